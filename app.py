@@ -1,52 +1,144 @@
 import os
 from typing import List
 from pathlib import Path
-from pdf2image import convert_from_path
 
 import streamlit as st
+from dotenv import load_dotenv
 from streamlit.runtime.uploaded_file_manager import UploadedFile
 
-from utils.parse_pdf import parse_doc
-from utils.retrieval import retrieve, synthesis_response
-from utils.embedding import create_nodes, build_corpus, load_corpus, list_collections
+from utils.jobs import FINISHED_STATUSES
+from utils.preview import page_count, render_page
+from utils.service_client import ServiceClient, ServiceError
+
+load_dotenv()
+service_url = os.getenv("SERVICE_URL", "")
 
 __dir__ = os.path.dirname(os.path.abspath(__file__))
 pdf_dir = "pdf_docs"
 persist_dir = Path(__dir__) / "chroma_storage"
 parse_output_dir = Path(__dir__) / pdf_dir / "parse_results"
+if service_url:
+    # 页面只作为service.py的客户端, 索引、模型和入库任务都在服务进程中
+    service = ServiceClient(service_url)
+else:
+    service = None
+    from utils.jobs import get_job_manager
+    from utils.retrieval import retrieve, synthesis_response
+    from utils.request_models import VLMStream
+    from utils.embedding import load_corpus, load_retriever, load_multi_retriever, list_collections, get_embed_model
+    from utils.answer_cache import answer_cache, cache_scope
+    from utils.metrics import span, trace, start_metrics_server
+    start_metrics_server() # 设置了METRICS_PORT时提供Prometheus指标
+    job_manager = get_job_manager(db_path=persist_dir / "ingest_jobs.db", parse_output_dir=parse_output_dir, persist_dir=persist_dir)
 
 def build_knowledge_base(uploaded_files: List[UploadedFile]) -> List[Path]:
+    '''
+    保存上传的文件并提交后台入库任务, 返回解析结果的输出目录
+    '''
     if not os.path.exists(pdf_dir):
         os.makedirs(pdf_dir)
+    output_path_list = [] # 解析结果输出目录
     for file in uploaded_files:
+        if not file.name.endswith(".pdf"):
+            continue
+        if service is not None:
+            try:
+                result = service.ingest(file.name, file.getvalue())
+            except Exception as e:
+                st.error(f"提交文件 {file.name} 失败: {e}")
+                continue
+            output_path_list.append(Path(result["output_path"]))
+            continue
         try:
-            file_path = os.path.join(pdf_dir, file.name)
+            file_path = Path(__dir__) / pdf_dir / file.name
             with open(file_path, "wb") as f:
                 f.write(file.getbuffer())
         except Exception as e:
             st.error(f"加载文件 {file.name} 失败: {e}")
-
-    doc_path_list = []
-    if file.name.endswith(".pdf"):
-        doc_path_list.append(Path(__dir__) / pdf_dir / file.name)
-    # pdf解析
-    parse_doc(path_list=doc_path_list, output_dir=parse_output_dir)
-    output_path_list = [] # 解析结果输出目录
-    for doc_path in doc_path_list:
-        output_path = Path(parse_output_dir / doc_path.stem / "auto")
-        output_path_list.append(output_path)
-    # 文档切分
-    nodes_list = create_nodes(parsed_result_path_list=output_path_list)
-    # 嵌入
-    build_corpus(nodes_list=nodes_list, persist_dir=persist_dir)
+            continue
+        # 解析、切分和嵌入在后台工作进程中执行
+        job_manager.submit(file_path)
+        output_path_list.append(Path(parse_output_dir / file_path.stem / "auto"))
 
     return output_path_list
 
+def _format_latency(spans) -> str:
+    return " | ".join(f"{stage} {seconds * 1000:.0f}ms" for stage, seconds in spans)
+
+def answer_local(question: str):
+    '''
+    在页面进程内检索并生成回答, 返回(回答, 是否命中缓存, 耗时分解), 知识库加载失败时返回None
+    '''
+    if len(st.session_state.collections) == 1:
+        retriever = load_retriever(corpus_name=st.session_state.collections[0], persist_dir=persist_dir)
+    else:
+        retriever = load_multi_retriever(corpus_names=st.session_state.collections, persist_dir=persist_dir)
+    if retriever is None:
+        return None
+    embed_model = get_embed_model()
+    with trace() as spans:
+        # 相同或相近的问题直接使用缓存的回答
+        scope, version = cache_scope(st.session_state.collections, persist_dir)
+        with span("embed_query"):
+            query_embedding = embed_model.get_query_embedding(question)
+        answer = answer_cache.lookup(scope, version, query_embedding)
+        cached = answer is not None
+        with st.chat_message("assistant"):
+            if cached:
+                st.write(answer)
+                st.caption("⚡ 缓存的回答")
+            else:
+                nodes = retrieve(query=question, retriever=retriever)
+                response = synthesis_response(
+                    query=question, nodes=nodes, stream=True,
+                    query_embedding=query_embedding
+                )
+                if isinstance(response, VLMStream):
+                    # 边生成边显示, 页面中断时关闭上游连接
+                    try:
+                        answer = st.write_stream(response)
+                    finally:
+                        response.close()
+                    st.caption(f"首字耗时 {response.time_to_first_token or 0:.2f}s, 总耗时 {response.total_latency:.2f}s")
+                    answer_cache.store(scope, version, query_embedding, answer)
+                else:
+                    answer = response
+                    st.write(answer)
+            latency = _format_latency(spans)
+            if st.session_state.show_latency and latency:
+                st.caption(latency)
+    return answer, cached, latency
+
+def answer_remote(question: str):
+    '''
+    通过service.py流式获取回答, 返回(回答, 是否命中缓存, 耗时分解)
+    '''
+    with st.chat_message("assistant"):
+        try:
+            response = service.query_stream(question, st.session_state.collections)
+            try:
+                answer = st.write_stream(response)
+            finally:
+                response.close()
+        except ServiceError as e:
+            st.error(f"请求服务失败: {e}")
+            return f"请求服务失败: {e}", False, ""
+        if response.cached:
+            st.caption("⚡ 缓存的回答")
+        else:
+            st.caption(f"首字耗时 {response.time_to_first_token or 0:.2f}s, 总耗时 {response.total_latency:.2f}s")
+        latency = _format_latency(response.latency)
+        if st.session_state.show_latency and latency:
+            st.caption(latency)
+    return answer, response.cached, latency
+
 # 初始化session state
 if 'history' not in st.session_state:
     st.session_state.history = []
-if 'retriever' not in st.session_state:
-    st.session_state.retriever = None
+if 'collections' not in st.session_state:
+    st.session_state.collections = [] # 当前会话使用的知识库, 检索器由进程内的注册表共享
+if 'show_latency' not in st.session_state:
+    st.session_state.show_latency = False
 if 'output_path_list' not in st.session_state:
     st.session_state.output_path_list = None
 
@@ -71,16 +163,24 @@ with col1:
         if msg["role"] == "user":
             st.chat_message("user").write(msg["content"])
         else:
-            st.chat_message("assistant").write(msg["content"])
+            with st.chat_message("assistant"):
+                st.write(msg["content"])
+                if msg.get("cached"):
+                    st.caption("⚡ 缓存的回答")
+                if st.session_state.show_latency and msg.get("latency"):
+                    st.caption(msg["latency"])
 
     # 用户输入
     if question := st.chat_input("请输入您的问题..."):
         st.session_state.history.append({"role": "user", "content": question})
-        if st.session_state.retriever is not None:
-            nodes = retrieve(query=question, retriever=st.session_state.retriever)
-            response = synthesis_response(query=question, nodes=nodes)
-            st.session_state.history.append({"role": "assistant", "content": response})
-        st.rerun()
+        st.chat_message("user").write(question)
+        answer_question = answer_remote if service is not None else answer_local
+        result = answer_question(question) if st.session_state.collections else None
+        if result is not None:
+            answer, cached, latency = result
+            st.session_state.history.append({"role": "assistant", "content": answer, "cached": cached, "latency": latency})
+
+    st.toggle("显示耗时分解", key="show_latency")
 
     if st.button("清除对话"):
         st.session_state.history = []
@@ -91,24 +191,26 @@ with col1:
     st.subheader("📚 加载知识库")
 
     try:
-        collections = list_collections(persist_dir=persist_dir)
-        selected_collection = st.selectbox(
+        collections = service.list_collections() if service is not None else list_collections(persist_dir=persist_dir)
+        selected_collections = st.multiselect(
             "选择知识库",
             options=collections,
-            help="选择要使用的知识库"
+            default=[c for c in st.session_state.collections if c in collections],
+            help="选择要使用的知识库, 可多选"
         )
 
         if st.button("加载知识库"):
-            if selected_collection:
-                with st.spinner(f"正在加载 {selected_collection}..."):
-                    # 调用load_corpus函数加载选中的collection
+            if selected_collections:
+                with st.spinner(f"正在加载 {', '.join(selected_collections)}..."):
+                    # 加载选中的collection, 索引和检索器在进程内缓存
                     try:
-                        loaded_index = load_corpus(corpus_name=selected_collection, persist_dir=persist_dir)
-                        st.session_state.retriever = loaded_index.as_retriever(
-                            similarity_top_k=5,
-                            vector_store_query_mode="default",
-                        )
-                        st.success(f"加载知识库: {selected_collection} 成功")
+                        for selected_collection in selected_collections:
+                            if service is not None: # 服务端在首次查询时加载
+                                continue
+                            if load_corpus(corpus_name=selected_collection, persist_dir=persist_dir) is None:
+                                raise ValueError(f"集合{selected_collection}不存在")
+                        st.session_state.collections = selected_collections
+                        st.success(f"加载知识库: {', '.join(selected_collections)} 成功")
                     except Exception as e:
                         st.error(f"加载知识库失败: {e}")
 
@@ -136,17 +238,50 @@ with col2:
 
         with col_btn1:
             if st.button("开始解析", type="primary"):
-                with st.spinner("正在解析PDF..."):
-                    output_path_list = build_knowledge_base(uploaded_files=uploaded_files)
-                    # 解析成功后，保存PDF文件信息用于预览
-                    st.session_state.output_path_list = output_path_list
-                    st.success("PDF解析完成！")
+                output_path_list = build_knowledge_base(uploaded_files=uploaded_files)
+                # 保存PDF文件信息用于预览, 解析完成后可以查看
+                st.session_state.output_path_list = output_path_list
+                st.success("已提交解析任务, 可在下方查看进度")
 
         with col_btn2:
             if st.button("清除结果"):
                 st.session_state.output_path_list = None
                 st.rerun()
 
+    # 入库任务进度, 定时刷新, 不阻塞对话
+    @st.fragment(run_every=2)
+    def show_jobs():
+        try:
+            jobs = service.list_jobs(limit=10) if service is not None else job_manager.queue.list_jobs(limit=10)
+        except Exception as e:
+            st.warning(f"获取入库任务失败: {e}")
+            return
+        if not jobs:
+            return
+        st.markdown("---")
+        st.subheader("⏳ 入库任务")
+        stage_names = {"parse": "解析页面", "caption": "描述图片", "embed": "嵌入节点"}
+        for job in jobs:
+            file_name = Path(job["file_path"]).name
+            col_job, col_cancel = st.columns([4, 1])
+            with col_job:
+                st.write(f"📄 {file_name}: {job['status']}")
+                for stage, stage_name in stage_names.items():
+                    progress = job["progress"].get(stage)
+                    if progress and progress["total"]:
+                        st.progress(
+                            progress["done"] / progress["total"],
+                            text=f"{stage_name} {progress['done']}/{progress['total']}"
+                        )
+                if job["error"]:
+                    st.error(job["error"])
+            with col_cancel:
+                if job["status"] not in FINISHED_STATUSES and not job["cancel_requested"]:
+                    if st.button("取消", key=f"cancel_{job['id']}"):
+                        (service or job_manager.queue).cancel(job["id"])
+
+    show_jobs()
+
     # PDF预览区域
     if st.session_state.output_path_list:
         st.markdown("---")
@@ -154,10 +289,14 @@ with col2:
         for output_path in st.session_state.output_path_list:
             pdf_name = output_path.as_posix().split("/")[-2]
             with st.expander(f"📄 {pdf_name}", expanded=True):
+                if not (output_path / "parse_manifest.json").exists():
+                    st.info("解析尚未完成")
+                    continue
                 try:
-                    # 转换PDF页面为图片（只转换前几页以提高性能）
-                    images = convert_from_path(output_path / (pdf_name + "_layout.pdf"), first_page=1, last_page=5)
-                    num_pages = len(images)
+                    # lean模式的解析不生成版面PDF, 首次预览时再绘制
+                    from utils.parse_pdf import ensure_layout_pdf
+                    layout_pdf = ensure_layout_pdf(output_path, pdf_name, Path(__dir__) / pdf_dir / (pdf_name + ".pdf"))
+                    num_pages = page_count(layout_pdf)
 
                     if num_pages > 0:
                         # 创建页码选择器
@@ -167,10 +306,10 @@ with col2:
                             key=f"page_select_{pdf_name}"
                         )
 
-                        # 显示选中页面的图片
+                        # 只渲染选中的页面, 缩略图缓存在磁盘上
                         if page_num:
                             st.image(
-                                images[page_num - 1], 
+                                render_page(layout_pdf, page_num),
                                 caption=f"第 {page_num} 页",
                                 width="stretch"
                             )
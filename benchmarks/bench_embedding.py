@@ -0,0 +1,124 @@
+'''
+嵌入后端的吞吐对比(节点/秒), 不经过嵌入缓存
+    dashscope-legacy: 原先的llama_index DashScopeEmbedding, 每批10条, 批次串行(需另行安装llama-index-embeddings-dashscope)
+    dashscope:        utils.embed_backends的DashScope后端, 按--batch-sizes和--concurrency组合测试
+    hashing:          本地特征哈希
+    onnx:             本地ONNX模型, 设置了EMBED_ONNX_MODEL_DIR时测试
+远程后端默认请求本地替身服务(stub_server.py, 延迟可配置), --real时请求.env中配置的DashScope
+
+用法:
+    python benchmarks/bench_embedding.py [--nodes 500] [--latency 0.1] [--batch-sizes 5 10 25] [--concurrency 1 4]
+    python benchmarks/bench_embedding.py --content-lists pdf_docs/parse_results --max-batch 10
+'''
+import os
+import sys
+import gzip
+import json
+import time
+import random
+import argparse
+import subprocess
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+_WORDS = (
+    "模型 推理 强化学习 奖励 训练 数据 蒸馏 基准 准确率 参数 上下文 检索 向量 表格 公式 图片 "
+    "reasoning reward policy distillation benchmark accuracy token context latency throughput"
+).split()
+
+
+def synthetic_texts(count: int, seed: int) -> list:
+    rng = random.Random(seed)
+    return [" ".join(rng.choice(_WORDS) for _ in range(rng.randint(20, 300))) for _ in range(count)]
+
+def load_texts(paths: list) -> list:
+    texts = []
+    for path in map(Path, paths):
+        files = [path] if path.is_file() else list(path.rglob("*_content_list.json")) + list(path.rglob("*_content_list.json.gz"))
+        for file in files:
+            with (gzip.open if file.suffix == ".gz" else open)(file, "rt", encoding="utf-8") as f:
+                texts.extend(c["text"] for c in json.load(f) if c.get("type") == "text" and c.get("text"))
+    return texts
+
+def start_stub_server(args) -> tuple:
+    command = [
+        sys.executable, str(Path(__file__).resolve().parent / "stub_server.py"),
+        "--latency", str(args.latency), "--max-batch", str(args.max_batch),
+    ]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    url = process.stdout.readline().strip()
+    if not url.startswith("http"):
+        process.kill()
+        raise RuntimeError("替身服务启动失败")
+    return process, url
+
+def measure(embed_model, texts: list, repeat: int) -> float:
+    '''
+    返回最好一次的吞吐(节点/秒)
+    '''
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        vectors = embed_model.get_text_embedding_batch(texts)
+        best = min(best, time.perf_counter() - start)
+        assert len(vectors) == len(texts) and all(vectors), "嵌入结果数量不一致"
+    return len(texts) / best
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--nodes", type=int, default=500, help="随机生成的文本数量")
+    parser.add_argument("--content-lists", nargs="*", default=[], help="使用MinerU解析结果中的文本")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=2)
+    parser.add_argument("--batch-sizes", type=int, nargs="*", default=[5, 10, 25])
+    parser.add_argument("--concurrency", type=int, nargs="*", default=[1, 4])
+    parser.add_argument("--latency", type=float, default=0.1, help="替身服务每个请求的延迟(秒)")
+    parser.add_argument("--max-batch", type=int, default=0, help="替身服务每批最多的文本数, 超出时返回400")
+    parser.add_argument("--real", action="store_true", help="请求真实的DashScope而不是替身服务")
+    args = parser.parse_args()
+
+    texts = load_texts(args.content_lists) if args.content_lists else synthetic_texts(args.nodes, args.seed)
+    process = None
+    if not args.real:
+        process, url = start_stub_server(args)
+        os.environ.update({
+            "DASHSCOPE_API_KEY": "stub",
+            "DASHSCOPE_HTTP_BASE_URL": f"{url}/api/v1",
+            "DASHSCOPE_TEXT_EMBED_MODEL_NAME": "stub-embed",
+        })
+    sys.path.insert(0, str(ROOT))
+    from utils.embed_backends import create_embed_backend
+
+    model_name = os.getenv("DASHSCOPE_TEXT_EMBED_MODEL_NAME")
+    results = []
+    try:
+        print(f"文本数量: {len(texts)}")
+        try:
+            from llama_index.embeddings.dashscope import DashScopeEmbedding
+        except ImportError:
+            print("未安装llama-index-embeddings-dashscope, 跳过dashscope-legacy")
+        else:
+            legacy = DashScopeEmbedding(model_name=model_name, api_key=os.getenv("DASHSCOPE_API_KEY"), embed_batch_size=10)
+            results.append(("dashscope-legacy", "batch=10 串行", measure(legacy, texts, args.repeat)))
+        for batch_size in args.batch_sizes:
+            for concurrency in args.concurrency:
+                backend = create_embed_backend("dashscope", batch_size=batch_size, max_concurrency=concurrency)
+                rate = measure(backend, texts, args.repeat)
+                label = f"batch={batch_size} 并发={concurrency}"
+                if args.max_batch and batch_size > args.max_batch:
+                    label += f" (自适应调整为{backend._batch_size})"
+                results.append(("dashscope", label, rate))
+        results.append(("hashing", "本地", measure(create_embed_backend("hashing"), texts, args.repeat)))
+        if os.getenv("EMBED_ONNX_MODEL_DIR"):
+            results.append(("onnx", Path(os.getenv("EMBED_ONNX_MODEL_DIR")).name, measure(create_embed_backend("onnx"), texts, args.repeat)))
+    finally:
+        if process is not None:
+            process.kill()
+
+    baseline = results[0][2]
+    for backend, label, rate in results:
+        print(f"{backend:<18}{label:<32}{rate:>10.1f} 节点/秒{rate / baseline:>8.1f}x")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,214 @@
+'''
+html表格转markdown的一致性检查和性能对比
+以原先基于BeautifulSoup的实现为基准, 检查utils.html_table在同一批表格上的输出逐字一致, 并比较耗时
+表格来自MinerU解析结果中的table_body(--corpus指定目录或content list文件), 另外随机生成覆盖
+rowspan/colspan、实体字符、嵌套标签、未闭合标签等情况的表格
+
+用法: python benchmarks/bench_html_table.py [--corpus pdf_docs/parse_results] [--samples 500] [--repeat 3]
+'''
+import io
+import sys
+import gzip
+import json
+import time
+import random
+import argparse
+from pathlib import Path
+from contextlib import redirect_stdout
+
+from bs4 import BeautifulSoup
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from utils.html_table import html_table_to_markdown
+
+
+def reference_html_table_to_markdown(html_table):
+    '''
+    html格式的表格表格解析为markdown
+    '''
+    try:
+        # 使用 BeautifulSoup 解析 HTML
+        soup = BeautifulSoup(html_table.strip(), 'html.parser')
+        table = soup.find('table')
+        if not table:
+            raise ValueError("No <table> found in the HTML.")
+
+        # 初始化存储表格内容的矩阵
+        rows = []
+        max_cols = 0
+
+        # 解析所有行
+        for row in table.find_all('tr'):
+            cells = []
+            for cell in row.find_all(['td', 'th']):
+                rowspan = int(cell.get('rowspan', 1))  # 获取 rowspan
+                colspan = int(cell.get('colspan', 1))  # 获取 colspan
+                text = cell.get_text(strip=True)  # 获取单元格内容
+
+                # 填充矩阵，支持跨行或跨列的单元格
+                for _ in range(colspan):
+                    cells.append({'text': text, 'rowspan': rowspan})
+            rows.append(cells)
+            max_cols = max(max_cols, len(cells))  # 更新列数
+
+        # 扩展矩阵，处理 rowspan 占用的单元格
+        expanded_rows = []
+        rowspan_tracker = [0] * max_cols  # 追踪每列的 rowspan
+        for row in rows:
+            expanded_row = []
+            col_idx = 0
+            for cell in row:
+                # 跳过因 rowspan 导致的占位列
+                while col_idx < max_cols and rowspan_tracker[col_idx] > 0:
+                    expanded_row.append(None)
+                    rowspan_tracker[col_idx] -= 1
+                    col_idx += 1
+
+                # 添加当前单元格
+                expanded_row.append(cell['text'])
+                # 更新 rowspan 追踪器
+                if cell['rowspan'] > 1:
+                    rowspan_tracker[col_idx] = cell['rowspan'] - 1
+                col_idx += 1
+
+            # 补全因 rowspan 导致的剩余占位符
+            while col_idx < max_cols:
+                if rowspan_tracker[col_idx] > 0:
+                    expanded_row.append(None)
+                    rowspan_tracker[col_idx] -= 1
+                else:
+                    expanded_row.append("")
+                col_idx += 1
+
+            expanded_rows.append(expanded_row)
+
+        # 将第一行视为表头
+        headers = expanded_rows[0]
+        body_rows = expanded_rows[1:]
+
+        # 生成 Markdown 表格
+        markdown = ''
+        if headers:
+            markdown += '| ' + ' | '.join(h if h else '' for h in headers) + ' |\n'
+            markdown += '| ' + ' | '.join(['-' * (len(h) if h else 3) for h in headers]) + ' |\n'
+        for row in body_rows:
+            markdown += '| ' + ' | '.join(cell if cell else '' for cell in row) + ' |\n'
+
+        return markdown
+
+    except Exception as e:
+        print(f"Error parsing table: {e}")
+        return ''
+
+
+_WORDS = ["型号", "参数", "Vdd", "3.3V", "温度", "-40~85°C", "a &amp; b", "&lt;1ms", "&nbsp;", "", "  padded  ", "典型值", "Max", "1,024"]
+
+def _random_cell(rng: random.Random, tag: str) -> str:
+    attrs = ""
+    if rng.random() < 0.15:
+        attrs += f' rowspan="{rng.randint(2, 4)}"'
+    if rng.random() < 0.15:
+        attrs += f' colspan="{rng.randint(2, 3)}"'
+    text = rng.choice(_WORDS)
+    roll = rng.random()
+    if roll < 0.1:
+        text = f"<b>{text}</b> {rng.choice(_WORDS)}"
+    elif roll < 0.15:
+        text = f"{text}<br>{rng.choice(_WORDS)}"
+    elif roll < 0.18:
+        text = f"<!-- note -->{text}"
+    elif roll < 0.2:
+        text = f"<script>var x = 1;</script>{text}<style>.c {{}}</style>"
+    elif roll < 0.22:
+        text = f"<![CDATA[{rng.choice(_WORDS)}]]>{text}"
+    return f"<{tag}{attrs}>{text}</{tag}>"
+
+def synthetic_tables(count: int, seed: int = 0) -> list:
+    '''
+    随机生成MinerU风格的表格, 少量样本带有嵌套表格、未闭合标签或不合法的属性
+    '''
+    rng = random.Random(seed)
+    tables = []
+    for _ in range(count):
+        n_rows, n_cols = rng.randint(1, 40), rng.randint(1, 12)
+        rows = []
+        for r in range(n_rows):
+            tag = "th" if r == 0 and rng.random() < 0.3 else "td"
+            rows.append("<tr>" + "".join(_random_cell(rng, tag) for _ in range(n_cols)) + "</tr>")
+        html = "<table>" + "".join(rows) + "</table>"
+        roll = rng.random()
+        if roll < 0.03:
+            html = html.replace("</td>", "", 3) # 未闭合的单元格
+        elif roll < 0.05:
+            html = html.replace("</td>", "<table><tr><td>inner</td></tr></table></td>", 1) # 嵌套表格
+        elif roll < 0.06:
+            html = html.replace("<td>", '<td rowspan="x">', 1) # 不合法的属性
+        elif roll < 0.07:
+            html = "<div>" + html.replace("</tr>", "</div></tr>", 1) + "</div>" # 表格外的标签提前闭合
+        elif roll < 0.08:
+            html = "<p>no table here</p>"
+        elif roll < 0.09:
+            html = "<table></table>"
+        tables.append("<html><body>" + html + "</body></html>")
+    return tables
+
+def load_corpus(paths: list) -> list:
+    '''
+    从MinerU的content list(.json或.json.gz)中读取所有table_body
+    '''
+    files = []
+    for path in map(Path, paths):
+        if path.is_dir():
+            files.extend(path.rglob("*_content_list.json"))
+            files.extend(path.rglob("*_content_list.json.gz"))
+        else:
+            files.append(path)
+    tables = []
+    for file in files:
+        with (gzip.open if file.suffix == ".gz" else open)(file, "rt", encoding="utf-8") as f:
+            tables.extend(
+                content["table_body"] for content in json.load(f)
+                if content.get("type") == "table" and content.get("table_body")
+            )
+    return tables
+
+def _time(func, tables: list, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for table in tables:
+            func(table)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--corpus", nargs="*", default=[], help="MinerU解析结果目录或content list文件")
+    parser.add_argument("--samples", type=int, default=500, help="随机生成的表格数量")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus)
+    tables = corpus + synthetic_tables(args.samples, args.seed)
+    print(f"表格数量: {len(tables)} (解析结果 {len(corpus)}, 随机生成 {len(tables) - len(corpus)})")
+
+    with redirect_stdout(io.StringIO()): # 两种实现在解析失败时都会打印错误
+        mismatches = [
+            table for table in tables
+            if reference_html_table_to_markdown(table) != html_table_to_markdown(table)
+        ]
+        reference_time = _time(reference_html_table_to_markdown, tables, args.repeat)
+        streaming_time = _time(html_table_to_markdown, tables, args.repeat)
+
+    print(f"BeautifulSoup: {reference_time * 1000:.1f} ms, {reference_time / len(tables) * 1e6:.1f} us/表格")
+    print(f"HTMLParser:    {streaming_time * 1000:.1f} ms, {streaming_time / len(tables) * 1e6:.1f} us/表格")
+    print(f"加速比: {reference_time / streaming_time:.2f}x")
+    if mismatches:
+        print(f"输出不一致的表格: {len(mismatches)}")
+        print(mismatches[0])
+        sys.exit(1)
+    print("输出全部一致")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+'''
+向量库检索的召回率和延迟对比: Chroma与utils.mmap_store的MmapVectorStore(float16/int8, 暴力扫描/IVF)
+使用带聚类结构的合成向量, 以float32精确检索的结果作为标准答案计算recall@k
+    build: 写入耗时
+    open:  打开集合并完成第一次查询的耗时
+    p50/p95: 单条查询的延迟
+
+用法:
+    python benchmarks/bench_vector_store.py [--nodes 50000] [--dim 1024] [--queries 200] [--top-k 5] [--nprobe 4 16 64]
+'''
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def synthetic_vectors(count: int, dim: int, clusters: int, seed: int) -> np.ndarray:
+    '''
+    围绕clusters个随机中心生成的向量, 模拟文档嵌入按主题聚集的分布
+    '''
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    labels = rng.integers(clusters, size=count)
+    vectors = centers[labels] + 0.6 * rng.standard_normal((count, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+def ground_truth(vectors: np.ndarray, queries: np.ndarray, top_k: int) -> np.ndarray:
+    scores = queries @ vectors.T
+    return np.argsort(-scores, axis=1)[:, :top_k]
+
+def recall(results: list, truth: np.ndarray) -> float:
+    hits = sum(len(set(result) & set(expected)) for result, expected in zip(results, truth.tolist()))
+    return hits / truth.size
+
+def make_nodes(vectors: np.ndarray) -> list:
+    from llama_index.core.schema import TextNode
+    return [TextNode(id_=str(row), text=f"node {row}", embedding=vector.tolist()) for row, vector in enumerate(vectors)]
+
+def run_queries(search, queries: np.ndarray) -> tuple:
+    results, latencies = [], []
+    for query in queries:
+        start = time.perf_counter()
+        results.append(search(query))
+        latencies.append(time.perf_counter() - start)
+    return results, latencies
+
+def bench_chroma(work_dir: Path, vectors: np.ndarray, queries: np.ndarray, top_k: int) -> tuple:
+    import chromadb
+
+    client = chromadb.PersistentClient(path=str(work_dir / "chroma"))
+    collection = client.create_collection("bench", metadata={"hnsw:space": "cosine"})
+    start = time.perf_counter()
+    batch_size = client.get_max_batch_size()
+    for batch_start in range(0, len(vectors), batch_size):
+        batch = vectors[batch_start:batch_start + batch_size]
+        collection.add(ids=[str(row) for row in range(batch_start, batch_start + len(batch))], embeddings=batch.tolist())
+    build = time.perf_counter() - start
+    del collection, client
+
+    start = time.perf_counter()
+    collection = chromadb.PersistentClient(path=str(work_dir / "chroma")).get_collection("bench")
+    collection.query(query_embeddings=[queries[0].tolist()], n_results=top_k)
+    open_seconds = time.perf_counter() - start
+
+    search = lambda query: [int(i) for i in collection.query(query_embeddings=[query.tolist()], n_results=top_k, include=[])["ids"][0]]
+    return build, open_seconds, run_queries(search, queries)
+
+def bench_mmap(store_dir: Path, nodes: list, queries: np.ndarray, top_k: int, dtype: str, ivf: bool, nprobes: list) -> list:
+    from utils.mmap_store import MmapVectorStore
+
+    ivf_min_nodes = 1 if ivf else 0
+    start = time.perf_counter()
+    store = MmapVectorStore(store_dir, dtype=dtype, ivf_min_nodes=ivf_min_nodes)
+    store.add(nodes)
+    store.commit()
+    build = time.perf_counter() - start
+    del store
+
+    rows = []
+    for nprobe in (nprobes if ivf else [0]):
+        start = time.perf_counter()
+        store = MmapVectorStore(store_dir, dtype=dtype, ivf_min_nodes=ivf_min_nodes, nprobe=nprobe)
+        store.search(queries[0], top_k)
+        open_seconds = time.perf_counter() - start
+        search = lambda query: [int(store.node_ids()[row]) for row in store.search(query, top_k)[0]]
+        label = f"mmap {dtype} " + (f"ivf nprobe={nprobe}" if ivf else "flat")
+        rows.append((label, build, open_seconds, run_queries(search, queries)))
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--nodes", type=int, default=50000)
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--clusters", type=int, default=200, help="合成数据的主题数")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--nprobe", type=int, nargs="*", default=[4, 16, 64])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--skip-chroma", action="store_true")
+    args = parser.parse_args()
+
+    sys.path.insert(0, str(ROOT))
+    data = synthetic_vectors(args.nodes + args.queries, args.dim, args.clusters, args.seed)
+    vectors, queries = data[:args.nodes], data[args.nodes:]
+    truth = ground_truth(vectors, queries, args.top_k)
+    nodes = make_nodes(vectors)
+    print(f"节点数: {args.nodes}, 维度: {args.dim}, 查询数: {args.queries}, top_k: {args.top_k}")
+
+    work_dir = Path(tempfile.mkdtemp(prefix="bench_vector_store_"))
+    rows = []
+    try:
+        if not args.skip_chroma:
+            build, open_seconds, measured = bench_chroma(work_dir, vectors, queries, args.top_k)
+            rows.append(("chroma hnsw", build, open_seconds, measured))
+        for dtype in ("float16", "int8"):
+            for ivf in (False, True):
+                rows.extend(bench_mmap(
+                    work_dir / f"mmap-{dtype}-{'ivf' if ivf else 'flat'}", nodes, queries,
+                    args.top_k, dtype, ivf, args.nprobe
+                ))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print(f"{'':<28}{'recall@' + str(args.top_k):>10}{'p50':>10}{'p95':>10}{'open':>10}{'build':>10}")
+    for label, build, open_seconds, (results, latencies) in rows:
+        print(
+            f"{label:<28}{recall(results, truth):>10.3f}"
+            f"{np.percentile(latencies, 50) * 1000:>8.2f}ms{np.percentile(latencies, 95) * 1000:>8.2f}ms"
+            f"{open_seconds * 1000:>8.0f}ms{build:>9.1f}s"
+        )
+
+if __name__ == '__main__':
+    main()
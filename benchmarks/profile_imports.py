@@ -0,0 +1,119 @@
+'''
+冷启动的导入耗时分析和回归检查, 每个入口在全新的子进程中导入, 不受本进程已导入模块的影响
+    query:  只做问答的进程(Streamlit页面本地模式、service.py、batch_qa)导入的模块
+    client: SERVICE_URL模式下Streamlit页面导入的模块
+输出各入口的导入耗时(取--repeat次中最好的一次), 以及python -X importtime统计的耗时最多的顶层包
+
+--check时做回归检查, 任一项不满足则以非零状态退出:
+    入口导入后不能加载LAZY_MODULES中的模块(它们应在第一次使用时才导入)
+    导入耗时不能超过--max-seconds
+
+用法:
+    python benchmarks/profile_imports.py [--entry query client] [--top 15]
+    python benchmarks/profile_imports.py --check --max-seconds 4
+'''
+import os
+import sys
+import json
+import argparse
+import subprocess
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+ENTRIES = {
+    "query": [
+        "utils.jobs", "utils.preview", "utils.metrics", "utils.request_models",
+        "utils.retrieval", "utils.embedding", "utils.answer_cache", "utils.batch_qa",
+    ],
+    "client": ["utils.jobs", "utils.preview", "utils.service_client"],
+}
+# 只在入库、第一次请求模型或打开Chroma集合时才需要的模块
+LAZY_MODULES = ["mineru", "openai", "chromadb", "llama_index.vector_stores.chroma", "utils.chroma_store", "dashscope", "onnxruntime"]
+
+_PROBE = '''
+import sys, time, json
+start = time.perf_counter()
+for name in sys.argv[1:]:
+    __import__(name)
+seconds = time.perf_counter() - start
+print(json.dumps({"seconds": seconds, "modules": sorted(sys.modules)}))
+'''
+
+
+def _env() -> dict:
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(ROOT), env.get("PYTHONPATH")]))
+    return env
+
+def measure(modules: list) -> dict:
+    '''
+    在新进程中导入modules, 返回耗时和导入后已加载的模块
+    '''
+    result = subprocess.run(
+        [sys.executable, "-c", _PROBE, *modules],
+        cwd=ROOT, env=_env(), capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"导入失败:\n{result.stderr.strip()}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def import_profile(modules: list) -> dict:
+    '''
+    python -X importtime的输出按顶层包汇总, 返回 包名 -> 累计耗时(秒)
+    '''
+    statement = "; ".join(f"import {name}" for name in modules)
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        cwd=ROOT, env=_env(), capture_output=True, text=True, check=True
+    )
+    lines = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if cumulative.strip().isdigit(): # 跳过表头
+            depth = (len(name) - len(name.lstrip())) // 2
+            lines.append((depth, name.strip().split(".")[0], int(cumulative) / 1e6))
+    # 子模块先于父模块输出, 倒序遍历时父模块在前; 只累计由其他包导入的那一层, 避免重复计算
+    packages, stack = {}, []
+    for depth, package, seconds in reversed(lines):
+        while stack and stack[-1][0] >= depth:
+            stack.pop()
+        if not stack or stack[-1][1] != package:
+            packages[package] = packages.get(package, 0.0) + seconds
+        stack.append((depth, package))
+    return packages
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--entry", nargs="*", default=list(ENTRIES), choices=list(ENTRIES))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--top", type=int, default=15, help="显示耗时最多的顶层包数量")
+    parser.add_argument("--check", action="store_true", help="回归检查, 不满足时以非零状态退出")
+    parser.add_argument("--max-seconds", type=float, default=0, help="--check时每个入口允许的最长导入耗时, 0表示不检查")
+    args = parser.parse_args()
+
+    failures = []
+    for entry in args.entry:
+        modules = ENTRIES[entry]
+        runs = [measure(modules) for _ in range(max(1, args.repeat))]
+        seconds = min(run["seconds"] for run in runs)
+        loaded = set(runs[0]["modules"])
+        eager = [name for name in LAZY_MODULES if name in loaded]
+        print(f"{entry}: 导入耗时{seconds:.2f}s, 已加载{len(loaded)}个模块" + (f", 提前导入了{', '.join(eager)}" if eager else ""))
+        if not args.check:
+            for package, package_seconds in sorted(import_profile(modules).items(), key=lambda item: -item[1])[:args.top]:
+                print(f"    {package:<32}{package_seconds:>8.3f}s")
+        if eager:
+            failures.append(f"{entry}导入时加载了{', '.join(eager)}")
+        if args.check and args.max_seconds > 0 and seconds > args.max_seconds:
+            failures.append(f"{entry}导入耗时{seconds:.2f}s, 超过{args.max_seconds:.2f}s")
+
+    if args.check:
+        for failure in failures:
+            print(f"失败: {failure}")
+        sys.exit(1 if failures else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,318 @@
+'''
+离线端到端基准: 用本地替身服务(stub_server.py)代替DashScope, 依次执行
+create_nodes -> build_corpus -> 回放问题(retrieve + synthesis_response流式生成)
+输出入库吞吐(节点/秒)、问题延迟的p50/p95/p99、首字耗时和峰值RSS, 结果以JSON保存在benchmarks/results/下,
+--compare可以和之前的结果对比
+
+用法:
+    python benchmarks/run_e2e.py                                     # 使用内置的合成文档
+    python benchmarks/run_e2e.py --content-lists pdf_docs/parse_results/deepseek-r1/auto
+    python benchmarks/run_e2e.py --latency 0.3 --queries queries.txt --compare latest
+每次运行使用全新的缓存目录和向量库, 结果不受之前运行的缓存影响(--cache-dir可以指定已有的缓存测热启动)
+'''
+import os
+import sys
+import json
+import time
+import gzip
+import random
+import shutil
+import socket
+import argparse
+import resource
+import tempfile
+import subprocess
+from pathlib import Path
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+FIXTURE_NAME = "bench_fixture"
+
+_WORDS = (
+    "模型 推理 强化学习 奖励 训练 数据 蒸馏 基准 准确率 参数 上下文 检索 向量 表格 公式 图片 "
+    "reasoning reward policy distillation benchmark accuracy token context latency throughput "
+    "GRPO MoE DeepSeek AIME MATH Codeforces GPQA"
+).split()
+
+
+def _sentence(rng: random.Random, length: int) -> str:
+    return " ".join(rng.choice(_WORDS) for _ in range(length)) + "。"
+
+def write_fixture(output_dir: Path, pages: int, seed: int = 0) -> Path:
+    '''
+    生成确定性的MinerU风格解析结果: 标题、段落、表格、公式和图片, 返回解析结果目录(<名称>/auto)
+    '''
+    from PIL import Image
+
+    rng = random.Random(seed)
+    parsed_dir = output_dir / FIXTURE_NAME / "auto"
+    image_dir = parsed_dir / "images"
+    image_dir.mkdir(parents=True, exist_ok=True)
+    content_list = []
+    for page in range(pages):
+        content_list.append({"type": "text", "text": f"第{page + 1}节 " + _sentence(rng, 4), "text_level": 1, "page_idx": page})
+        for _ in range(rng.randint(3, 8)):
+            content_list.append({"type": "text", "text": " ".join(_sentence(rng, rng.randint(8, 30)) for _ in range(3)), "page_idx": page})
+        if page % 3 == 0:
+            rows = "".join(
+                "<tr>" + "".join(f"<td>{rng.choice(_WORDS)} {rng.randint(0, 100)}</td>" for _ in range(5)) + "</tr>"
+                for _ in range(rng.randint(3, 20))
+            )
+            content_list.append({
+                "type": "table", "table_body": f"<table>{rows}</table>", "table_caption": [f"表{page}: " + _sentence(rng, 5)],
+                "table_footnote": [], "img_path": f"images/table_{page}.jpg", "page_idx": page,
+            })
+        if page % 4 == 1:
+            content_list.append({"type": "equation", "text": f"$$L_{{{page}}} = \\sum_i r_i \\log \\pi(a_i)$$",
+                                 "text_format": "latex", "img_path": f"images/eq_{page}.jpg", "page_idx": page})
+        if page % 5 == 2:
+            image_name = f"images/figure_{page}.jpg"
+            Image.new("RGB", (rng.randint(400, 1600), rng.randint(300, 1200)), tuple(rng.randint(0, 255) for _ in range(3))) \
+                .save(parsed_dir / image_name, quality=90)
+            content_list.append({"type": "image", "img_path": image_name, "image_caption": [f"图{page}: " + _sentence(rng, 6)],
+                                 "image_footnote": [], "page_idx": page})
+    with open(parsed_dir / f"{FIXTURE_NAME}_content_list.json", "w", encoding="utf-8") as f:
+        json.dump(content_list, f, ensure_ascii=False)
+    return parsed_dir
+
+def copy_content_lists(paths: list, output_dir: Path) -> list:
+    '''
+    把已有的解析结果(<名称>/auto目录或content list文件)复制到临时目录, 返回各文件的解析结果目录
+    '''
+    parsed_dirs = []
+    for path in map(Path, paths):
+        if path.is_file():
+            path = path.parent
+        stem = path.parent.name
+        target = output_dir / stem / "auto"
+        shutil.copytree(path, target, ignore=shutil.ignore_patterns("*.pdf", ".checkpoints"))
+        parsed_dirs.append(target)
+    return parsed_dirs
+
+def load_queries(path: str, parsed_dirs: list, count: int, seed: int) -> list:
+    '''
+    读取问题文件(每行一个问题, 或JSONL中的query字段); 未指定时从文档段落中截取
+    '''
+    if path:
+        queries = []
+        for line in Path(path).read_text(encoding="utf-8").splitlines():
+            line = line.strip()
+            if line:
+                queries.append(json.loads(line)["query"] if line.startswith("{") else line)
+        return queries
+    texts = []
+    for parsed_dir in parsed_dirs:
+        for file in list(parsed_dir.glob("*_content_list.json")) + list(parsed_dir.glob("*_content_list.json.gz")):
+            with (gzip.open if file.suffix == ".gz" else open)(file, "rt", encoding="utf-8") as f:
+                texts.extend(c["text"] for c in json.load(f) if c.get("type") == "text" and len(c.get("text", "")) > 20)
+    rng = random.Random(seed)
+    return [rng.choice(texts)[:60] for _ in range(count)] if texts else ["What is the main contribution?"] * count
+
+def start_stub_server(args) -> tuple:
+    command = [
+        sys.executable, str(Path(__file__).resolve().parent / "stub_server.py"),
+        "--latency", str(args.latency), "--jitter", str(args.jitter),
+        "--token-latency", str(args.token_latency), "--answer-tokens", str(args.answer_tokens),
+        "--dim", str(args.dim),
+    ]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    url = process.stdout.readline().strip()
+    if not url.startswith("http"):
+        process.kill()
+        raise RuntimeError("替身服务启动失败")
+    return process, url
+
+def percentiles(values: list) -> dict:
+    if not values:
+        return {"p50": None, "p95": None, "p99": None, "mean": None}
+    array = np.asarray(values, dtype=np.float64)
+    return {
+        "p50": float(np.percentile(array, 50)),
+        "p95": float(np.percentile(array, 95)),
+        "p99": float(np.percentile(array, 99)),
+        "mean": float(array.mean()),
+    }
+
+def peak_rss_mb() -> float:
+    # Linux上ru_maxrss单位为KB, macOS上为字节
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024 / 1024 if sys.platform == "darwin" else rss / 1024
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except Exception:
+        return ""
+
+def run(args, url: str, work_dir: Path) -> dict:
+    # 替身服务的地址要在导入utils之前写入环境变量
+    os.environ.update({
+        "DASHSCOPE_API_KEY": "stub",
+        "DASHSCOPE_BASE_URL": f"{url}/v1",
+        "DASHSCOPE_HTTP_BASE_URL": f"{url}/api/v1",
+        "DASHSCOPE_VLM_MODEL_NAME": "stub-vlm",
+        "DASHSCOPE_LLM_MODEL_NAME": "stub-llm",
+        "DASHSCOPE_TEXT_EMBED_MODEL_NAME": "stub-embed",
+        "CACHE_DIR": str(args.cache_dir or work_dir / "cache"),
+    })
+    sys.path.insert(0, str(ROOT))
+    from utils.embedding import create_nodes, build_corpus, load_retriever, get_embed_model
+    from utils.retrieval import retrieve, synthesis_response
+    from utils.request_models import VLMStream
+    from utils.metrics import registry
+
+    parse_dir = work_dir / "parse_results"
+    if args.content_lists:
+        parsed_dirs = copy_content_lists(args.content_lists, parse_dir)
+    else:
+        parsed_dirs = [write_fixture(parse_dir, pages=args.pages, seed=args.seed)]
+    persist_dir = work_dir / "chroma_storage"
+
+    # 入库
+    start = time.perf_counter()
+    nodes_list = create_nodes(parsed_result_path_list=parsed_dirs)
+    create_seconds = time.perf_counter() - start
+    node_count = sum(len(nodes) for nodes in nodes_list)
+    start = time.perf_counter()
+    build_corpus(nodes_list=nodes_list, persist_dir=persist_dir)
+    build_seconds = time.perf_counter() - start
+    ingest_seconds = create_seconds + build_seconds
+
+    # 回放问题
+    collection = nodes_list[0][0].metadata["source_file"].split(".")[0]
+    retriever = load_retriever(corpus_name=collection, persist_dir=persist_dir)
+    embed_model = get_embed_model()
+    queries = load_queries(args.queries, parsed_dirs, args.num_queries, args.seed)
+
+    def answer(query: str) -> dict:
+        start = time.perf_counter()
+        query_embedding = embed_model.get_query_embedding(query)
+        nodes = retrieve(query=query, retriever=retriever)
+        retrieve_seconds = time.perf_counter() - start
+        response = synthesis_response(
+            query=query, nodes=nodes, stream=True, query_embedding=query_embedding
+        )
+        ttft = None
+        if isinstance(response, VLMStream):
+            try:
+                for _ in response:
+                    if ttft is None:
+                        ttft = time.perf_counter() - start
+            finally:
+                response.close()
+        return {"retrieve": retrieve_seconds, "ttft": ttft, "total": time.perf_counter() - start}
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        timings = list(executor.map(answer, queries))
+    replay_seconds = time.perf_counter() - start
+
+    return {
+        "ingest": {
+            "files": len(parsed_dirs),
+            "nodes": node_count,
+            "create_nodes_seconds": create_seconds,
+            "build_corpus_seconds": build_seconds,
+            "nodes_per_second": node_count / ingest_seconds if ingest_seconds > 0 else None,
+        },
+        "query": {
+            "count": len(queries),
+            "concurrency": args.concurrency,
+            "queries_per_second": len(queries) / replay_seconds if replay_seconds > 0 else None,
+            "retrieve": percentiles([t["retrieve"] for t in timings]),
+            "ttft": percentiles([t["ttft"] for t in timings if t["ttft"] is not None]),
+            "total": percentiles([t["total"] for t in timings]),
+        },
+        "peak_rss_mb": peak_rss_mb(),
+        "stages": registry.snapshot(), # 各阶段的耗时和计数器
+    }
+
+def _flatten(result: dict, prefix: str = "") -> dict:
+    flat = {}
+    for key, value in result.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+def compare(current: dict, baseline: dict):
+    print(f"\n与 {baseline.get('label')} ({baseline.get('timestamp')}, {baseline.get('git_commit')}) 对比:")
+    old, new = _flatten(baseline.get("metrics", {})), _flatten(current["metrics"])
+    for key in new:
+        if key in old and old[key]:
+            change = (new[key] - old[key]) / old[key] * 100
+            print(f"  {key:<32} {old[key]:>12.4f} -> {new[key]:>12.4f} ({change:+.1f}%)")
+
+def find_baseline(spec: str, exclude: Path) -> dict:
+    if spec == "latest":
+        candidates = sorted(p for p in RESULTS_DIR.glob("*.json") if p != exclude)
+        if not candidates:
+            return None
+        spec = str(candidates[-1])
+    return json.loads(Path(spec).read_text(encoding="utf-8"))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--content-lists", nargs="*", default=[], help="MinerU解析结果目录(<名称>/auto)或content list文件, 默认使用合成文档")
+    parser.add_argument("--pages", type=int, default=40, help="合成文档的页数")
+    parser.add_argument("--queries", default=None, help="问题文件, 每行一个问题或JSONL")
+    parser.add_argument("--num-queries", type=int, default=50, help="未指定问题文件时生成的问题数")
+    parser.add_argument("--concurrency", type=int, default=1, help="同时回放的问题数")
+    parser.add_argument("--latency", type=float, default=0.2, help="替身服务每个请求的延迟(秒)")
+    parser.add_argument("--jitter", type=float, default=0.05)
+    parser.add_argument("--token-latency", type=float, default=0.005)
+    parser.add_argument("--answer-tokens", type=int, default=64)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--cache-dir", default=None, help="缓存目录, 默认每次运行使用新的临时目录")
+    parser.add_argument("--label", default="e2e")
+    parser.add_argument("--compare", default=None, help="对比的结果文件, latest表示上一次的结果")
+    parser.add_argument("--keep", action="store_true", help="保留临时目录")
+    args = parser.parse_args()
+
+    process, url = start_stub_server(args)
+    work_dir = Path(tempfile.mkdtemp(prefix="rag_bench_"))
+    try:
+        metrics = run(args, url, work_dir)
+    finally:
+        process.kill()
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    result = {
+        "label": args.label,
+        "timestamp": timestamp,
+        "git_commit": git_commit(),
+        "host": socket.gethostname(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("compare", "keep")},
+        "metrics": metrics,
+    }
+    RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+    result_path = RESULTS_DIR / f"{timestamp}-{args.label}.json"
+    result_path.write_text(json.dumps(result, ensure_ascii=False, indent=4), encoding="utf-8")
+
+    ingest, query = metrics["ingest"], metrics["query"]
+    print(f"\n入库: {ingest['nodes']}个节点, {ingest['nodes_per_second']:.1f} 节点/秒 "
+          f"(create_nodes {ingest['create_nodes_seconds']:.2f}s, build_corpus {ingest['build_corpus_seconds']:.2f}s)")
+    for name in ("retrieve", "ttft", "total"):
+        stats = query[name]
+        if stats["p50"] is not None:
+            print(f"问题{name:<8}: p50 {stats['p50'] * 1000:.0f}ms, p95 {stats['p95'] * 1000:.0f}ms, p99 {stats['p99'] * 1000:.0f}ms")
+    print(f"峰值RSS: {metrics['peak_rss_mb']:.0f}MB")
+    print(f"结果已保存到 {result_path}")
+
+    if args.compare:
+        baseline = find_baseline(args.compare, exclude=result_path)
+        if baseline is None:
+            print("没有可对比的结果")
+        else:
+            compare(result, baseline)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+'''
+本地模型替身: 兼容OpenAI接口的对话补全(含流式)和嵌入, 以及DashScope原生的文本嵌入接口
+延迟可配置, 嵌入是对词做哈希的确定性向量, 相近的文本得到相近的向量, 检索结果有意义且可复现
+
+用法: python benchmarks/stub_server.py [--port 0] [--latency 0.2] [--token-latency 0.01] [--answer-tokens 64]
+启动后第一行输出监听地址, 例如 http://127.0.0.1:38211
+    对话:       {地址}/v1/chat/completions  (DASHSCOPE_BASE_URL={地址}/v1)
+    嵌入:       {地址}/v1/embeddings
+    DashScope:  {地址}/api/v1/services/embeddings/text-embedding/text-embedding  (DASHSCOPE_HTTP_BASE_URL={地址}/api/v1)
+'''
+import re
+import sys
+import json
+import time
+import uuid
+import random
+import hashlib
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+_TOKEN = re.compile(r"[a-z0-9]+|[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af]")
+
+
+def hash_embedding(text: str, dim: int = 256) -> list:
+    '''
+    把词(英文单词、中日韩单字和相邻两字)哈希到dim维并带符号累加, 再做L2归一化
+    '''
+    tokens = _TOKEN.findall((text or "").lower())
+    tokens += [a + b for a, b in zip(tokens, tokens[1:])]
+    vector = np.zeros(dim, dtype=np.float32)
+    for token in tokens:
+        digest = hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest()
+        bucket = int.from_bytes(digest[:4], "little") % dim
+        vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+    norm = np.linalg.norm(vector)
+    if norm == 0:
+        vector[0] = 1.0
+        norm = 1.0
+    return (vector / norm).tolist()
+
+class StubConfig:
+    def __init__(self, latency: float, jitter: float, token_latency: float, answer_tokens: int, dim: int, seed: int, max_batch: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.token_latency = token_latency
+        self.answer_tokens = answer_tokens
+        self.dim = dim
+        self.max_batch = max_batch
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.requests = {}
+
+    def sleep(self):
+        with self._lock:
+            delay = self.latency + (self._rng.uniform(-self.jitter, self.jitter) if self.jitter else 0.0)
+        time.sleep(max(0.0, delay))
+
+    def count(self, kind: str):
+        with self._lock:
+            self.requests[kind] = self.requests.get(kind, 0) + 1
+
+class StubHandler(BaseHTTPRequestHandler):
+    config: StubConfig = None
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, obj: dict, status: int = 200):
+        body = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/stats":
+            self._send_json({"requests": self.config.requests})
+        else:
+            self._send_json({"error": "not found"}, status=404)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        path = self.path.split("?")[0].rstrip("/")
+        if path.endswith("/chat/completions"):
+            self._chat(payload)
+        elif path.endswith("/embeddings") and not path.endswith("/services/embeddings"):
+            self._openai_embeddings(payload)
+        elif path.endswith("/text-embedding/text-embedding"):
+            self._dashscope_embeddings(payload)
+        else:
+            self._send_json({"error": f"unknown path {self.path}"}, status=404)
+
+    def _answer_tokens(self) -> list:
+        return [f"token{i} " for i in range(self.config.answer_tokens)]
+
+    def _chat(self, payload: dict):
+        self.config.count("chat")
+        self.config.sleep()
+        model = payload.get("model", "stub")
+        created = int(time.time())
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        tokens = self._answer_tokens()
+        if not payload.get("stream"):
+            time.sleep(self.config.token_latency * len(tokens))
+            self._send_json({
+                "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": len(tokens), "total_tokens": len(tokens)},
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        try:
+            for index, token in enumerate(tokens + [None]):
+                if index:
+                    time.sleep(self.config.token_latency)
+                delta = {"content": token} if token is not None else {}
+                if index == 0:
+                    delta["role"] = "assistant"
+                chunk = {
+                    "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": None if token is not None else "stop"}],
+                }
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError): # 客户端提前关闭了流
+            pass
+
+    def _openai_embeddings(self, payload: dict):
+        self.config.count("embeddings")
+        self.config.sleep()
+        texts = payload.get("input")
+        texts = [texts] if isinstance(texts, str) else texts
+        self._send_json({
+            "object": "list",
+            "model": payload.get("model", "stub"),
+            "data": [
+                {"object": "embedding", "index": i, "embedding": hash_embedding(text, self.config.dim)}
+                for i, text in enumerate(texts)
+            ],
+            "usage": {"prompt_tokens": 0, "total_tokens": 0},
+        })
+
+    def _dashscope_embeddings(self, payload: dict):
+        self.config.count("embeddings")
+        self.config.sleep()
+        texts = payload.get("input", {}).get("texts", [])
+        if self.config.max_batch and len(texts) > self.config.max_batch:
+            self._send_json({"code": "InvalidParameter", "message": f"batch size exceeds {self.config.max_batch}"}, status=400)
+            return
+        self._send_json({
+            "request_id": uuid.uuid4().hex,
+            "output": {"embeddings": [
+                {"text_index": i, "embedding": hash_embedding(text, self.config.dim)} for i, text in enumerate(texts)
+            ]},
+            "usage": {"total_tokens": 0},
+        })
+
+def serve(
+    host: str = "127.0.0.1",
+    port: int = 0,
+    latency: float = 0.2,
+    jitter: float = 0.0,
+    token_latency: float = 0.01,
+    answer_tokens: int = 64,
+    dim: int = 256,
+    seed: int = 0,
+    max_batch: int = 0,
+) -> ThreadingHTTPServer:
+    '''
+    在后台线程中启动替身服务并返回server, server.server_address为实际监听的地址
+    '''
+    handler = type("ConfiguredStubHandler", (StubHandler,), {
+        "config": StubConfig(latency, jitter, token_latency, answer_tokens, dim, seed, max_batch)
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=0, help="0表示随机端口")
+    parser.add_argument("--latency", type=float, default=0.2, help="每个请求的基础延迟(秒)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="延迟的随机抖动范围(秒)")
+    parser.add_argument("--token-latency", type=float, default=0.01, help="流式输出每个片段的间隔(秒)")
+    parser.add_argument("--answer-tokens", type=int, default=64, help="回答的片段数")
+    parser.add_argument("--dim", type=int, default=256, help="嵌入维度")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-batch", type=int, default=0, help="DashScope嵌入接口每批最多的文本数, 超出时返回400, 0表示不限")
+    args = parser.parse_args()
+
+    server = serve(
+        host=args.host, port=args.port, latency=args.latency, jitter=args.jitter,
+        token_latency=args.token_latency, answer_tokens=args.answer_tokens, dim=args.dim, seed=args.seed,
+        max_batch=args.max_batch,
+    )
+    host, port = server.server_address[:2]
+    print(f"http://{host}:{port}", flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+        sys.exit(0)
+
+if __name__ == '__main__':
+    main()
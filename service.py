@@ -0,0 +1,312 @@
+'''
+无界面的异步问答/入库服务, 与Streamlit页面解耦, 可以同时服务多个API客户端
+各集合的索引和检索器在进程内共享(见utils/registry.py), 访问上游模型的请求有并发上限, 排队已满时返回503
+
+启动: python service.py  (或 uvicorn service:app --host 0.0.0.0 --port 8000)
+接口:
+    GET    /health
+    GET    /collections                     知识库列表
+    POST   /query                           {"query": ..., "collections": [...], "top_k": 5, "stream": true}
+                                            流式时返回NDJSON: nodes -> delta... -> done
+    POST   /ingest?name=<文件名>.pdf         请求体为PDF文件内容(不超过SERVICE_MAX_UPLOAD_MB), 提交后台入库任务, 返回任务ID
+                                            同名文件的任务还未结束时返回409
+    GET    /jobs?limit=20, GET /jobs/{id}   入库任务进度
+    DELETE /jobs/{id}                       取消入库任务
+    GET    /metrics                         Prometheus指标
+Streamlit页面设置SERVICE_URL后只作为客户端调用这些接口
+'''
+import os
+import json
+import time
+import asyncio
+from pathlib import Path
+from typing import List
+
+from dotenv import load_dotenv
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.routing import Route
+
+from utils.jobs import get_job_manager
+from utils.retrieval import retrieve, asynthesis_response_stream, synthesis_response, AsyncVLMStream
+from utils.embedding import load_retriever, load_multi_retriever, list_collections, get_embed_model
+from utils.answer_cache import answer_cache, cache_scope
+from utils.rate_limit import ConcurrencyLimiter, Overloaded
+from utils.metrics import registry, span, trace, increment
+
+load_dotenv()
+service_host            = os.getenv("SERVICE_HOST", "127.0.0.1")
+service_port            = int(os.getenv("SERVICE_PORT", "8000"))
+service_max_concurrency = int(os.getenv("SERVICE_MAX_CONCURRENCY", "8"))
+service_max_pending     = int(os.getenv("SERVICE_MAX_PENDING", "32"))
+service_queue_timeout   = float(os.getenv("SERVICE_QUEUE_TIMEOUT", "30"))
+service_max_upload_mb   = float(os.getenv("SERVICE_MAX_UPLOAD_MB", "200"))
+
+__dir__ = os.path.dirname(os.path.abspath(__file__))
+pdf_dir = Path(__dir__) / "pdf_docs"
+persist_dir = Path(__dir__) / "chroma_storage"
+parse_output_dir = pdf_dir / "parse_results"
+job_manager = get_job_manager(db_path=persist_dir / "ingest_jobs.db", parse_output_dir=parse_output_dir, persist_dir=persist_dir)
+
+# 查询要嵌入问题并请求VLM, 同时进行的查询数受限, 超出的排队, 排队已满时直接拒绝
+limiter = ConcurrencyLimiter(
+    max_concurrency=service_max_concurrency,
+    max_pending=service_max_pending,
+    timeout=service_queue_timeout,
+)
+_uploading = set() # 正在上传的文件名, 同名文件同时上传时只接受一个
+
+
+def _error(message: str, status_code: int, **headers) -> JSONResponse:
+    return JSONResponse({"error": message}, status_code=status_code, headers=headers or None)
+
+def _overloaded(e: Overloaded) -> JSONResponse:
+    increment("service_rejected")
+    return _error(f"服务繁忙: {e}", 503, **{"Retry-After": "1"})
+
+def _get_retriever(collections: List[str], top_k: int):
+    if len(collections) == 1:
+        return load_retriever(corpus_name=collections[0], persist_dir=persist_dir, similarity_top_k=top_k)
+    return load_multi_retriever(corpus_names=collections, persist_dir=persist_dir, similarity_top_k=top_k)
+
+def _node_info(node) -> dict:
+    base = getattr(node, "node", node)
+    return {
+        "id": base.node_id,
+        "score": getattr(node, "score", None),
+        "content_type": base.metadata.get("content_type"),
+        "source_file": base.metadata.get("source_file"),
+        "page_idx": base.metadata.get("page_idx"),
+    }
+
+def _positive_int(value, default: int) -> int:
+    '''
+    解析正整数参数, 不合法时抛出ValueError(返回400)
+    '''
+    if value is None or value == "":
+        return default
+    number = int(value)
+    if number <= 0:
+        raise ValueError(value)
+    return number
+
+def _slot_releaser():
+    '''
+    归还一个并发名额, 重复调用只归还一次
+    '''
+    released = False
+    def release():
+        nonlocal released
+        if not released:
+            released = True
+            limiter.release()
+    return release
+
+class SlotStreamingResponse(StreamingResponse):
+    '''
+    响应结束时归还并发名额; 客户端在响应体开始前断开时生成器不会运行, 名额由这里归还
+    '''
+    def __init__(self, content, release, **kwargs):
+        super().__init__(content, **kwargs)
+        self._release = release
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self._release()
+
+def _json_line(obj: dict) -> bytes:
+    return (json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8")
+
+async def health(request: Request):
+    return JSONResponse({"status": "ok", "active": limiter.active, "pending": limiter.pending})
+
+async def collections(request: Request):
+    names = await asyncio.to_thread(list_collections, persist_dir)
+    return JSONResponse({"collections": names})
+
+async def query(request: Request):
+    try:
+        payload = await request.json()
+    except ValueError:
+        return _error("请求体不是合法的JSON", 400)
+    if not isinstance(payload, dict):
+        return _error("请求体必须是JSON对象", 400)
+    question = payload.get("query") or ""
+    names = payload.get("collections") or []
+    if not isinstance(question, str):
+        return _error("query必须是字符串", 400)
+    if not isinstance(names, list) or not all(isinstance(name, str) for name in names):
+        return _error("collections必须是字符串列表", 400)
+    question = question.strip()
+    try:
+        top_k = _positive_int(payload.get("top_k"), 5)
+    except (TypeError, ValueError):
+        return _error("top_k必须是正整数", 400)
+    stream = bool(payload.get("stream", True))
+    if not question or not names:
+        return _error("query和collections不能为空", 400)
+    known = await asyncio.to_thread(list_collections, persist_dir)
+    missing = [name for name in names if name not in known]
+    if missing:
+        return _error(f"集合{', '.join(missing)}不存在", 404)
+
+    try:
+        await limiter.acquire()
+    except Overloaded as e:
+        return _overloaded(e)
+    # 获得的并发名额在回答结束(或客户端断开)时归还
+    if stream:
+        release = _slot_releaser()
+        return SlotStreamingResponse(_answer_stream(question, names, top_k, release), release, media_type="application/x-ndjson")
+    try:
+        return JSONResponse(await _answer(question, names, top_k))
+    finally:
+        limiter.release()
+
+async def _prepare(question: str, names: List[str], top_k: int):
+    '''
+    嵌入问题、查回答缓存并检索, 返回(缓存的回答, 检索节点, 问题嵌入, 缓存的scope和version)
+    '''
+    with span("embed_query"):
+        # 嵌入缓存的查找和写入是同步的文件操作, 放到线程中执行, 不阻塞事件循环
+        query_embedding = await asyncio.to_thread(get_embed_model().get_query_embedding, question)
+    scope, version = await asyncio.to_thread(cache_scope, names, persist_dir)
+    answer = answer_cache.lookup(scope, version, query_embedding)
+    if answer is not None:
+        return answer, [], query_embedding, (scope, version)
+    retriever = await asyncio.to_thread(_get_retriever, names, top_k)
+    nodes = await asyncio.to_thread(retrieve, question, retriever)
+    return None, nodes, query_embedding, (scope, version)
+
+async def _answer(question: str, names: List[str], top_k: int) -> dict:
+    with trace() as spans:
+        answer, nodes, query_embedding, (scope, version) = await _prepare(question, names, top_k)
+        cached = answer is not None
+        if not cached:
+            answer = await asyncio.to_thread(
+                synthesis_response, query=question, nodes=nodes, stream=False,
+                query_embedding=query_embedding
+            )
+            if nodes:
+                answer_cache.store(scope, version, query_embedding, answer)
+    return {
+        "answer": answer,
+        "cached": cached,
+        "nodes": [_node_info(node) for node in nodes],
+        "latency": [[stage, seconds] for stage, seconds in spans],
+    }
+
+async def _answer_stream(question: str, names: List[str], top_k: int, release):
+    '''
+    NDJSON流: {"type": "nodes"}, 若干{"type": "delta"}, 最后{"type": "done"}; 出错时为{"type": "error"}
+    release: 归还并发名额, 回答结束时立即调用
+    '''
+    response = None
+    try:
+        with trace() as spans:
+            start = time.perf_counter()
+            answer, nodes, query_embedding, (scope, version) = await _prepare(question, names, top_k)
+            cached = answer is not None
+            yield _json_line({"type": "nodes", "nodes": [_node_info(node) for node in nodes]})
+            done = {"type": "done", "cached": cached, "time_to_first_token": None}
+            if cached:
+                yield _json_line({"type": "delta", "text": answer})
+            else:
+                response = await asynthesis_response_stream(
+                    query=question, nodes=nodes, query_embedding=query_embedding
+                )
+                if isinstance(response, AsyncVLMStream):
+                    parts = []
+                    async for delta in response:
+                        parts.append(delta)
+                        yield _json_line({"type": "delta", "text": delta})
+                    answer_cache.store(scope, version, query_embedding, "".join(parts))
+                    done["time_to_first_token"] = response.time_to_first_token
+                else:
+                    yield _json_line({"type": "delta", "text": response})
+            done["total_latency"] = time.perf_counter() - start
+            done["latency"] = [[stage, seconds] for stage, seconds in spans]
+        yield _json_line(done)
+    except Exception as e:
+        print(f"回答失败: {e}")
+        yield _json_line({"type": "error", "error": str(e)})
+    finally:
+        # 客户端断开时生成器被关闭, 同时关闭上游连接并归还并发名额
+        if isinstance(response, AsyncVLMStream):
+            await response.aclose()
+        release()
+
+async def ingest(request: Request):
+    name = Path(request.query_params.get("name", "")).name
+    if not name.endswith(".pdf"):
+        return _error("name必须是PDF文件名", 400)
+    max_bytes = int(service_max_upload_mb * 1024 * 1024)
+    try:
+        declared = int(request.headers.get("content-length", "0"))
+    except ValueError:
+        return _error("Content-Length不合法", 400)
+    if declared > max_bytes:
+        return _error(f"文件超过{service_max_upload_mb:g}MB", 413)
+    pdf_dir.mkdir(parents=True, exist_ok=True)
+    file_path = pdf_dir / name
+    # 同名文件的任务还在解析时覆盖PDF会让任务读到不一致的内容
+    if name in _uploading or await asyncio.to_thread(job_manager.queue.active_job, file_path) is not None:
+        return _error(f"{name}的入库任务尚未结束", 409)
+    _uploading.add(name)
+    tmp_path = file_path.with_name(file_path.name + ".uploading")
+    try:
+        # 分块写入磁盘, 大文件不占用内存; 写文件在线程中执行, 不阻塞事件循环
+        size = 0
+        with open(tmp_path, "wb") as f:
+            async for chunk in request.stream():
+                size += len(chunk)
+                if size > max_bytes: # 没有Content-Length(分块传输)时在这里截断
+                    break
+                await asyncio.to_thread(f.write, chunk)
+        if size == 0 or size > max_bytes:
+            tmp_path.unlink()
+            return _error("请求体为空", 400) if size == 0 else _error(f"文件超过{service_max_upload_mb:g}MB", 413)
+        await asyncio.to_thread(os.replace, tmp_path, file_path)
+        job_id = await asyncio.to_thread(job_manager.submit, file_path)
+    except BaseException: # 客户端中途断开等
+        tmp_path.unlink(missing_ok=True)
+        raise
+    finally:
+        _uploading.discard(name)
+    return JSONResponse({"job_id": job_id, "output_path": str(parse_output_dir / file_path.stem / "auto")}, status_code=202)
+
+async def jobs(request: Request):
+    try:
+        limit = _positive_int(request.query_params.get("limit"), 20)
+    except ValueError:
+        return _error("limit必须是正整数", 400)
+    return JSONResponse({"jobs": await asyncio.to_thread(job_manager.queue.list_jobs, limit)})
+
+async def job(request: Request):
+    job_id = request.path_params["job_id"]
+    if request.method == "DELETE":
+        await asyncio.to_thread(job_manager.queue.cancel, job_id)
+    info = await asyncio.to_thread(job_manager.queue.get, job_id)
+    if info is None:
+        return _error(f"任务{job_id}不存在", 404)
+    return JSONResponse(info)
+
+async def metrics(request: Request):
+    return PlainTextResponse(registry.prometheus_text(), media_type="text/plain; version=0.0.4")
+
+app = Starlette(routes=[
+    Route("/health", health),
+    Route("/collections", collections),
+    Route("/query", query, methods=["POST"]),
+    Route("/ingest", ingest, methods=["POST"]),
+    Route("/jobs", jobs),
+    Route("/jobs/{job_id}", job, methods=["GET", "DELETE"]),
+    Route("/metrics", metrics),
+])
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(app, host=service_host, port=service_port)
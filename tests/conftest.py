@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# 仓库没有打包配置, 测试直接导入仓库根目录下的utils
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
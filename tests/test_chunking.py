@@ -0,0 +1,59 @@
+import random
+import uuid
+
+from llama_index.core.schema import TextNode
+
+from utils.chunking import pack_nodes, estimate_tokens
+
+_WORDS = "model reward policy training data benchmark accuracy context retrieval vector table image".split()
+
+
+def _block(text: str, page: int) -> TextNode:
+    # 与create_nodes一样, 内容块ID由内容决定
+    return TextNode(
+        id_=str(uuid.uuid5(uuid.NAMESPACE_URL, f"doc.pdf|{text}")),
+        text=text,
+        metadata={"content_type": "text", "page_idx": page, "source_file": "doc.pdf"},
+    )
+
+def _document(blocks: int, blocks_per_page: int, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    texts = [" ".join(rng.choice(_WORDS) for _ in range(rng.randint(20, 80))) + f" #{i}" for i in range(blocks)]
+    return [_block(text, page=i // blocks_per_page) for i, text in enumerate(texts)]
+
+def _edit(nodes: list, index: int) -> list:
+    edited = list(nodes)
+    edited[index] = _block(nodes[index].text + " edited", page=nodes[index].metadata["page_idx"])
+    return edited
+
+def _pages(chunks: list) -> dict:
+    return {chunk.node_id: chunk.metadata["page_range"] for chunk in chunks}
+
+def test_chunks_respect_token_limit():
+    chunks = pack_nodes(_document(blocks=120, blocks_per_page=20), max_tokens=512)
+    assert 1 < len(chunks) < 120
+    assert all(estimate_tokens(chunk.text) <= 512 for chunk in chunks)
+
+def test_one_block_edit_changes_one_chunk():
+    # 每页不超过上限时每页一个块, 修改任一内容块只改变一个块ID
+    nodes = _document(blocks=60, blocks_per_page=4)
+    before = {chunk.node_id for chunk in pack_nodes(nodes, max_tokens=512)}
+    for index in range(len(nodes)):
+        after = {chunk.node_id for chunk in pack_nodes(_edit(nodes, index), max_tokens=512)}
+        assert len(after - before) == 1, index
+        assert len(before - after) == 1, index
+
+def test_edit_stays_within_its_page():
+    # 一页分为多个块时, 修改只影响同一页的块, 其他页的块ID不变
+    nodes = _document(blocks=120, blocks_per_page=20)
+    before = _pages(pack_nodes(nodes, max_tokens=512))
+    for index in (3, 30, 61, 100):
+        after = _pages(pack_nodes(_edit(nodes, index), max_tokens=512))
+        page = str(nodes[index].metadata["page_idx"])
+        changed = set(before.items()) ^ set(after.items())
+        assert changed and all(page_range == f"{page}-{page}" for _, page_range in changed), index
+
+def test_headings_start_new_chunk():
+    nodes = _document(blocks=10, blocks_per_page=10)
+    chunks = pack_nodes(nodes, max_tokens=100000, heading_ids=[nodes[5].node_id])
+    assert any(chunk.text.startswith(nodes[5].text) for chunk in chunks)
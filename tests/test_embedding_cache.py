@@ -0,0 +1,49 @@
+import numpy as np
+
+from utils.embedding_cache import EmbeddingStore
+
+
+def _vectors(count: int, dim: int, seed: int) -> np.ndarray:
+    return np.random.default_rng(seed).standard_normal((count, dim)).astype(np.float32)
+
+def test_put_and_get_across_instances(tmp_path):
+    writer, reader = EmbeddingStore(tmp_path), EmbeddingStore(tmp_path)
+    expected = {}
+    for batch in range(50):
+        vectors = _vectors(7, 16, batch)
+        keys = [f"k{batch}-{i}" for i in range(7)]
+        writer.put_many(keys, vectors.tolist())
+        expected.update(zip(keys, vectors))
+    # 另一个实例只读取新增的行
+    got = reader.get_many(list(expected))
+    for vector, want in zip(got, expected.values()):
+        np.testing.assert_allclose(vector, want.astype(np.float16))
+    assert len(reader) == len(writer) == 350
+
+def test_reopen_and_duplicate_keys(tmp_path):
+    store = EmbeddingStore(tmp_path, dtype="float32")
+    vectors = _vectors(3, 4, 0)
+    store.put_many(["a", "b", "a"], vectors.tolist())
+    store.put_many(["b", "c"], vectors[:2].tolist())
+    reopened = EmbeddingStore(tmp_path)
+    a, b, c, missing = reopened.get_many(["a", "b", "c", "d"])
+    np.testing.assert_array_equal(a, vectors[0])
+    np.testing.assert_array_equal(b, vectors[1])
+    np.testing.assert_array_equal(c, vectors[1])
+    assert missing is None and len(reopened) == 3
+
+def test_query_embeddings_kept_in_bounded_memory_not_on_disk(tmp_path):
+    from utils.embed_backends import HashingEmbedding
+    from utils.embedding_cache import CachedEmbedding
+
+    model = CachedEmbedding(HashingEmbedding(dim=32), store=EmbeddingStore(tmp_path), query_cache_size=2)
+    model.get_text_embedding_batch(["doc one", "doc two"])
+    first = model.get_query_embedding("q0")
+    for i in range(1, 5):
+        model.get_query_embedding(f"q{i}")
+    assert len(EmbeddingStore(tmp_path)) == 2 # 只持久化文档的嵌入
+    assert len(model._query_cache) == 2
+    hits = model.stats()["hits"]
+    model.get_query_embedding("q4")
+    assert model.stats()["hits"] == hits + 1
+    assert model.get_query_embedding("q0") == first # 被淘汰后重新嵌入
@@ -0,0 +1,24 @@
+from pathlib import Path
+
+import pytest
+
+from utils.html_table import html_table_to_markdown
+
+FIXTURES = Path(__file__).parent / "fixtures" / "html_tables"
+CASES = sorted(path.stem for path in FIXTURES.glob("*.html"))
+
+
+@pytest.mark.parametrize("name", CASES)
+def test_matches_golden_markdown(name):
+    # 期望输出由原先基于BeautifulSoup的实现生成, 见benchmarks/bench_html_table.py
+    html = (FIXTURES / f"{name}.html").read_text(encoding="utf-8")
+    expected = (FIXTURES / f"{name}.md").read_text(encoding="utf-8")
+    assert html_table_to_markdown(html) == expected
+
+def test_matches_reference_on_synthetic_tables():
+    pytest.importorskip("bs4")
+    from benchmarks.bench_html_table import reference_html_table_to_markdown, synthetic_tables
+
+    tables = synthetic_tables(300, seed=0)
+    mismatches = [table for table in tables if html_table_to_markdown(table) != reference_html_table_to_markdown(table)]
+    assert not mismatches
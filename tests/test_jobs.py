@@ -0,0 +1,56 @@
+import os
+import time
+
+from utils.jobs import JobManager, JobQueue, DONE, FAILED, FINISHED_STATUSES
+
+
+def _runner(db_path, job_id, file_path, parse_output_dir, persist_dir, shard_workers):
+    # 模拟解析时被杀死的工作进程
+    if file_path.endswith("crash.pdf"):
+        os._exit(1)
+    JobQueue(db_path).finish(job_id, DONE)
+
+def _wait(queue: JobQueue, job_id: str, timeout: float = 60) -> dict:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = queue.get(job_id)
+        if job["status"] in FINISHED_STATUSES:
+            return job
+        time.sleep(0.1)
+    raise TimeoutError(job)
+
+def test_dead_worker_fails_its_job_and_later_jobs_still_run(tmp_path):
+    manager = JobManager(tmp_path / "jobs.db", tmp_path, tmp_path, max_workers=1, runner=_runner)
+    crashed = manager.submit(tmp_path / "crash.pdf")
+    job = _wait(manager.queue, crashed)
+    assert job["status"] == FAILED and job["error"] == "入库工作进程异常退出"
+    for name in ("a.pdf", "b.pdf"):
+        assert _wait(manager.queue, manager.submit(tmp_path / name))["status"] == DONE
+
+def _metrics_runner(db_path, job_id, file_path, parse_output_dir, persist_dir, shard_workers):
+    from utils.metrics import span, increment, registry
+
+    with span("parse"):
+        increment("test_worker_pages", 3)
+    JobQueue(db_path).finish(job_id, DONE)
+    return registry.drain()
+
+def test_worker_metrics_merged_into_main_process(tmp_path):
+    from utils.metrics import registry
+
+    manager = JobManager(tmp_path / "jobs.db", tmp_path, tmp_path, max_workers=1, runner=_metrics_runner)
+    _wait(manager.queue, manager.submit(tmp_path / "a.pdf"))
+    deadline = time.monotonic() + 10
+    while "rag_test_worker_pages_total 3" not in registry.prometheus_text() and time.monotonic() < deadline:
+        time.sleep(0.05) # 任务状态先于done回调更新
+    text = registry.prometheus_text()
+    assert "rag_test_worker_pages_total 3" in text
+    assert 'rag_stage_duration_seconds_count{stage="parse"} 1' in text
+
+def _threads_runner(db_path, job_id, file_path, parse_output_dir, persist_dir, shard_workers):
+    JobQueue(db_path).finish(job_id, DONE, error=os.environ.get("OMP_NUM_THREADS"))
+
+def test_worker_threads_limited_to_cpu_share(tmp_path):
+    manager = JobManager(tmp_path / "jobs.db", tmp_path, tmp_path, max_workers=2, runner=_threads_runner)
+    job = _wait(manager.queue, manager.submit(tmp_path / "a.pdf"))
+    assert job["error"] == str(manager._cpu_share)
@@ -0,0 +1,25 @@
+from utils.lexical import tokenize, BM25Index
+
+
+def test_symbols_and_greek_letters_are_tokens():
+    assert tokenize("α β ∑") == ["α", "β", "∑"]
+    assert "≤" in tokenize("x ≤ y")
+    # 标点不作为词
+    assert tokenize("a, b.") == ["a", "b"]
+
+def test_hyphenated_words_kept_whole_and_split():
+    tokens = tokenize("GPT-4 and BERT")
+    assert "gpt-4" in tokens
+    assert {"gpt", "4", "and", "bert"} <= set(tokens)
+
+def test_accented_latin_and_cjk():
+    assert tokenize("Café naïve") == ["café", "naïve"]
+    assert tokenize("检索") == ["检", "索", "检索"]
+
+def test_bm25_finds_symbol_and_version(tmp_path):
+    index = BM25Index.build(["a", "b", "c"], ["梯度 ∇ 算子", "GPT-4 的结果", "普通文本"])
+    assert index.search("∇")[0][0] == "a"
+    assert index.search("gpt-4")[0][0] == "b"
+    index.save(tmp_path)
+    assert BM25Index.exists(tmp_path)
+    assert BM25Index.load(tmp_path).search("∇")[0][0] == "a"
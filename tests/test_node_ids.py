@@ -0,0 +1,47 @@
+import json
+
+import pytest
+
+import utils.embedding as embedding
+from utils.cache import DiskLRUCache
+
+_CONTENT_LIST = [
+    {"type": "text", "text": "正文段落", "page_idx": 0},
+    {"type": "table", "table_body": "<table><tr><td>a</td></tr></table>", "table_caption": ["表1"], "img_path": "images/t.png", "page_idx": 0},
+    {"type": "image", "image_caption": ["图1"], "img_path": "images/i.png", "page_idx": 0},
+]
+
+
+@pytest.fixture
+def parsed_result(tmp_path, monkeypatch):
+    parsed_result_path = tmp_path / "doc" / "auto"
+    (parsed_result_path / "images").mkdir(parents=True)
+    (parsed_result_path / "images" / "t.png").write_bytes(b"table")
+    (parsed_result_path / "images" / "i.png").write_bytes(b"image")
+    with open(parsed_result_path / "doc_content_list.json", "w", encoding="utf-8") as f:
+        json.dump(_CONTENT_LIST, f, ensure_ascii=False)
+    monkeypatch.setattr(embedding, "prepare_image", lambda path: (path, "image/png"))
+    monkeypatch.setattr(embedding, "encode_data_url", lambda path, mime: "data:")
+    return parsed_result_path
+
+def _node_ids(parsed_result_path, tmp_path, monkeypatch, description: str, table: str) -> dict:
+    # 每次使用新的图片描述缓存, 描述变化能被看到
+    cache = DiskLRUCache(cache_dir=tmp_path / f"captions-{description}", max_bytes=1 << 20)
+    monkeypatch.setattr(embedding, "get_caption_cache", lambda: cache)
+    monkeypatch.setattr(embedding, "_describe_image", lambda url, caption, timeout=None: description)
+    monkeypatch.setattr(embedding, "html_table_to_markdown", lambda html: table)
+    [nodes] = embedding.create_nodes([parsed_result_path], max_tokens=0)
+    return {node.metadata["content_type"]: node.node_id for node in nodes}
+
+def test_ids_follow_rendered_text(parsed_result, tmp_path, monkeypatch):
+    before = _node_ids(parsed_result, tmp_path, monkeypatch, "描述A", "| a |\n")
+    assert before == _node_ids(parsed_result, tmp_path, monkeypatch, "描述A", "| a |\n")
+
+    # 图片描述或表格转换结果变化时, 只有对应节点的ID变化
+    recaptioned = _node_ids(parsed_result, tmp_path, monkeypatch, "描述B", "| a |\n")
+    assert recaptioned["image"] != before["image"]
+    assert {k: v for k, v in recaptioned.items() if k != "image"} == {k: v for k, v in before.items() if k != "image"}
+
+    reconverted = _node_ids(parsed_result, tmp_path, monkeypatch, "描述A", "| A |\n")
+    assert reconverted["table"] != before["table"]
+    assert {k: v for k, v in reconverted.items() if k != "table"} == {k: v for k, v in before.items() if k != "table"}
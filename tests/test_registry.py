@@ -0,0 +1,53 @@
+import sys
+import time
+import threading
+import subprocess
+from pathlib import Path
+
+from utils.registry import get_resource, get_chroma_client, bump_index_version
+
+
+def test_factory_runs_once_per_resource_and_outside_global_lock(tmp_path):
+    calls, started = [], threading.Event()
+
+    def slow_factory():
+        calls.append("slow")
+        started.set()
+        time.sleep(0.3)
+        return "slow"
+
+    threads = [threading.Thread(target=get_resource, args=(tmp_path, "a", "index", slow_factory)) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    started.wait()
+    # 另一个集合的资源不用等待正在创建的资源
+    start = time.perf_counter()
+    assert get_resource(tmp_path, "b", "index", lambda: "fast") == "fast"
+    assert time.perf_counter() - start < 0.2
+    for thread in threads:
+        thread.join()
+    assert calls == ["slow"]
+
+def test_resource_rebuilt_after_version_bump(tmp_path):
+    assert get_resource(tmp_path, "a", "index", lambda: 1) == 1
+    assert get_resource(tmp_path, "a", "index", lambda: 2) == 1
+    bump_index_version(tmp_path, "a")
+    assert get_resource(tmp_path, "a", "index", lambda: 3) == 3
+
+_WRITER = '''
+import sys
+sys.path.insert(0, sys.argv[2])
+from pathlib import Path
+from utils.registry import get_chroma_client, bump_index_version
+get_chroma_client(Path(sys.argv[1])).get_or_create_collection("docs").add(ids=["x"], embeddings=[[1.0, 0.0]])
+bump_index_version(Path(sys.argv[1]), "docs")
+'''
+
+def test_chroma_client_reopened_and_old_one_closed(tmp_path):
+    old = get_chroma_client(tmp_path)
+    old.get_or_create_collection("docs")
+    subprocess.run([sys.executable, "-c", _WRITER, str(tmp_path), str(Path(__file__).resolve().parent.parent)], check=True)
+    new = get_chroma_client(tmp_path)
+    assert new is not old
+    assert new.get_collection("docs").count() == 1
+    assert getattr(old, "_closed", True)
@@ -0,0 +1,17 @@
+import pytest
+
+from benchmarks.profile_imports import ENTRIES, LAZY_MODULES, measure
+
+
+@pytest.mark.parametrize("entry", sorted(ENTRIES))
+def test_entry_does_not_load_lazy_modules(entry):
+    # 在全新的子进程中导入, 不受测试进程已导入模块的影响
+    loaded = set(measure(ENTRIES[entry])["modules"])
+    assert [name for name in LAZY_MODULES if name in loaded] == []
+
+def test_parse_pdf_does_not_import_mineru():
+    # 预览时导入parse_pdf只为ensure_layout_pdf, 不应加载MinerU
+    pytest.importorskip("pypdfium2")
+    pytest.importorskip("loguru")
+    loaded = set(measure(["utils.parse_pdf"])["modules"])
+    assert "mineru" not in loaded
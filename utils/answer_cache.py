@@ -0,0 +1,98 @@
+'''
+语义回答缓存: 相同或相近的问题直接返回缓存的回答, 不再走检索和VLM生成
+缓存键为(知识库, 索引版本, 问题向量), 知识库重建后版本号变化, 旧的回答自动失效
+'''
+import os
+import time
+import threading
+from pathlib import Path
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from .registry import index_version
+
+answer_cache_threshold = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+answer_cache_ttl       = float(os.getenv("ANSWER_CACHE_TTL", "86400"))
+answer_cache_capacity  = int(os.getenv("ANSWER_CACHE_CAPACITY", "1024"))
+
+
+class SemanticAnswerCache:
+    '''
+    按余弦相似度匹配问题向量的回答缓存, 支持TTL和LRU容量限制
+    threshold <= 0 时关闭缓存
+    '''
+    def __init__(self, threshold: float, ttl: float, capacity: int):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict() # 序号 -> (scope, version, 归一化的问题向量, 回答, 写入时间)
+        self._next_id = 0
+
+    @staticmethod
+    def _normalize(embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def lookup(self, scope: str, version: tuple, query_embedding: List[float]) -> Optional[str]:
+        if self.threshold <= 0:
+            return None
+        query = self._normalize(query_embedding)
+        now = time.time()
+        with self._lock:
+            # 顺带清除过期和版本已变化的条目
+            for entry_id, (entry_scope, entry_version, _, _, created) in list(self._entries.items()):
+                if now - created > self.ttl or (entry_scope == scope and entry_version != version):
+                    del self._entries[entry_id]
+            candidates = [
+                (entry_id, entry[2]) for entry_id, entry in self._entries.items()
+                if entry[0] == scope and len(entry[2]) == len(query)
+            ]
+            if candidates:
+                similarities = np.stack([vector for _, vector in candidates]) @ query
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    entry_id = candidates[best][0]
+                    self._entries.move_to_end(entry_id)
+                    self.hits += 1
+                    return self._entries[entry_id][3]
+            self.misses += 1
+            return None
+
+    def store(self, scope: str, version: tuple, query_embedding: List[float], answer: str):
+        if self.threshold <= 0:
+            return
+        with self._lock:
+            self._entries[self._next_id] = (scope, version, self._normalize(query_embedding), answer, time.time())
+            self._next_id += 1
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": len(self._entries),
+            }
+
+def cache_scope(collections: List[str], persist_dir: Path) -> Tuple[str, tuple]:
+    '''
+    由选中的知识库得到缓存的(scope, version)
+    '''
+    names = sorted(collections)
+    return f"{persist_dir}|{'|'.join(names)}", tuple(index_version(persist_dir, name) for name in names)
+
+# 进程内共享的回答缓存
+answer_cache = SemanticAnswerCache(
+    threshold=answer_cache_threshold,
+    ttl=answer_cache_ttl,
+    capacity=answer_cache_capacity,
+)
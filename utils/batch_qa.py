@@ -0,0 +1,187 @@
+'''
+批量问答, 用于离线回归评测: 从JSONL读取问题, 并发执行检索和生成, 每完成一个问题就追加写入结果文件
+中断后用同样的命令重新运行, 已成功的问题会被跳过(失败的问题重新执行, 结果文件中以最后一条为准)
+
+输入每行一个JSON: {"id": "q1", "query": "...", "collections": ["..."]}, id和collections可省略
+    id省略时使用行号, collections省略时使用--collections
+输出每行一个JSON: id, query, answer, node_ids, scores, latency(总耗时), stages(各阶段耗时), error
+
+用法:
+    python -m utils.batch_qa questions.jsonl -o answers.jsonl --collections deepseek-r1 --concurrency 8 --rate-limit 4
+'''
+import os
+import json
+import time
+import argparse
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+
+from .rate_limit import TokenBucket
+from .metrics import span, trace
+
+batch_qa_concurrency = int(os.getenv("BATCH_QA_CONCURRENCY", "4"))
+batch_qa_rate_limit  = float(os.getenv("BATCH_QA_RATE_LIMIT", "0"))
+
+default_persist_dir = Path(__file__).resolve().parent.parent / "chroma_storage"
+
+
+def load_questions(path: Path, default_collections: List[str]) -> List[dict]:
+    questions = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f):
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            questions.append({
+                "id": str(item.get("id", line_no)),
+                "query": item["query"],
+                "collections": item.get("collections") or default_collections,
+            })
+    ids = [question["id"] for question in questions]
+    if len(set(ids)) != len(ids):
+        raise ValueError("问题文件中有重复的id")
+    return questions
+
+def load_finished(path: Path) -> Dict[str, dict]:
+    '''
+    读取已有的结果文件, 返回已成功的问题id -> 结果; 同一id以最后一条为准, 中断时写了一半的行会被忽略
+    '''
+    results = {}
+    if not path.exists():
+        return results
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            results[record["id"]] = record
+    return {key: record for key, record in results.items() if not record.get("error")}
+
+class BatchQA:
+    '''
+    并发执行问答: 最多concurrency个问题同时进行, 每秒最多开始rate_limit个问题(<=0时不限)
+    吞吐随并发数增加, 直到达到限流速率或上游模型的处理能力
+    '''
+    def __init__(self, persist_dir: Path, concurrency: int = batch_qa_concurrency, rate_limit: float = batch_qa_rate_limit, top_k: int = 5):
+        # 在这里才导入, 只读取结果文件时不需要加载模型
+        from .embedding import get_embed_model, load_retriever, load_multi_retriever
+        from .retrieval import retrieve, synthesis_response
+
+        self._embed_model = get_embed_model()
+        self._load_retriever = load_retriever
+        self._load_multi_retriever = load_multi_retriever
+        self._retrieve = retrieve
+        self._synthesis_response = synthesis_response
+        self.persist_dir = Path(persist_dir)
+        self.concurrency = max(1, concurrency)
+        self.top_k = top_k
+        self._bucket = TokenBucket(rate=rate_limit)
+
+    def _get_retriever(self, collections: List[str]):
+        if len(collections) == 1:
+            return self._load_retriever(corpus_name=collections[0], persist_dir=self.persist_dir, similarity_top_k=self.top_k)
+        return self._load_multi_retriever(corpus_names=collections, persist_dir=self.persist_dir, similarity_top_k=self.top_k)
+
+    def answer(self, question: dict) -> dict:
+        '''
+        回答一个问题, 异常记录在结果的error字段中
+        '''
+        record = {"id": question["id"], "query": question["query"], "collections": question["collections"]}
+        self._bucket.acquire()
+        start = time.perf_counter()
+        with trace() as spans:
+            try:
+                if not question["collections"]:
+                    raise ValueError("未指定知识库")
+                retriever = self._get_retriever(question["collections"])
+                if retriever is None:
+                    raise ValueError(f"知识库{', '.join(question['collections'])}不存在")
+                with span("embed_query"):
+                    query_embedding = self._embed_model.get_query_embedding(question["query"])
+                nodes = self._retrieve(query=question["query"], retriever=retriever)
+                record["answer"] = self._synthesis_response(
+                    query=question["query"], nodes=nodes, stream=False,
+                    query_embedding=query_embedding
+                )
+                record["node_ids"] = [node.node.node_id for node in nodes]
+                record["scores"] = [node.score for node in nodes]
+                record["error"] = None
+            except Exception as e:
+                record["error"] = f"{type(e).__name__}: {e}"
+        record["latency"] = time.perf_counter() - start
+        stages = {}
+        for stage, seconds in spans:
+            stages[stage] = stages.get(stage, 0.0) + seconds
+        record["stages"] = stages
+        return record
+
+    def run(self, questions: List[dict], output_path: Path) -> dict:
+        '''
+        回答questions中尚未成功的问题, 结果逐条追加写入output_path, 返回本次运行的统计
+        '''
+        output_path = Path(output_path)
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        finished = load_finished(output_path)
+        pending = [question for question in questions if question["id"] not in finished]
+        print(f"共{len(questions)}个问题, 已完成{len(questions) - len(pending)}个, 本次执行{len(pending)}个")
+
+        write_lock = threading.Lock()
+        latencies, failed = [], 0
+        start = time.perf_counter()
+        with open(output_path, "a", encoding="utf-8") as f, ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            if f.tell() > 0 and not output_path.read_bytes().endswith(b"\n"):
+                f.write("\n") # 上次中断时写了一半的行单独成行, 读取时会被忽略
+            futures = [executor.submit(self.answer, question) for question in pending]
+            for done, future in enumerate(as_completed(futures), start=1):
+                record = future.result()
+                with write_lock:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    f.flush() # 每条结果立即落盘, 中断后可以续跑
+                if record["error"]:
+                    failed += 1
+                    print(f"[{done}/{len(pending)}] {record['id']} 失败: {record['error']}")
+                else:
+                    latencies.append(record["latency"])
+                    if done % 10 == 0 or done == len(pending):
+                        print(f"[{done}/{len(pending)}] 已完成")
+        elapsed = time.perf_counter() - start
+        stats = {
+            "questions": len(pending),
+            "succeeded": len(latencies),
+            "failed": failed,
+            "seconds": elapsed,
+            "throughput": len(pending) / elapsed if elapsed > 0 else 0.0, # 问题/秒
+            "p50": float(np.percentile(latencies, 50)) if latencies else None,
+            "p95": float(np.percentile(latencies, 95)) if latencies else None,
+        }
+        return stats
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="批量问答, 中断后重新运行会跳过已成功的问题")
+    parser.add_argument("questions", type=Path, help="问题JSONL文件")
+    parser.add_argument("-o", "--output", type=Path, required=True, help="结果JSONL文件, 已存在时续跑")
+    parser.add_argument("--collections", nargs="*", default=[], help="问题未指定collections时使用的知识库")
+    parser.add_argument("--persist-dir", type=Path, default=default_persist_dir)
+    parser.add_argument("--concurrency", type=int, default=batch_qa_concurrency, help="同时进行的问题数")
+    parser.add_argument("--rate-limit", type=float, default=batch_qa_rate_limit, help="每秒最多开始的问题数, 0表示不限")
+    parser.add_argument("--top-k", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    questions = load_questions(args.questions, args.collections)
+    runner = BatchQA(persist_dir=args.persist_dir, concurrency=args.concurrency, rate_limit=args.rate_limit, top_k=args.top_k)
+    stats = runner.run(questions, args.output)
+    p50 = f"{stats['p50']:.2f}s" if stats["p50"] is not None else "-"
+    p95 = f"{stats['p95']:.2f}s" if stats["p95"] is not None else "-"
+    print(
+        f"成功{stats['succeeded']}个, 失败{stats['failed']}个, 用时{stats['seconds']:.1f}s, "
+        f"吞吐{stats['throughput']:.2f}问题/秒, 延迟p50 {p50}, p95 {p95}"
+    )
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+import os
+import hashlib
+import tempfile
+import threading
+from pathlib import Path
+from typing import Optional
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+load_dotenv()
+cache_dir = Path(os.getenv("CACHE_DIR") or Path(__file__).parent.parent / ".cache") # 各类持久化缓存的根目录
+
+
+def hash_bytes(*parts: bytes) -> str:
+    '''
+    计算多段内容的sha256, 作为缓存键
+    '''
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(hashlib.sha256(part).digest()) # 先分别哈希, 避免拼接产生歧义
+    return h.hexdigest()
+
+def atomic_write(path: Path, data: bytes):
+    '''
+    原子写文件: 先写入同目录下的临时文件, 再rename覆盖目标文件
+    '''
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+class DiskLRUCache:
+    '''
+    基于文件的键值缓存, 每个键一个文件, 总大小超过max_bytes时按最近使用时间淘汰
+    最近使用时间记录在文件的mtime上, 进程重启后依然有效
+    '''
+    def __init__(self, cache_dir: Path, max_bytes: int):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict() # key -> 文件大小, 按最近使用排序
+        self._total_bytes = 0
+        self._load()
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / key
+
+    def _load(self):
+        if not self.cache_dir.exists():
+            return
+        files = []
+        for path in self.cache_dir.glob("*/*"):
+            if path.name.startswith(".tmp-") or not path.is_file():
+                continue
+            stat = path.stat()
+            files.append((stat.st_mtime, path.name, stat.st_size))
+        for _, key, size in sorted(files):
+            self._entries[key] = size
+            self._total_bytes += size
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            path = self._path(key)
+            try:
+                data = path.read_bytes()
+                os.utime(path)
+            except OSError: # 文件可能被其他进程淘汰
+                self._total_bytes -= self._entries.pop(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def set(self, key: str, value: bytes):
+        with self._lock:
+            atomic_write(self._path(key), value)
+            if key in self._entries:
+                self._total_bytes -= self._entries.pop(key)
+            self._entries[key] = len(value)
+            self._total_bytes += len(value)
+            self._evict()
+
+    def _evict(self):
+        while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+            key, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+            }
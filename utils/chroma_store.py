@@ -0,0 +1,54 @@
+'''
+检索结果带有节点嵌入的Chroma向量库
+llama_index的ChromaVectorStore查询时不返回嵌入, 这里让query和get_nodes一并取出入库时的嵌入,
+组装上下文时直接用来做MMR和去重, 不必再请求嵌入模型
+只在打开Chroma集合时导入(导入chromadb约需1秒)
+'''
+import math
+from typing import Any, List, Optional
+
+import numpy as np
+from llama_index.core.schema import BaseNode
+from llama_index.core.vector_stores.types import MetadataFilters, VectorStoreQueryResult
+from llama_index.core.vector_stores.utils import metadata_dict_to_node
+from llama_index.vector_stores.chroma import ChromaVectorStore
+
+
+def _to_node(text: str, metadata: dict, embedding) -> BaseNode:
+    node = metadata_dict_to_node(metadata, text=text)
+    node.embedding = np.asarray(embedding, dtype=np.float32).tolist() if embedding is not None else None
+    return node
+
+class EmbeddingChromaVectorStore(ChromaVectorStore):
+    @classmethod
+    def class_name(cls) -> str:
+        return "EmbeddingChromaVectorStore"
+
+    def _query(self, query_embeddings: List[float], n_results: int, where: dict, **kwargs: Any) -> VectorStoreQueryResult:
+        kwargs.setdefault("include", ["documents", "metadatas", "distances", "embeddings"])
+        if where:
+            kwargs["where"] = where
+        results = self._collection.query(query_embeddings=query_embeddings, n_results=n_results, **kwargs)
+        embeddings = results.get("embeddings")
+        embeddings = embeddings[0] if embeddings is not None else [None] * len(results["ids"][0])
+        nodes = [
+            _to_node(text, metadata, embedding)
+            for text, metadata, embedding in zip(results["documents"][0], results["metadatas"][0], embeddings)
+        ]
+        return VectorStoreQueryResult(
+            nodes=nodes,
+            similarities=[math.exp(-distance) for distance in results["distances"][0]], # 与ChromaVectorStore一致
+            ids=list(results["ids"][0]),
+        )
+
+    def get_nodes(self, node_ids: Optional[List[str]] = None, filters: Optional[MetadataFilters] = None) -> List[BaseNode]:
+        if filters:
+            return super().get_nodes(node_ids, filters)
+        results = self._collection.get(ids=node_ids or None, include=["documents", "metadatas", "embeddings"])
+        embeddings = results.get("embeddings")
+        if embeddings is None:
+            embeddings = [None] * len(results["ids"])
+        return [
+            _to_node(text, metadata, embedding)
+            for text, metadata, embedding in zip(results["documents"], results["metadatas"], embeddings)
+        ]
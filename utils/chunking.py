@@ -0,0 +1,131 @@
+'''
+把MinerU逐块生成的节点按文档顺序合并为有token上限的块(chunk):
+同一页(或页码相近, 见CHUNK_MAX_PAGE_GAP)的相邻段落合并在一起, 公式、表格和图片并入前后的段落, 标题开始新的块
+合并后节点数和嵌入量大幅减少, 每个向量对应的上下文也更完整
+
+块边界由内容决定(页、标题和内容块ID的哈希, 见_is_anchor), 不依赖前面所有内容块的累计长度:
+修改一个内容块只改变它所在页的块(通常只有它所在的块), 重复入库时其余块的ID不变, 不需要重新嵌入
+'''
+import os
+import re
+import json
+import uuid
+import hashlib
+from typing import Iterable, List, Set
+
+from llama_index.core.schema import BaseNode, TextNode
+
+chunk_max_tokens   = int(os.getenv("CHUNK_MAX_TOKENS", "512"))
+chunk_max_page_gap = int(os.getenv("CHUNK_MAX_PAGE_GAP", "0")) # 0: 块不跨页, 修改只影响所在页的块
+
+# 中日韩文字每个字约一个token, 其余按单词和标点计数
+_CJK_CHAR = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af]")
+_WORD = re.compile(r"[A-Za-z0-9_]+|[^\sA-Za-z0-9_\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af]")
+_ATTACHED_TYPES = ("equation", "table", "image")
+
+
+def estimate_tokens(text: str) -> int:
+    '''
+    不依赖分词器的token数估算, 英文单词按4/3个token计
+    '''
+    if not text:
+        return 0
+    cjk = len(_CJK_CHAR.findall(text))
+    words = _WORD.findall(text)
+    long_words = sum(1 for word in words if len(word) > 1)
+    return cjk + len(words) + (long_words + 2) // 3
+
+def _is_anchor(node: BaseNode, node_tokens: int, target_tokens: int) -> bool:
+    '''
+    是否在该内容块之后断开: 只由内容块自身的ID和长度决定, 平均每target_tokens个token出现一次
+    '''
+    digest = hashlib.blake2b(node.node_id.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") / 2 ** 64 < node_tokens / max(1, target_tokens)
+
+def _make_chunk(blocks: List[BaseNode]) -> TextNode:
+    pages = [block.metadata.get("page_idx") for block in blocks if block.metadata.get("page_idx") is not None]
+    page_start, page_end = (min(pages), max(pages)) if pages else (None, None)
+    image_paths = [block.metadata["image_path"] for block in blocks if block.metadata.get("content_type") == "image"]
+    content_types = []
+    for block in blocks:
+        if block.metadata.get("content_type") not in content_types:
+            content_types.append(block.metadata.get("content_type"))
+    metadata = {
+        "content_type": "chunk",
+        "page_idx": page_start,
+        "page_range": f"{page_start}-{page_end}",
+        "source_file": blocks[0].metadata.get("source_file"),
+        "image_path": "",
+        "image_paths": json.dumps(image_paths, ensure_ascii=False),
+        "content_types": ",".join(content_types),
+    }
+    return TextNode(
+        # 块ID由各个内容块的ID决定, 任一内容块变化时块ID随之变化, 重复入库时只嵌入变化的块
+        id_=str(uuid.uuid5(uuid.NAMESPACE_URL, "chunk|" + "|".join(block.node_id for block in blocks))),
+        text="\n\n".join(block.get_content() for block in blocks if block.get_content()),
+        metadata=metadata,
+        excluded_embed_metadata_keys=["image_path", "image_paths", "content_types"],
+        excluded_llm_metadata_keys=["image_path", "image_paths", "content_types"],
+    )
+
+def _split_segment(blocks: List[BaseNode], block_tokens: List[int], max_tokens: int) -> List[List[BaseNode]]:
+    '''
+    把超出上限的一段内容块拆分为多个块, 在内容定义的边界处断开, 只有超出上限时才强制断开
+    块的平均长度约为上限的一半
+    '''
+    target_tokens, min_tokens = max_tokens // 2, max_tokens // 4
+    parts, current, tokens, anchor = [], [], 0, False
+    for block, node_tokens in zip(blocks, block_tokens):
+        overflow = tokens + node_tokens > max_tokens
+        if current and (overflow or anchor):
+            # 前一块只有公式/表格/图片时, 把它留给后面的段落, 除非会超出上限
+            attached_only = all(item.metadata.get("content_type") in _ATTACHED_TYPES for item in current)
+            if overflow or not attached_only:
+                parts.append(current)
+                current, tokens = [], 0
+        current.append(block)
+        tokens += node_tokens
+        anchor = tokens >= min_tokens and _is_anchor(block, node_tokens, target_tokens)
+    if current:
+        parts.append(current)
+    return parts
+
+def pack_nodes(
+    nodes: List[BaseNode],
+    max_tokens: int = chunk_max_tokens,
+    max_page_gap: int = chunk_max_page_gap,
+    heading_ids: Iterable[str] = (),
+) -> List[TextNode]:
+    '''
+    按文档顺序把一个文件的节点合并为块
+    先在标题和换页处分段, 不超过上限的段整体作为一个块, 超出上限的段再按内容定义的边界拆分
+    max_tokens: 每个块的token上限, 单个内容块超出上限时独占一个块, 不做拆分
+    max_page_gap: 同一个块中相邻内容块的最大页码差, 0表示块不跨页
+    heading_ids: 标题节点的ID, 标题总是开始一个新块
+    '''
+    heading_ids: Set[str] = set(heading_ids)
+    segments = []
+    blocks, last_page = [], None
+    for node in nodes:
+        page = node.metadata.get("page_idx")
+        page_break = last_page is not None and page is not None and page - last_page > max_page_gap
+        if blocks and (node.node_id in heading_ids or page_break):
+            # 前一段只有公式/表格/图片时, 把它留给后面的标题段落, 除非跨越太多页
+            attached_only = all(block.metadata.get("content_type") in _ATTACHED_TYPES for block in blocks)
+            if page_break or not attached_only:
+                segments.append(blocks)
+                blocks = []
+        blocks.append(node)
+        if page is not None:
+            last_page = page
+    if blocks:
+        segments.append(blocks)
+
+    chunks = []
+    for segment in segments:
+        block_tokens = [estimate_tokens(block.get_content()) for block in segment]
+        if sum(block_tokens) <= max_tokens:
+            chunks.append(_make_chunk(segment))
+            continue
+        chunks.extend(_make_chunk(part) for part in _split_segment(segment, block_tokens, max_tokens))
+    return chunks
@@ -0,0 +1,144 @@
+'''
+生成回答前的上下文组装: 在token和图片预算内挑选检索到的节点
+用向量库随检索结果返回的节点嵌入做MMR选择并剔除近似重复的节点, 过长的表格只保留前若干行
+'''
+import os
+import json
+import re
+from typing import List, Optional, Tuple
+
+import numpy as np
+from llama_index.core.schema import BaseNode
+
+from .chunking import estimate_tokens
+
+context_max_tokens      = int(os.getenv("CONTEXT_MAX_TOKENS", "3000"))
+context_max_images      = int(os.getenv("CONTEXT_MAX_IMAGES", "4"))
+context_dedup_threshold = float(os.getenv("CONTEXT_DEDUP_THRESHOLD", "0.92"))
+context_mmr_lambda      = float(os.getenv("CONTEXT_MMR_LAMBDA", "0.7"))
+context_table_max_rows  = int(os.getenv("CONTEXT_TABLE_MAX_ROWS", "30"))
+
+_MIN_TRUNCATED_TOKENS = 64 # 剩余预算少于此值时不再截断放入下一个节点
+_TABLE_BLOCK = re.compile(r"(?:^\|.*\|[ \t]*(?:\n|$))+", re.MULTILINE)
+
+
+def trim_tables(text: str, max_rows: int = context_table_max_rows) -> str:
+    '''
+    markdown表格只保留表头和前max_rows行, 其余行用一行说明代替
+    '''
+    def trim(match: re.Match) -> str:
+        lines = match.group(0).rstrip("\n").split("\n")
+        if len(lines) <= max_rows + 2:
+            return match.group(0)
+        ending = "\n" if match.group(0).endswith("\n") else ""
+        kept = lines[:max_rows + 2] + [f"| ... (省略{len(lines) - max_rows - 2}行) |"]
+        return "\n".join(kept) + ending
+    if max_rows <= 0:
+        return text
+    return _TABLE_BLOCK.sub(trim, text)
+
+def _node_images(node: BaseNode) -> List[str]:
+    content_type = node.metadata.get("content_type")
+    if content_type == "image":
+        return [node.metadata["image_path"]]
+    if content_type == "chunk":
+        return json.loads(node.metadata.get("image_paths") or "[]")
+    return []
+
+def _node_text(node: BaseNode) -> str:
+    # 图片节点的文本是图片描述, 图片本身会发给VLM, 不再放入文本上下文
+    return "" if node.metadata.get("content_type") == "image" else node.get_content()
+
+def _mmr_order(
+    embeddings: np.ndarray, relevance: np.ndarray, mmr_lambda: float, dedup_threshold: float
+) -> Tuple[List[int], int]:
+    '''
+    按MMR依次挑选节点, 与已选节点的余弦相似度不低于dedup_threshold的视为重复并丢弃
+    返回(挑选顺序, 丢弃的节点数)
+    '''
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    embeddings = embeddings / np.where(norms > 0, norms, 1.0)
+    similarity = embeddings @ embeddings.T
+    remaining = list(range(len(embeddings)))
+    max_similarity = np.full(len(embeddings), -np.inf) # 每个节点与已选节点的最大相似度
+    order, dropped = [], 0
+    while remaining:
+        candidates = np.array(remaining)
+        redundancy = np.where(np.isfinite(max_similarity[candidates]), max_similarity[candidates], 0.0)
+        scores = mmr_lambda * relevance[candidates] - (1 - mmr_lambda) * redundancy
+        best = int(candidates[np.argmax(scores)])
+        remaining.remove(best)
+        if max_similarity[best] >= dedup_threshold:
+            dropped += 1
+            continue
+        order.append(best)
+        max_similarity = np.maximum(max_similarity, similarity[best])
+    return order, dropped
+
+def assemble_context(
+    nodes: List[BaseNode],
+    query_embedding: Optional[List[float]] = None,
+    max_tokens: int = context_max_tokens,
+    max_images: int = context_max_images,
+    dedup_threshold: float = context_dedup_threshold,
+    mmr_lambda: float = context_mmr_lambda,
+    table_max_rows: int = context_table_max_rows,
+) -> Tuple[List[str], List[str], dict]:
+    '''
+    在预算内组装上下文, 返回(文本片段, 图片路径, 统计信息)
+    nodes: 检索结果, 按相关性排序; 可以是NodeWithScore
+    节点带有嵌入(向量库返回的入库时的嵌入)时按MMR排序并去重, 否则按检索顺序填充预算; 这里不请求嵌入模型
+    query_embedding: 问题的嵌入, 用作MMR中的相关性; 为None时使用检索得分
+    '''
+    base_nodes = [getattr(node, "node", node) for node in nodes]
+    texts = [_node_text(node) for node in base_nodes]
+    tokens_before = sum(estimate_tokens(text) for text in texts)
+    images_before = sum(len(_node_images(node)) for node in base_nodes)
+
+    order, dropped = list(range(len(base_nodes))), 0
+    node_embeddings = [getattr(node, "embedding", None) for node in base_nodes]
+    if len(base_nodes) > 1 and all(embedding is not None for embedding in node_embeddings):
+        try:
+            embeddings = np.asarray(node_embeddings, dtype=np.float32)
+            if query_embedding is not None:
+                query = np.asarray(query_embedding, dtype=np.float32)
+                norms = np.linalg.norm(embeddings, axis=1) * (np.linalg.norm(query) or 1.0)
+                relevance = embeddings @ query / np.where(norms > 0, norms, 1.0)
+            else:
+                scores = np.array([getattr(node, "score", None) or 0.0 for node in nodes], dtype=np.float32)
+                low, high = scores.min(), scores.max()
+                relevance = (scores - low) / (high - low) if high > low else 1.0 - np.arange(len(nodes)) / len(nodes)
+            order, dropped = _mmr_order(embeddings, relevance, mmr_lambda, dedup_threshold)
+        except Exception as e:
+            print(f"上下文去重失败, 按检索顺序组装: {e}")
+
+    text_parts, image_paths, tokens_after, trimmed_tables = [], [], 0, 0
+    for index in order:
+        text = texts[index]
+        if text:
+            trimmed = trim_tables(text, table_max_rows)
+            trimmed_tables += trimmed != text
+            text_tokens = estimate_tokens(trimmed)
+            remaining = max_tokens - tokens_after
+            if text_tokens > remaining:
+                if remaining < _MIN_TRUNCATED_TOKENS:
+                    continue
+                trimmed = trimmed[:len(trimmed) * remaining // text_tokens] # 按比例截断到剩余预算
+                text_tokens = estimate_tokens(trimmed)
+            text_parts.append(trimmed)
+            tokens_after += text_tokens
+        for image_path in _node_images(base_nodes[index]):
+            if len(image_paths) < max_images and image_path not in image_paths:
+                image_paths.append(image_path)
+
+    stats = {
+        "nodes": len(base_nodes),
+        "duplicates_dropped": dropped,
+        "tables_trimmed": trimmed_tables,
+        "tokens_before": tokens_before,
+        "tokens_after": tokens_after,
+        "tokens_saved": tokens_before - tokens_after,
+        "images_before": images_before,
+        "images_after": len(image_paths),
+    }
+    return text_parts, image_paths, stats
@@ -0,0 +1,315 @@
+'''
+可替换的嵌入后端, 由EMBED_BACKEND选择:
+    dashscope: DashScope文本嵌入接口(默认), 按token数自适应分批, 多个批次并发请求
+    hashing:   本地numpy特征哈希, 不需要网络和模型文件, 用于离线环境和测试
+    onnx:      本地ONNX句向量模型, EMBED_ONNX_MODEL_DIR下放model.onnx和tokenizer.json(HuggingFace导出格式)
+后端都是llama_index的BaseEmbedding, 外面再包一层CachedEmbedding做持久化缓存
+不同后端(或维度)的向量不能混用, 切换后端后需要重新入库
+'''
+import os
+import time
+import zlib
+import asyncio
+import threading
+from pathlib import Path
+from http import HTTPStatus
+from functools import lru_cache
+from typing import Any, List, Optional
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from dotenv import load_dotenv
+from llama_index.core.base.embeddings.base import BaseEmbedding, Embedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+
+from .chunking import estimate_tokens
+from .lexical import tokenize, TOKENIZER_VERSION
+from .metrics import increment
+
+load_dotenv()
+embed_backend         = os.getenv("EMBED_BACKEND", "dashscope")
+embed_batch_size      = int(os.getenv("EMBED_BATCH_SIZE", "10"))
+embed_batch_tokens    = int(os.getenv("EMBED_BATCH_TOKENS", "8192"))
+embed_max_concurrency = int(os.getenv("EMBED_MAX_CONCURRENCY", "4"))
+embed_max_retries     = int(os.getenv("EMBED_MAX_RETRIES", "3"))
+embed_hashing_dim     = int(os.getenv("EMBED_HASHING_DIM", "512"))
+embed_onnx_model_dir  = os.getenv("EMBED_ONNX_MODEL_DIR", "")
+embed_onnx_max_length = int(os.getenv("EMBED_ONNX_MAX_LENGTH", "256"))
+
+MAX_INPUT_BATCH = 2048 # 后端自己分批, llama_index传入的每批文本数上限设为最大
+
+
+def pack_batches(texts: List[str], max_size: int, max_tokens: int) -> List[List[int]]:
+    '''
+    按顺序把文本装箱成批次, 每批最多max_size条、估算token数不超过max_tokens, 返回各批次的文本下标
+    单条文本超过max_tokens时单独成批
+    '''
+    batches, current, current_tokens = [], [], 0
+    for index, text in enumerate(texts):
+        tokens = estimate_tokens(text)
+        if current and (len(current) >= max_size or current_tokens + tokens > max_tokens):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(index)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+class DashScopeBatchEmbedding(BaseEmbedding):
+    '''
+    DashScope文本嵌入: 按条数和token数分批, 最多max_concurrency个批次同时请求
+    批次被接口拒绝(参数错误)时拆成两半重试并把批次上限减半, 之后满批成功时再逐步调大(不超过被拒绝过的大小)
+    限流和服务端错误按指数退避重试
+    '''
+    _api_key: Optional[str] = PrivateAttr()
+    _batch_size: int = PrivateAttr()
+    _batch_tokens: int = PrivateAttr()
+    _max_batch_size: int = PrivateAttr()
+    _smallest_rejected: Optional[int] = PrivateAttr(default=None)
+    _max_concurrency: int = PrivateAttr()
+    _max_retries: int = PrivateAttr()
+    _executor: ThreadPoolExecutor = PrivateAttr()
+    _lock: threading.Lock = PrivateAttr()
+
+    def __init__(
+        self,
+        model_name: str,
+        api_key: Optional[str] = None,
+        batch_size: int = embed_batch_size,
+        batch_tokens: int = embed_batch_tokens,
+        max_concurrency: int = embed_max_concurrency,
+        max_retries: int = embed_max_retries,
+        **kwargs: Any,
+    ):
+        super().__init__(model_name=model_name, embed_batch_size=MAX_INPUT_BATCH, **kwargs)
+        self._api_key = api_key
+        self._batch_size = self._max_batch_size = max(1, batch_size)
+        self._batch_tokens = max(1, batch_tokens)
+        self._max_concurrency = max(1, max_concurrency)
+        self._max_retries = max_retries
+        self._executor = ThreadPoolExecutor(max_workers=self._max_concurrency)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "DashScopeBatchEmbedding"
+
+    def _request(self, texts: List[str], text_type: str) -> List[Embedding]:
+        import dashscope
+
+        for attempt in range(self._max_retries + 1):
+            increment("embed_requests", type=text_type)
+            response = dashscope.TextEmbedding.call(
+                model=self.model_name, input=texts, api_key=self._api_key, text_type=text_type
+            )
+            if response.status_code == HTTPStatus.OK:
+                vectors = [None] * len(texts)
+                for item in response.output["embeddings"]:
+                    vectors[item["text_index"]] = item["embedding"]
+                if any(vector is None for vector in vectors):
+                    raise RuntimeError("嵌入接口返回的向量数与文本数不一致")
+                with self._lock:
+                    # 满批成功时逐步调大, 不超过配置的上限和被拒绝过的最小批次
+                    limit = min(self._max_batch_size, (self._smallest_rejected or self._max_batch_size + 1) - 1)
+                    if len(texts) >= self._batch_size and self._batch_size < limit:
+                        self._batch_size += 1
+                return vectors
+            if response.status_code == HTTPStatus.BAD_REQUEST and len(texts) > 1:
+                # 批次条数超限, 拆开重试, 之后的批次上限减半
+                half = len(texts) // 2
+                with self._lock:
+                    self._smallest_rejected = min(self._smallest_rejected or len(texts), len(texts))
+                    self._batch_size = max(1, min(self._batch_size, half))
+                increment("embed_batch_splits")
+                return self._request(texts[:half], text_type) + self._request(texts[half:], text_type)
+            retryable = response.status_code == HTTPStatus.TOO_MANY_REQUESTS or response.status_code >= 500
+            if not retryable or attempt == self._max_retries:
+                break
+            time.sleep(0.5 * 2 ** attempt)
+        raise RuntimeError(f"嵌入请求失败: {response.status_code} {response.code} {response.message}")
+
+    def _batches(self, texts: List[str]) -> List[List[int]]:
+        with self._lock:
+            return pack_batches(texts, self._batch_size, self._batch_tokens)
+
+    def _embed(self, texts: List[str], text_type: str) -> List[Embedding]:
+        batches = self._batches(texts)
+        if len(batches) == 1:
+            return self._request(texts, text_type)
+        results = self._executor.map(lambda batch: self._request([texts[i] for i in batch], text_type), batches)
+        vectors = [None] * len(texts)
+        for batch, batch_vectors in zip(batches, results):
+            for index, vector in zip(batch, batch_vectors):
+                vectors[index] = vector
+        return vectors
+
+    async def _aembed(self, texts: List[str], text_type: str) -> List[Embedding]:
+        semaphore = asyncio.Semaphore(self._max_concurrency)
+
+        async def _run(batch: List[int]) -> List[Embedding]:
+            async with semaphore:
+                return await asyncio.to_thread(self._request, [texts[i] for i in batch], text_type)
+
+        batches = self._batches(texts)
+        results = await asyncio.gather(*(_run(batch) for batch in batches))
+        vectors = [None] * len(texts)
+        for batch, batch_vectors in zip(batches, results):
+            for index, vector in zip(batch, batch_vectors):
+                vectors[index] = vector
+        return vectors
+
+    def _get_query_embedding(self, query: str) -> Embedding:
+        return self._request([query], "query")[0]
+
+    async def _aget_query_embedding(self, query: str) -> Embedding:
+        return (await asyncio.to_thread(self._request, [query], "query"))[0]
+
+    def _get_text_embedding(self, text: str) -> Embedding:
+        return self._request([text], "document")[0]
+
+    async def _aget_text_embedding(self, text: str) -> Embedding:
+        return (await asyncio.to_thread(self._request, [text], "document"))[0]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[Embedding]:
+        return self._embed(texts, "document")
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[Embedding]:
+        return await self._aembed(texts, "document")
+
+@lru_cache(maxsize=1 << 16)
+def _token_hash(token: str) -> int:
+    return zlib.crc32(token.encode("utf-8"))
+
+class HashingEmbedding(BaseEmbedding):
+    '''
+    本地特征哈希嵌入: 把词(单词、数学符号、中日韩单字和两字, 见lexical.tokenize)带符号哈希到dim维,
+    词频取log1p后做L2归一化; 字面相近的文本向量相近, 没有语义泛化能力
+    '''
+    _dim: int = PrivateAttr()
+
+    def __init__(self, dim: int = embed_hashing_dim, **kwargs: Any):
+        super().__init__(model_name=f"hashing-{dim}-v{TOKENIZER_VERSION}", embed_batch_size=MAX_INPUT_BATCH, **kwargs)
+        self._dim = dim
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "HashingEmbedding"
+
+    def _embed(self, texts: List[str]) -> List[Embedding]:
+        rows, hashes = [], []
+        for row, text in enumerate(texts):
+            tokens = tokenize(text or "")
+            rows.extend([row] * len(tokens))
+            hashes.extend(_token_hash(token) for token in tokens)
+        hashes = np.asarray(hashes, dtype=np.uint32)
+        matrix = np.zeros((len(texts), self._dim), dtype=np.float32)
+        signs = np.where(hashes >> 31, 1.0, -1.0).astype(np.float32)
+        np.add.at(matrix, (np.asarray(rows, dtype=np.int64), (hashes % self._dim).astype(np.int64)), signs)
+        matrix = np.sign(matrix) * np.log1p(np.abs(matrix))
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix /= np.where(norms > 0, norms, 1.0)
+        return matrix.tolist()
+
+    def _get_query_embedding(self, query: str) -> Embedding:
+        return self._embed([query])[0]
+
+    async def _aget_query_embedding(self, query: str) -> Embedding:
+        return self._embed([query])[0]
+
+    def _get_text_embedding(self, text: str) -> Embedding:
+        return self._embed([text])[0]
+
+    async def _aget_text_embedding(self, text: str) -> Embedding:
+        return self._embed([text])[0]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[Embedding]:
+        return self._embed(texts)
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[Embedding]:
+        return self._embed(texts)
+
+class OnnxEmbedding(BaseEmbedding):
+    '''
+    本地ONNX句向量模型(如all-MiniLM-L6-v2、bge-small-zh的ONNX导出), 在CPU上推理
+    模型输出为逐token的隐状态时按attention mask做平均池化, 最后L2归一化
+    文本按长度排序后分批, 减少padding
+    '''
+    _session: Any = PrivateAttr()
+    _tokenizer: Any = PrivateAttr()
+    _input_names: List[str] = PrivateAttr()
+    _batch_size: int = PrivateAttr()
+
+    def __init__(self, model_dir: str = embed_onnx_model_dir, max_length: int = embed_onnx_max_length, batch_size: int = 32, **kwargs: Any):
+        try:
+            import onnxruntime
+            from tokenizers import Tokenizer
+        except ImportError as e:
+            raise ImportError("onnx嵌入后端需要安装onnxruntime和tokenizers") from e
+        model_dir = Path(model_dir)
+        if not (model_dir / "model.onnx").exists() or not (model_dir / "tokenizer.json").exists():
+            raise FileNotFoundError(f"{model_dir}下需要有model.onnx和tokenizer.json")
+        super().__init__(model_name=f"onnx-{model_dir.name}", embed_batch_size=MAX_INPUT_BATCH, **kwargs)
+        tokenizer = Tokenizer.from_file(str(model_dir / "tokenizer.json"))
+        tokenizer.enable_truncation(max_length=max_length)
+        tokenizer.enable_padding(pad_id=tokenizer.token_to_id("[PAD]") or 0)
+        self._tokenizer = tokenizer
+        self._session = onnxruntime.InferenceSession(str(model_dir / "model.onnx"), providers=["CPUExecutionProvider"])
+        self._input_names = [item.name for item in self._session.get_inputs()]
+        self._batch_size = batch_size
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "OnnxEmbedding"
+
+    def _embed(self, texts: List[str]) -> List[Embedding]:
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        vectors = [None] * len(texts)
+        for start in range(0, len(order), self._batch_size):
+            batch = order[start:start + self._batch_size]
+            encodings = self._tokenizer.encode_batch([texts[i] for i in batch])
+            feeds = {
+                "input_ids": np.array([encoding.ids for encoding in encodings], dtype=np.int64),
+                "attention_mask": np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64),
+                "token_type_ids": np.array([encoding.type_ids for encoding in encodings], dtype=np.int64),
+            }
+            output = self._session.run(None, {name: feeds[name] for name in self._input_names if name in feeds})[0]
+            if output.ndim == 3: # (批次, token, 维度) -> 平均池化
+                mask = feeds["attention_mask"][:, :, None].astype(np.float32)
+                output = (output * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+            output = output / np.maximum(np.linalg.norm(output, axis=1, keepdims=True), 1e-12)
+            for index, vector in zip(batch, output.astype(np.float32)):
+                vectors[index] = vector.tolist()
+        return vectors
+
+    def _get_query_embedding(self, query: str) -> Embedding:
+        return self._embed([query])[0]
+
+    async def _aget_query_embedding(self, query: str) -> Embedding:
+        return (await asyncio.to_thread(self._embed, [query]))[0]
+
+    def _get_text_embedding(self, text: str) -> Embedding:
+        return self._embed([text])[0]
+
+    async def _aget_text_embedding(self, text: str) -> Embedding:
+        return (await asyncio.to_thread(self._embed, [text]))[0]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[Embedding]:
+        return self._embed(texts)
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[Embedding]:
+        return await asyncio.to_thread(self._embed, texts)
+
+def create_embed_backend(backend: str = embed_backend, **kwargs: Any) -> BaseEmbedding:
+    '''
+    按名称创建嵌入后端, kwargs传给后端的构造函数
+    '''
+    if backend == "dashscope":
+        kwargs.setdefault("model_name", os.getenv("DASHSCOPE_TEXT_EMBED_MODEL_NAME"))
+        kwargs.setdefault("api_key", os.getenv("DASHSCOPE_API_KEY"))
+        return DashScopeBatchEmbedding(**kwargs)
+    if backend == "hashing":
+        return HashingEmbedding(**kwargs)
+    if backend == "onnx":
+        return OnnxEmbedding(**kwargs)
+    raise ValueError(f"未知的嵌入后端{backend}, 可选dashscope/hashing/onnx")
@@ -1,18 +1,31 @@
 import os
+import gzip
 import json
-import base64
-import chromadb
+import uuid
+import hashlib
+import threading
 from pathlib import Path
-from typing import List
-from bs4 import BeautifulSoup
+from typing import Callable, List, Tuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
 
 from llama_index.core import VectorStoreIndex, StorageContext
-from llama_index.embeddings.dashscope import DashScopeEmbedding
-from llama_index.vector_stores.chroma import ChromaVectorStore
-from llama_index.core.schema import BaseNode, TextNode
+from llama_index.core.schema import BaseNode, TextNode, MetadataMode
+from llama_index.core.retrievers import BaseRetriever
 
 from .request_models import request_vlm
+from .rate_limit import TokenBucket
+from .cache import DiskLRUCache, hash_bytes, cache_dir
+from .embedding_cache import CachedEmbedding, EmbeddingStore
+from .embed_backends import create_embed_backend
+from .mmap_store import MmapVectorStore, mmap_store_dir, list_mmap_collections
+from .image_payload import prepare_image, encode_data_url, image_max_pixels, image_max_bytes
+from .lexical import BM25Index, lexical_index_dir
+from .html_table import html_table_to_markdown
+from .chunking import pack_nodes, chunk_max_tokens
+from .retrieval import HybridRetriever, MultiCollectionRetriever
+from .registry import get_chroma_client, get_resource, bump_index_version
+from .metrics import span, increment
 
 
 load_dotenv()
@@ -21,101 +34,205 @@ dashscope_base_url              = os.getenv("DASHSCOPE_BASE_URL")
 dashscope_llm_model_name        = os.getenv("DASHSCOPE_LLM_MODEL_NAME")
 dashscope_vlm_model_name        = os.getenv("DASHSCOPE_VLM_MODEL_NAME")
 dashscope_text_embed_model_name = os.getenv("DASHSCOPE_TEXT_EMBED_MODEL_NAME")
+vlm_max_concurrency             = int(os.getenv("VLM_MAX_CONCURRENCY", "4"))
+vlm_rate_limit                  = float(os.getenv("VLM_RATE_LIMIT", "2"))
+vlm_timeout                     = float(os.getenv("VLM_TIMEOUT", "60"))
+caption_cache_max_mb            = float(os.getenv("CAPTION_CACHE_MAX_MB", "256"))
+embed_cache_dtype               = os.getenv("EMBED_CACHE_DTYPE", "float16")
+vector_store_backend            = os.getenv("VECTOR_STORE", "chroma") # chroma或mmap(见mmap_store.py)
 
-embed_model = DashScopeEmbedding(
-    model_name=dashscope_text_embed_model_name,
-    api_key=dashscope_api_key,
-    base_url=dashscope_base_url,
-    embed_batch_size=10
-)
+ProgressCallback = Callable[[str, int, int], None] # (阶段, 已完成数, 总数)
+INSERT_BATCH_SIZE = 100 # 每批写入向量库的节点数
 
-def _html_table_to_markdown_rapid(html_table):
+_lazy_lock = threading.Lock()
+_embed_model = None
+_caption_cache = None
+
+def get_embed_model() -> CachedEmbedding:
     '''
-    html格式的表格表格解析为markdown
+    嵌入后端由EMBED_BACKEND选择, 外包一层持久化缓存, 重复的文本不再请求嵌入
+    第一次使用时才创建(ONNX后端要加载模型), 只列出集合的进程不需要
     '''
-    try:
-        # 使用 BeautifulSoup 解析 HTML
-        soup = BeautifulSoup(html_table.strip(), 'html.parser')
-        table = soup.find('table')
-        if not table:
-            raise ValueError("No <table> found in the HTML.")
-
-        # 初始化存储表格内容的矩阵
-        rows = []
-        max_cols = 0
-
-        # 解析所有行
-        for row in table.find_all('tr'):
-            cells = []
-            for cell in row.find_all(['td', 'th']):
-                rowspan = int(cell.get('rowspan', 1))  # 获取 rowspan
-                colspan = int(cell.get('colspan', 1))  # 获取 colspan
-                text = cell.get_text(strip=True)  # 获取单元格内容
-
-                # 填充矩阵，支持跨行或跨列的单元格
-                for _ in range(colspan):
-                    cells.append({'text': text, 'rowspan': rowspan})
-            rows.append(cells)
-            max_cols = max(max_cols, len(cells))  # 更新列数
-
-        # 扩展矩阵，处理 rowspan 占用的单元格
-        expanded_rows = []
-        rowspan_tracker = [0] * max_cols  # 追踪每列的 rowspan
-        for row in rows:
-            expanded_row = []
-            col_idx = 0
-            for cell in row:
-                # 跳过因 rowspan 导致的占位列
-                while col_idx < max_cols and rowspan_tracker[col_idx] > 0:
-                    expanded_row.append(None)
-                    rowspan_tracker[col_idx] -= 1
-                    col_idx += 1
-
-                # 添加当前单元格
-                expanded_row.append(cell['text'])
-                # 更新 rowspan 追踪器
-                if cell['rowspan'] > 1:
-                    rowspan_tracker[col_idx] = cell['rowspan'] - 1
-                col_idx += 1
-
-            # 补全因 rowspan 导致的剩余占位符
-            while col_idx < max_cols:
-                if rowspan_tracker[col_idx] > 0:
-                    expanded_row.append(None)
-                    rowspan_tracker[col_idx] -= 1
-                else:
-                    expanded_row.append("")
-                col_idx += 1
-
-            expanded_rows.append(expanded_row)
-
-        # 将第一行视为表头
-        headers = expanded_rows[0]
-        body_rows = expanded_rows[1:]
-
-        # 生成 Markdown 表格
-        markdown = ''
-        if headers:
-            markdown += '| ' + ' | '.join(h if h else '' for h in headers) + ' |\n'
-            markdown += '| ' + ' | '.join(['-' * (len(h) if h else 3) for h in headers]) + ' |\n'
-        for row in body_rows:
-            markdown += '| ' + ' | '.join(cell if cell else '' for cell in row) + ' |\n'
-
-        return markdown
+    global _embed_model
+    with _lazy_lock:
+        if _embed_model is None:
+            embed_backend_model = create_embed_backend()
+            _embed_model = CachedEmbedding(
+                embed_backend_model,
+                store=EmbeddingStore(
+                    store_dir=cache_dir / "embeddings" / hashlib.sha256(str(embed_backend_model.model_name).encode("utf-8")).hexdigest()[:16],
+                    dtype=embed_cache_dtype
+                )
+            )
+        return _embed_model
+
+def get_caption_cache() -> DiskLRUCache:
+    '''
+    图片描述缓存, 重复入库相同图片时不再请求VLM; 创建时要扫描缓存目录, 只在入库时创建
+    '''
+    global _caption_cache
+    with _lazy_lock:
+        if _caption_cache is None:
+            _caption_cache = DiskLRUCache(
+                cache_dir=cache_dir / "vlm_captions",
+                max_bytes=int(caption_cache_max_mb * 1024 * 1024)
+            )
+        return _caption_cache
+
+def _image_prompt(image_caption: str) -> str:
+    return f"The caption of the image is:{image_caption}, please describe the uploaded image in detail."
+
+def _describe_image(image_url: str, image_caption: str, timeout: float = None) -> str:
+    '''
+    用VLM把图片描述为文本
+    '''
+    system_content = {
+        "role": "system",
+        "content": [{"type": "text", "text": "You are a helpful assistant."}]
+    }
+    user_content = {
+        "role": "user",
+        "content": [
+            {
+                "type": "image_url",
+                "image_url":{"url": image_url},
+            },
+            {
+                "type": "text",
+                "text": _image_prompt(image_caption)
+            },
+        ],
+    }
+    return request_vlm(system_content=system_content, user_content=user_content, timeout=timeout)
+
+def _caption_cache_key(image_bytes: bytes, image_caption: str) -> str:
+    '''
+    图片描述缓存键: 图片内容 + 提示词(含图片标题) + VLM模型名 + 派生图片的像素和字节预算(决定VLM看到的图片)
+    '''
+    return hash_bytes(
+        image_bytes,
+        _image_prompt(image_caption).encode("utf-8"),
+        str(dashscope_vlm_model_name).encode("utf-8"),
+        f"{image_max_pixels}|{image_max_bytes}".encode("utf-8"),
+    )
+
+def _caption_images(
+    caption_jobs: List[Tuple[TextNode, str, str]],
+    max_concurrency: int,
+    rate_limit: float,
+    timeout: float,
+    progress_callback: ProgressCallback = None
+):
+    '''
+    并发请求VLM生成图片描述, 原地更新图片节点的文本
+    命中缓存的图片不请求VLM, 单张图片失败时保留仅含图片标题的节点
+    progress_callback抛出异常(如任务被取消)时停止提交剩余的图片
+    '''
+    bucket = TokenBucket(rate=rate_limit)
+    caption_cache = get_caption_cache()
+    stats_before = caption_cache.stats() # 缓存在进程内共享, 只输出本次的命中情况
 
-    except Exception as e:
-        print(f"Error parsing table: {e}")
-        return ''
+    def _caption(job: Tuple[TextNode, str, str]):
+        text_node, image_path, image_caption = job
+        try:
+            with open(image_path, "rb") as f:
+                image_bytes = f.read()
+            cache_key = _caption_cache_key(image_bytes, image_caption)
+            cached = caption_cache.get(cache_key)
+            if cached is not None:
+                # 命中时不生成派生图片, 回答时用到这张图片才生成
+                image_content = cached.decode("utf-8")
+                increment("caption_cache_hits")
+            else:
+                increment("caption_cache_misses")
+                derivative_path, mime = prepare_image(image_path) # 请求VLM和之后回答时使用同一张派生图片
+                with span("caption_wait"):
+                    bucket.acquire()
+                with span("caption"):
+                    image_content = _describe_image(encode_data_url(derivative_path, mime), image_caption, timeout=timeout)
+                increment("caption_image_bytes", os.path.getsize(derivative_path))
+                caption_cache.set(cache_key, image_content.encode("utf-8"))
+        except Exception as e:
+            increment("caption_failures")
+            print(f"描述图片 {image_path} 失败, 仅使用图片标题: {str(e)}")
+            # 仅含标题的节点文本不同, ID也不同, 下次入库描述成功时会替换掉它
+            text_node.id_ = _with_text_hash(text_node.id_, text_node.get_content())
+            return
+        text_node.set_content(image_caption + "\n" + image_content)
+        # 图片描述随VLM模型或提示词变化, ID包含描述文本, 描述变化时重新嵌入
+        text_node.id_ = _with_text_hash(text_node.id_, text_node.get_content())
+
+    with ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as executor:
+        futures = [executor.submit(_caption, job) for job in caption_jobs]
+        try:
+            for done, _ in enumerate(as_completed(futures), start=1):
+                if progress_callback is not None:
+                    progress_callback("caption", done, len(caption_jobs))
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+    stats = caption_cache.stats()
+    print(f"图片描述缓存命中{stats['hits'] - stats_before['hits']}次, 未命中{stats['misses'] - stats_before['misses']}次")
+
+def _make_node_id(source_file: str, content: dict, id_counts: dict) -> str:
+    '''
+    由(source_file, page_idx, content_type, 内容哈希)生成确定性的节点ID
+    内容不变的块在重复入库时得到相同的ID, 以便增量更新
+    '''
+    content_hash = hashlib.sha256(
+        json.dumps(content, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    ).hexdigest()
+    key = f"{source_file}.pdf|{content.get('page_idx')}|{content.get('type')}|{content_hash}"
+    occurrence = id_counts.get(key, 0)
+    id_counts[key] = occurrence + 1
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"{key}|{occurrence}"))
+
+def _with_text_hash(node_id: str, text: str) -> str:
+    '''
+    在节点ID中加入渲染后文本的哈希, 用于文本不只由MinerU内容决定的节点(表格、图片)
+    表格转换或图片描述变化时ID随之变化, 增量入库时重新嵌入这些节点
+    '''
+    text_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"{node_id}|{text_hash}"))
 
-def create_nodes(parsed_result_path_list: List[Path]) -> List[List[BaseNode]]:
+def content_list_path(parsed_result_path: Path, source_file: str) -> Path:
+    '''
+    解析结果中的content list文件, lean模式下为压缩的.json.gz
+    '''
+    gz_path = parsed_result_path / (source_file + "_content_list.json.gz")
+    return gz_path if gz_path.exists() else parsed_result_path / (source_file + "_content_list.json")
+
+def create_nodes(
+    parsed_result_path_list: List[Path],
+    max_concurrency: int = vlm_max_concurrency,
+    rate_limit: float = vlm_rate_limit,
+    timeout: float = vlm_timeout,
+    progress_callback: ProgressCallback = None,
+    max_tokens: int = chunk_max_tokens
+) -> List[List[BaseNode]]:
+    '''
+    把MinerU的解析结果切分为节点
+    max_concurrency: 同时进行的VLM图片描述请求数
+    rate_limit: 每秒最多发起的VLM请求数, <=0 时不限流
+    timeout: 单次VLM请求的超时时间(秒)
+    progress_callback: 进度回调, 参数为(阶段, 已完成数, 总数)
+    max_tokens: 相邻内容块合并后每个块的token上限, <=0 时不合并, 每个内容块一个节点
+    '''
     nodes_list = []
+    heading_ids_list = [] # 每个文件中标题节点的ID
+    caption_jobs = [] # (图片节点, 图片路径, 图片标题)
     for parsed_result_path in parsed_result_path_list:
         source_file = parsed_result_path.parent.name
-        content_file = parsed_result_path / (source_file + "_content_list.json")
+        content_file = content_list_path(parsed_result_path, source_file)
         try:
-            with open(content_file, 'r', encoding="utf-8") as f:
+            with (gzip.open if content_file.suffix == ".gz" else open)(content_file, 'rt', encoding="utf-8") as f:
                 content_list = json.load(f)
                 nodes = []
+                file_caption_jobs = []
+                heading_ids = set()
+                id_counts = {} # 同一页中完全相同的内容块按出现顺序区分
                 for content in content_list:
                     # 文本直接储存为文本节点
                     if content.get("type") == "text":
@@ -128,12 +245,14 @@ def create_nodes(parsed_result_path_list: List[Path]) -> List[List[BaseNode]]:
                             "image_path": ""
                         }
                         text_node = TextNode(
+                            id_=_make_node_id(source_file, content, id_counts),
                             text=text_content,
                             metadata=meta_info
                         )
                         nodes.append(text_node)
-                    # 公式储存为文本节点, 并在meta信息中储存图片链接
-                    # TODO(wangjintao): 把公式前后的段落组合到一起, 认为是一个完整的分段
+                        if content.get("text_level"):
+                            heading_ids.add(text_node.node_id)
+                    # 公式储存为文本节点, 并在meta信息中储存图片链接, 合并块时并入前后的段落
                     elif content.get("type") == "equation":
                         text_content = content.get("text")
                         image_path = content.get("img_path")
@@ -146,12 +265,12 @@ def create_nodes(parsed_result_path_list: List[Path]) -> List[List[BaseNode]]:
                             "image_path": full_image_path
                         }
                         text_node = TextNode(
+                            id_=_make_node_id(source_file, content, id_counts),
                             text=text_content,
                             metadata=meta_info
                         )
                         nodes.append(text_node)
-                    # 表格储存为文本节点, 并在meta信息中储存图片链接
-                    # TODO(wangjintao): 把表格前后的段落组合到一起, 认为是一个完整的分段
+                    # 表格储存为文本节点, 并在meta信息中储存图片链接, 合并块时并入前后的段落
                     elif content.get("type") == "table":
                         table_body = content.get("table_body")
                         table_caption = ""
@@ -161,7 +280,7 @@ def create_nodes(parsed_result_path_list: List[Path]) -> List[List[BaseNode]]:
                         full_image_path = (parsed_result_path / image_path).as_posix()
 
                         # 把table_body从html格式转为markdown格式
-                        table_body_markdown = _html_table_to_markdown_rapid(table_body)
+                        table_body_markdown = html_table_to_markdown(table_body)
                         table_content = table_body_markdown + "\n" + table_caption
 
                         meta_info = {
@@ -171,39 +290,18 @@ def create_nodes(parsed_result_path_list: List[Path]) -> List[List[BaseNode]]:
                             "image_path": full_image_path
                         }
                         text_node = TextNode(
+                            id_=_with_text_hash(_make_node_id(source_file, content, id_counts), table_content),
                             text=table_content,
                             metadata=meta_info
                         )
                         nodes.append(text_node)
-                    # 图片储存为图片节点
+                    # 图片储存为图片节点, 先用图片标题占位, 图片描述在所有文件遍历完后并发生成
                     elif content.get("type") == "image":
                         image_caption = ""
                         for caption in content.get("image_caption"):
                             image_caption = image_caption + caption + "\n"
                         image_path = content.get("img_path")
                         full_image_path = (parsed_result_path / image_path).as_posix()
-                        # 用VLM把图片描述为文本, 通过文本进行嵌入
-                        with open(full_image_path, "rb") as f:
-                            img_b64 = base64.b64encode(f.read()).decode("utf-8")
-                        system_content = {
-                            "role": "system",
-                            "content": [{"type": "text", "text": "You are a helpful assistant."}]
-                        }
-                        user_content = {
-                            "role": "user",
-                            "content": [
-                                {
-                                    "type": "image_url",
-                                    "image_url":{"url": f"data:image/jpeg;base64,{img_b64}"},
-                                },
-                                {
-                                    "type": "text",
-                                    "text": f"The caption of the image is:{image_caption}, please describe the uploaded image in detail."
-                                },
-                            ],
-                        }
-                        image_content = request_vlm(system_content=system_content, user_content=user_content)
-                        image_content = image_caption + "\n" + image_content
 
                         meta_info = {
                             "content_type": "image",
@@ -212,25 +310,48 @@ def create_nodes(parsed_result_path_list: List[Path]) -> List[List[BaseNode]]:
                             "image_path": full_image_path
                         }
                         text_node = TextNode(
-                            text=image_content,
+                            id_=_make_node_id(source_file, content, id_counts),
+                            text=image_caption,
                             metadata=meta_info
                         )
                         nodes.append(text_node)
+                        file_caption_jobs.append((text_node, full_image_path, image_caption))
                 nodes_list.append(nodes)
+                heading_ids_list.append(heading_ids)
+                caption_jobs.extend(file_caption_jobs)
 
         except Exception as e:
             print(f"处理文件 {content_file} 时发生错误: {str(e)}")
             continue
 
+    # 图片描述作为一个独立的并发阶段, 节点顺序和meta信息不受影响
+    _caption_images(
+        caption_jobs, max_concurrency=max_concurrency, rate_limit=rate_limit,
+        timeout=timeout, progress_callback=progress_callback
+    )
+
+    # 图片描述完成后再合并, 块的文本和ID包含图片描述
+    if max_tokens > 0:
+        packed_list = [
+            pack_nodes(nodes, max_tokens=max_tokens, heading_ids=heading_ids)
+            for nodes, heading_ids in zip(nodes_list, heading_ids_list)
+        ]
+        print(f"合并前节点数{sum(map(len, nodes_list))}, 合并后{sum(map(len, packed_list))}")
+        nodes_list = packed_list
+
     return nodes_list
 
-def build_corpus(nodes_list: List[List[BaseNode]], persist_dir: Path):
+def build_corpus(nodes_list: List[List[BaseNode]], persist_dir: Path, progress_callback: ProgressCallback = None):
     '''
     创建语料库并嵌入
+    节点ID是确定性的, 重复入库时只嵌入新增或改动的节点, 并删除已不存在的节点
+    progress_callback: 进度回调, 参数为("embed", 已嵌入节点数, 需嵌入节点数)
     '''
     chroma_dir = persist_dir
     chroma_dir.mkdir(exist_ok=True) # 创建持久化目录
-    db = chromadb.PersistentClient(path=str(chroma_dir)) # 创建ChromaDB客户端
+    db = get_chroma_client(chroma_dir) if vector_store_backend == "chroma" else None # 获取共享的ChromaDB客户端
+    embed_model = get_embed_model()
+    stats_before = embed_model.stats() # 嵌入模型在进程内共享, 统计是累计的, 只输出本次构建的部分
 
     filename_list = []
 
@@ -239,40 +360,151 @@ def build_corpus(nodes_list: List[List[BaseNode]], persist_dir: Path):
     for filename, nodes in zip(filename_list, nodes_list):
         collection_name = filename.split(".")[0]
 
-        # 获取或创建集合
-        collection = db.get_or_create_collection(collection_name)
+        # 获取或创建集合, 与集合中已有的节点做差分
+        if db is not None:
+            from .chroma_store import EmbeddingChromaVectorStore
+
+            collection = db.get_or_create_collection(collection_name)
+            vector_store = EmbeddingChromaVectorStore(chroma_collection=collection)
+            existing_ids = set(collection.get(include=[])["ids"])
+        else:
+            vector_store = MmapVectorStore(mmap_store_dir(chroma_dir, collection_name))
+            existing_ids = set(vector_store.node_ids())
+        node_ids = set(node.node_id for node in nodes)
+        stale_ids = list(existing_ids - node_ids)
+        new_nodes = [node for node in nodes if node.node_id not in existing_ids]
+        changed = False
+        try:
+            if stale_ids:
+                changed = True
+                vector_store.delete_nodes(node_ids=stale_ids)
+
+            if new_nodes:
+                storage_context = StorageContext.from_defaults(vector_store=vector_store)
+
+                # 创建索引, 分批插入以便汇报进度
+                index = VectorStoreIndex(
+                    nodes=[],
+                    storage_context=storage_context,
+                    embed_model=embed_model
+                )
+                for start in range(0, len(new_nodes), INSERT_BATCH_SIZE):
+                    batch = new_nodes[start:start + INSERT_BATCH_SIZE]
+                    # 先嵌入再写入, 嵌入和写入Chroma分别计时; 已有嵌入的节点insert_nodes不会重复嵌入
+                    with span("embed_nodes", collection=collection_name):
+                        embeddings = embed_model.get_text_embedding_batch(
+                            [node.get_content(metadata_mode=MetadataMode.EMBED) for node in batch]
+                        )
+                    for node, embedding in zip(batch, embeddings):
+                        node.embedding = embedding
+                    changed = True
+                    with span("chroma_upsert", collection=collection_name):
+                        index.insert_nodes(batch)
+                    increment("chroma_upserted_nodes", len(batch), collection=collection_name)
+                    if progress_callback is not None:
+                        progress_callback("embed", min(start + INSERT_BATCH_SIZE, len(new_nodes)), len(new_nodes))
+        finally:
+            # 中途取消或出错时集合已部分更新, 同样提交、重建BM25并递增版本号, 保持向量、字面索引和回答缓存一致
+            # 已写入的节点下次入库时不会重复嵌入
+            if isinstance(vector_store, MmapVectorStore):
+                with span("mmap_commit", collection=collection_name):
+                    vector_store.commit() # 暂存的新增和删除一次写成新的一代
+            # 集合有变化时重建BM25索引
+            lexical_dir = lexical_index_dir(chroma_dir, collection_name)
+            if changed or not BM25Index.exists(lexical_dir):
+                with span("bm25_build", collection=collection_name):
+                    if db is not None:
+                        result = collection.get(include=["documents"])
+                        ids, documents = result["ids"], result["documents"]
+                    else:
+                        ids, documents = vector_store.documents()
+                    BM25Index.build(ids, documents).save(lexical_dir)
+            if changed:
+                bump_index_version(chroma_dir, collection_name) # 让已缓存的索引和检索器失效
+        print(f"构建语料库{collection_name}成功: 新增{len(new_nodes)}个节点, 删除{len(stale_ids)}个节点, 未变{len(nodes) - len(new_nodes)}个节点")
+
+    stats = embed_model.stats()
+    hits, misses, deduped = (stats[name] - stats_before[name] for name in ("hits", "misses", "deduped"))
+    total = hits + misses + deduped
+    print(f"嵌入缓存命中率{(hits + deduped) / total if total else 0.0:.1%}, 请求嵌入{misses}条, 批次内去重{deduped}条")
 
-        # 创建向量存储
-        vector_store = ChromaVectorStore(chroma_collection=collection)
-        storage_context = StorageContext.from_defaults(vector_store=vector_store)
+def load_corpus(corpus_name: str, persist_dir: Path) -> VectorStoreIndex:
+    '''
+    加载语料库, 同一进程内复用已加载的索引
+    '''
+    return get_resource(persist_dir, corpus_name, "index", lambda: _load_corpus(corpus_name, persist_dir))
 
-        # 创建索引
-        index = VectorStoreIndex(
-            nodes=nodes,
-            storage_context=storage_context,
-            embed_model=embed_model
+def load_retriever(corpus_name: str, persist_dir: Path, similarity_top_k: int = 5) -> BaseRetriever:
+    '''
+    获取语料库的检索器, 同一进程内的所有会话共享
+    集合有BM25索引时返回向量+字面的混合检索器
+    '''
+    def _create():
+        index = load_corpus(corpus_name=corpus_name, persist_dir=persist_dir)
+        if index is None:
+            return None
+        vector_retriever = index.as_retriever(
+            similarity_top_k=similarity_top_k,
+            vector_store_query_mode="default",
+        )
+        lexical_dir = lexical_index_dir(persist_dir, corpus_name)
+        if not BM25Index.exists(lexical_dir):
+            return vector_retriever
+        return HybridRetriever(
+            vector_retriever=vector_retriever,
+            lexical_index=get_resource(persist_dir, corpus_name, "lexical", lambda: BM25Index.load(lexical_dir)),
+            vector_store=index.vector_store,
+            similarity_top_k=similarity_top_k,
         )
-        print(f"构建语料库{collection_name}成功")
+    return get_resource(persist_dir, corpus_name, f"retriever_top{similarity_top_k}", _create)
 
-def load_corpus(corpus_name: str, persist_dir: Path) -> VectorStoreIndex:
+def load_multi_retriever(corpus_names: List[str], persist_dir: Path, similarity_top_k: int = 5) -> BaseRetriever:
     '''
-    加载语料库
+    获取跨多个语料库的检索器, 各语料库的索引在进程内共享
     '''
-    db = chromadb.PersistentClient(path=str(persist_dir))
-
+    vector_stores, lexical_indexes = {}, {}
+    for corpus_name in corpus_names:
+        index = load_corpus(corpus_name=corpus_name, persist_dir=persist_dir)
+        if index is None:
+            continue
+        vector_stores[corpus_name] = index.vector_store
+        # 与单集合检索一样, 有BM25索引的集合同时做字面检索
+        lexical_dir = lexical_index_dir(persist_dir, corpus_name)
+        if BM25Index.exists(lexical_dir):
+            lexical_indexes[corpus_name] = get_resource(
+                persist_dir, corpus_name, "lexical", lambda lexical_dir=lexical_dir: BM25Index.load(lexical_dir)
+            )
+    return MultiCollectionRetriever(
+        vector_stores=vector_stores,
+        embed_model=get_embed_model(),
+        similarity_top_k=similarity_top_k,
+        lexical_indexes=lexical_indexes,
+    )
+
+def _load_corpus(corpus_name: str, persist_dir: Path) -> VectorStoreIndex:
     try:
-        # 获取集合
-        collection = db.get_collection(corpus_name)
+        if vector_store_backend == "mmap":
+            # 只读取元数据, 向量和节点文件做内存映射
+            store_dir = mmap_store_dir(persist_dir, corpus_name)
+            if not MmapVectorStore.exists(store_dir):
+                raise ValueError(f"集合{corpus_name}不存在")
+            vector_store = MmapVectorStore(store_dir)
+        else:
+            from .chroma_store import EmbeddingChromaVectorStore
+
+            # 获取集合
+            collection = get_chroma_client(persist_dir).get_collection(corpus_name)
+
+            # 创建向量存储
+            vector_store = EmbeddingChromaVectorStore(chroma_collection=collection)
 
-        # 创建向量存储
-        vector_store = ChromaVectorStore(chroma_collection=collection)
         storage_context = StorageContext.from_defaults(vector_store=vector_store)
 
         # 加载索引
         index = VectorStoreIndex(
             nodes=[],  # 从存储中加载，不需要传入nodes
             storage_context=storage_context,
-            embed_model=embed_model
+            embed_model=get_embed_model()
         )
         return index
 
@@ -280,7 +512,9 @@ def load_corpus(corpus_name: str, persist_dir: Path) -> VectorStoreIndex:
         print(f"加载语料库{corpus_name}失败: {e}")
 
 def list_collections(persist_dir: Path) -> List[str]:
-    db = chromadb.PersistentClient(path=str(persist_dir))
+    if vector_store_backend == "mmap":
+        return list_mmap_collections(persist_dir)
+    db = get_chroma_client(persist_dir)
     collections = db.list_collections()
     collections_names = [collection.name for collection in collections]
     return collections_names
\ No newline at end of file
@@ -0,0 +1,295 @@
+import os
+import json
+import hashlib
+import threading
+from pathlib import Path
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from llama_index.core.base.embeddings.base import BaseEmbedding, Embedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+
+from .chunking import estimate_tokens
+from .metrics import span, increment
+
+embed_query_cache_size = int(os.getenv("EMBED_QUERY_CACHE_SIZE", "1024"))
+
+try:
+    import fcntl
+except ImportError: # Windows下不做跨进程加锁
+    fcntl = None
+
+
+class EmbeddingStore:
+    '''
+    持久化的嵌入向量存储, 以追加方式写入:
+        keys.txt: 每行一个键, 行号即向量的行号
+        vectors.bin: 连续存放的float16/float32向量
+        meta.json: 向量维度和数据类型
+    内存中的向量放在按倍数扩容的缓冲区中, 写入和读取其他进程追加的内容都只处理新增的行
+    '''
+    def __init__(self, store_dir: Path, dtype: str = "float16"):
+        self.store_dir = Path(store_dir)
+        self.store_dir.mkdir(parents=True, exist_ok=True)
+        self._keys_path = self.store_dir / "keys.txt"
+        self._vectors_path = self.store_dir / "vectors.bin"
+        self._meta_path = self.store_dir / "meta.json"
+        self._lock = threading.Lock()
+        self._rows: Dict[str, int] = {}
+        self._count = 0 # 已读入的向量行数
+        self._keys_offset = 0 # 已读取的keys.txt字节数
+        self.dim: Optional[int] = None
+        self.dtype = np.dtype(dtype)
+        self._buffer = np.zeros((0, 0), dtype=self.dtype)
+        self._sync()
+
+    def _load_meta(self):
+        if self._meta_path.exists():
+            meta = json.loads(self._meta_path.read_text())
+            self.dim = meta["dim"]
+            self.dtype = np.dtype(meta["dtype"])
+            self._buffer = np.zeros((0, self.dim), dtype=self.dtype)
+
+    def _append(self, vectors: np.ndarray):
+        '''
+        把向量追加到缓冲区末尾, 容量不足时按倍数扩容
+        '''
+        needed = self._count + len(vectors)
+        if needed > len(self._buffer):
+            buffer = np.empty((max(needed, 2 * len(self._buffer), 1024), self.dim), dtype=self.dtype)
+            buffer[:self._count] = self._buffer[:self._count]
+            self._buffer = buffer
+        self._buffer[self._count:needed] = vectors
+        self._count = needed
+
+    def _sync(self):
+        '''
+        读取其他进程追加的键和向量
+        '''
+        if self.dim is None:
+            self._load_meta() # 其他进程可能已写入第一批向量
+        if self.dim is None or not self._keys_path.exists():
+            return
+        if self._keys_path.stat().st_size == self._keys_offset:
+            return
+        with open(self._keys_path, "rb") as f:
+            f.seek(self._keys_offset)
+            chunk = f.read()
+        # 只处理完整的行, 写了一半的行留到下次
+        end = chunk.rfind(b"\n") + 1
+        keys = chunk[:end].decode("utf-8").splitlines()
+        if not keys:
+            return
+        # 只读取新键对应的向量
+        row_bytes = self.dim * self.dtype.itemsize
+        with open(self._vectors_path, "rb") as f:
+            f.seek(self._count * row_bytes)
+            data = f.read(len(keys) * row_bytes)
+        available = len(data) // row_bytes
+        vectors = np.frombuffer(data[:available * row_bytes], dtype=self.dtype).reshape(-1, self.dim)
+        for row, key in enumerate(keys[:available], start=self._count):
+            self._rows[key] = row
+            self._keys_offset += len(key.encode("utf-8")) + 1
+        self._append(vectors)
+
+    def get_many(self, keys: List[str]) -> List[Optional[np.ndarray]]:
+        with self._lock:
+            if any(key not in self._rows for key in keys):
+                self._sync()
+            result = []
+            for key in keys:
+                row = self._rows.get(key)
+                result.append(None if row is None else self._buffer[row])
+            return result
+
+    def put_many(self, keys: List[str], vectors: List[List[float]]):
+        if not keys:
+            return
+        array = np.asarray(vectors, dtype=np.float32)
+        with self._lock:
+            if self.dim is None:
+                self._load_meta()
+            if self.dim is None:
+                self.dim = array.shape[1]
+                self._meta_path.write_text(json.dumps({"dim": self.dim, "dtype": self.dtype.name}))
+                self._buffer = np.zeros((0, self.dim), dtype=self.dtype)
+            with open(self.store_dir / ".lock", "w") as lock_file:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                self._sync() # 追加前先读入其他进程写入的内容, 保证行号一致
+                new_keys, new_rows, seen = [], [], set()
+                for key, vector in zip(keys, array):
+                    if key in self._rows or key in seen:
+                        continue
+                    seen.add(key)
+                    new_keys.append(key)
+                    new_rows.append(vector)
+                if not new_keys:
+                    return
+                new_vectors = np.stack(new_rows).astype(self.dtype)
+                # 先写向量再写键, 中途崩溃只会留下没有键的向量, 追加前截掉这部分
+                with open(self._vectors_path, "ab") as f:
+                    f.truncate(self._count * self.dim * self.dtype.itemsize)
+                    new_vectors.tofile(f)
+                keys_bytes = "".join(key + "\n" for key in new_keys).encode("utf-8")
+                with open(self._keys_path, "ab") as f:
+                    f.write(keys_bytes)
+                    f.flush()
+                    os.fsync(f.fileno())
+            for row, key in enumerate(new_keys, start=self._count):
+                self._rows[key] = row
+            self._keys_offset += len(keys_bytes)
+            self._append(new_vectors)
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+
+class CachedEmbedding(BaseEmbedding):
+    '''
+    带持久化缓存的嵌入模型, 包装任意llama_index嵌入模型
+    缓存键为(模型名, 文本类型, 文本哈希), 同一批次内相同的文本只嵌入一次
+    只有文档的嵌入写入持久化存储; 用户问题各不相同, 只在进程内按LRU保留最近的query_cache_size条
+    '''
+    _inner: BaseEmbedding = PrivateAttr()
+    _store: EmbeddingStore = PrivateAttr()
+    _query_cache: OrderedDict = PrivateAttr()
+    _query_cache_size: int = PrivateAttr()
+    _stats_lock: threading.Lock = PrivateAttr()
+    _hits: int = PrivateAttr(default=0)
+    _misses: int = PrivateAttr(default=0)
+    _deduped: int = PrivateAttr(default=0)
+
+    def __init__(
+        self,
+        embed_model: BaseEmbedding,
+        store: EmbeddingStore,
+        embed_batch_size: int = 1000,
+        query_cache_size: int = embed_query_cache_size,
+        **kwargs: Any
+    ):
+        super().__init__(model_name=embed_model.model_name, embed_batch_size=embed_batch_size, **kwargs)
+        self._inner = embed_model
+        self._store = store
+        self._query_cache = OrderedDict()
+        self._query_cache_size = query_cache_size
+        self._stats_lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._deduped = 0
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CachedEmbedding"
+
+    def _key(self, text: str, text_type: str) -> str:
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        return f"{self.model_name}:{text_type}:{digest}"
+
+    def _lookup(self, texts: List[str], text_type: str):
+        '''
+        查询缓存, 返回(每个文本的键, 已缓存的向量, 需要嵌入的去重后的键和文本)
+        '''
+        keys = [self._key(text, text_type) for text in texts]
+        cached = self._store.get_many(keys)
+        missing: Dict[str, str] = {}
+        for key, text, vector in zip(keys, texts, cached):
+            if vector is None:
+                missing.setdefault(key, text)
+        hits = sum(vector is not None for vector in cached)
+        with self._stats_lock:
+            self._hits += hits
+            self._misses += len(missing)
+            self._deduped += sum(vector is None for vector in cached) - len(missing)
+        increment("embed_cache_hits", hits, type=text_type)
+        increment("embed_cache_misses", len(missing), type=text_type)
+        if missing:
+            increment("embed_texts", len(missing), type=text_type)
+            increment("embed_tokens", sum(estimate_tokens(text) for text in missing.values()), type=text_type)
+        return keys, cached, missing
+
+    def _merge(self, keys, cached, missing_keys, missing_vectors) -> List[Embedding]:
+        self._store.put_many(missing_keys, missing_vectors)
+        fresh = dict(zip(missing_keys, missing_vectors))
+        return [
+            vector.astype(np.float32).tolist() if vector is not None else list(fresh[key])
+            for key, vector in zip(keys, cached)
+        ]
+
+    def _lookup_query(self, query: str):
+        '''
+        在进程内的LRU中查询问题的嵌入, 返回(键, 向量或None)
+        '''
+        key = self._key(query, "query")
+        with self._stats_lock:
+            vector = self._query_cache.get(key)
+            if vector is not None:
+                self._query_cache.move_to_end(key)
+                self._hits += 1
+            else:
+                self._misses += 1
+        if vector is not None:
+            increment("embed_cache_hits", type="query")
+        else:
+            increment("embed_cache_misses", type="query")
+            increment("embed_texts", type="query")
+            increment("embed_tokens", estimate_tokens(query), type="query")
+        return key, vector
+
+    def _remember_query(self, key: str, vector: Embedding) -> Embedding:
+        with self._stats_lock:
+            self._query_cache[key] = list(vector)
+            self._query_cache.move_to_end(key)
+            while len(self._query_cache) > self._query_cache_size:
+                self._query_cache.popitem(last=False)
+        return list(vector)
+
+    def _get_query_embedding(self, query: str) -> Embedding:
+        key, vector = self._lookup_query(query)
+        if vector is not None:
+            return list(vector)
+        with span("embed_batch", type="query"):
+            vector = self._inner.get_query_embedding(query)
+        return self._remember_query(key, vector)
+
+    async def _aget_query_embedding(self, query: str) -> Embedding:
+        key, vector = self._lookup_query(query)
+        if vector is not None:
+            return list(vector)
+        with span("embed_batch", type="query"):
+            vector = await self._inner.aget_query_embedding(query)
+        return self._remember_query(key, vector)
+
+    def _get_text_embedding(self, text: str) -> Embedding:
+        return self._get_text_embeddings([text])[0]
+
+    async def _aget_text_embedding(self, text: str) -> Embedding:
+        return (await self._aget_text_embeddings([text]))[0]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[Embedding]:
+        keys, cached, missing = self._lookup(texts, "text")
+        vectors = []
+        if missing:
+            with span("embed_batch", type="text"):
+                vectors = self._inner.get_text_embedding_batch(list(missing.values()))
+        return self._merge(keys, cached, list(missing), vectors)
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[Embedding]:
+        keys, cached, missing = self._lookup(texts, "text")
+        vectors = []
+        if missing:
+            with span("embed_batch", type="text"):
+                vectors = await self._inner.aget_text_embedding_batch(list(missing.values()))
+        return self._merge(keys, cached, list(missing), vectors)
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            total = self._hits + self._misses + self._deduped
+            return {
+                "hits": self._hits,
+                "misses": self._misses, # 实际请求嵌入的文本数
+                "deduped": self._deduped, # 批次内重复而省去的请求数
+                "hit_rate": (self._hits + self._deduped) / total if total else 0.0,
+                "entries": len(self._store),
+            }
@@ -0,0 +1,173 @@
+'''
+html表格转markdown: 基于标准库HTMLParser边读边收集单元格, 不构建完整的文档树
+输出与原先基于BeautifulSoup(html.parser)的实现逐字一致, 包括rowspan/colspan的展开方式、
+嵌套表格和未闭合标签的处理, 以及<script>/<style>等标签内文本的丢弃和CDATA文本的保留
+'''
+from html.parser import HTMLParser
+from typing import List
+
+# 与BeautifulSoup的html.parser一致, 这些标签没有闭合标签, 不会包含子节点
+_VOID_TAGS = frozenset([
+    "area", "base", "br", "col", "embed", "hr", "img", "input", "keygen", "link", "menuitem",
+    "meta", "param", "source", "track", "wbr", "basefont", "bgsound", "command", "frame",
+    "image", "isindex", "nextid", "spacer",
+])
+# BeautifulSoup把这些标签内的文本存为Script/Stylesheet等类型, get_text()不包含它们
+_HIDDEN_TEXT_TAGS = frozenset(["script", "style", "template", "rt", "rp"])
+
+
+class _Cell:
+    __slots__ = ("texts", "rowspan", "colspan")
+
+    def __init__(self, rowspan: int, colspan: int):
+        self.texts = []
+        self.rowspan = rowspan
+        self.colspan = colspan
+
+class _TableCollector(HTMLParser):
+    '''
+    收集第一个<table>中的行和单元格
+    和BeautifulSoup的find_all一样, 行包含其下所有层级的单元格, 单元格文本包含其下所有层级的文本
+    '''
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.found = False # 是否遇到过<table>
+        self.done = False  # 第一个<table>是否已闭合
+        self.rows = []
+        self._stack = []   # 打开的标签: (标签名, 行/单元格/None)
+        self._table_depth = 0 # 第一个<table>在栈中的位置
+        self._open_rows = []
+        self._open_cells = []
+        self._hidden_depth = 0 # 打开的_HIDDEN_TEXT_TAGS标签数
+
+    def handle_starttag(self, tag, attrs):
+        if self.done or tag in _VOID_TAGS:
+            return
+        element = None
+        if not self.found:
+            if tag == "table":
+                self.found = True
+                self._table_depth = len(self._stack)
+        elif tag == "tr":
+            element = []
+            self.rows.append(element)
+            self._open_rows.append(element)
+        elif tag == "td" or tag == "th":
+            attrs = dict(attrs)
+            element = _Cell(int(attrs.get("rowspan", 1)), int(attrs.get("colspan", 1)))
+            for row in self._open_rows:
+                row.append(element)
+            self._open_cells.append(element)
+        if tag in _HIDDEN_TEXT_TAGS:
+            self._hidden_depth += 1
+        self._stack.append((tag, element))
+
+    def handle_startendtag(self, tag, attrs):
+        # <td/>等自闭合写法按开始标签紧跟结束标签处理
+        self.handle_starttag(tag, attrs)
+        self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if self.done:
+            return
+        # 闭合最近一个同名标签及其内部未闭合的标签, 没有同名标签时忽略
+        for index in range(len(self._stack) - 1, -1, -1):
+            if self._stack[index][0] == tag:
+                break
+        else:
+            return
+        while len(self._stack) > index:
+            closed_tag, element = self._stack.pop()
+            if closed_tag in _HIDDEN_TEXT_TAGS:
+                self._hidden_depth -= 1
+            if element is None:
+                continue
+            if isinstance(element, _Cell):
+                self._open_cells.pop()
+            else:
+                self._open_rows.pop()
+        if self.found and len(self._stack) <= self._table_depth:
+            self.done = True
+
+    def handle_data(self, data):
+        if not self._hidden_depth:
+            self._add_text(data)
+
+    def unknown_decl(self, data):
+        # <![CDATA[...]]>的内容在BeautifulSoup中是CData, 不受所在标签的影响, 总是计入文本
+        if data.upper().startswith("CDATA["):
+            self._add_text(data[len("CDATA["):])
+
+    def _add_text(self, data):
+        if self._open_cells and not self.done:
+            text = data.strip()
+            if text:
+                for cell in self._open_cells:
+                    cell.texts.append(text)
+
+def _expand_rows(rows: List[List[_Cell]]) -> List[list]:
+    '''
+    按colspan复制单元格, 按rowspan为下方的行补充占位符(None)
+    '''
+    expanded_cells = []
+    max_cols = 0
+    for row in rows:
+        cells = []
+        for cell in row:
+            text = "".join(cell.texts)
+            cells.extend([(text, cell.rowspan)] * max(cell.colspan, 0))
+        expanded_cells.append(cells)
+        max_cols = max(max_cols, len(cells))
+
+    expanded_rows = []
+    rowspan_tracker = [0] * max_cols # 追踪每列的 rowspan
+    for cells in expanded_cells:
+        expanded_row = []
+        col_idx = 0
+        for text, rowspan in cells:
+            # 跳过因 rowspan 导致的占位列
+            while col_idx < max_cols and rowspan_tracker[col_idx] > 0:
+                expanded_row.append(None)
+                rowspan_tracker[col_idx] -= 1
+                col_idx += 1
+            expanded_row.append(text)
+            if rowspan > 1:
+                rowspan_tracker[col_idx] = rowspan - 1
+            col_idx += 1
+
+        # 补全因 rowspan 导致的剩余占位符
+        while col_idx < max_cols:
+            if rowspan_tracker[col_idx] > 0:
+                expanded_row.append(None)
+                rowspan_tracker[col_idx] -= 1
+            else:
+                expanded_row.append("")
+            col_idx += 1
+        expanded_rows.append(expanded_row)
+    return expanded_rows
+
+def html_table_to_markdown(html_table: str) -> str:
+    '''
+    html格式的表格解析为markdown, 第一行视为表头; 解析失败时返回空字符串
+    '''
+    try:
+        collector = _TableCollector()
+        collector.feed(html_table.strip())
+        collector.close()
+        if not collector.found:
+            raise ValueError("No <table> found in the HTML.")
+
+        expanded_rows = _expand_rows(collector.rows)
+        headers = expanded_rows[0]
+
+        lines = []
+        if headers:
+            lines.append("| " + " | ".join(h if h else "" for h in headers) + " |")
+            lines.append("| " + " | ".join("-" * (len(h) if h else 3) for h in headers) + " |")
+        for row in expanded_rows[1:]:
+            lines.append("| " + " | ".join(cell if cell else "" for cell in row) + " |")
+        return "".join(line + "\n" for line in lines)
+
+    except Exception as e:
+        print(f"Error parsing table: {e}")
+        return ''
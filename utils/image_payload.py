@@ -0,0 +1,97 @@
+'''
+发给VLM的图片预处理: 按像素和字节预算生成缩小、重新压缩后的派生图片并落盘,
+编码后的data URL在内存中做LRU缓存, 热门图片查询时不再读盘和重新编码
+'''
+import io
+import os
+import base64
+import hashlib
+from pathlib import Path
+from functools import lru_cache
+from typing import Tuple
+
+from PIL import Image
+
+from .cache import atomic_write, cache_dir
+
+image_max_pixels   = int(os.getenv("IMAGE_MAX_PIXELS", str(1024 * 1024)))
+image_max_bytes    = int(os.getenv("IMAGE_MAX_BYTES", str(512 * 1024)))
+image_payload_lru  = int(os.getenv("IMAGE_PAYLOAD_LRU", "256"))
+derivative_dir     = cache_dir / "image_derivatives"
+
+_MIME_TYPES = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp", "GIF": "image/gif"}
+_JPEG_QUALITIES = (85, 75, 65, 50)
+
+
+def _derivative_path(image_path: Path, stat: os.stat_result) -> Path:
+    key = f"{image_path.resolve()}|{stat.st_mtime_ns}|{stat.st_size}|{image_max_pixels}|{image_max_bytes}"
+    return derivative_dir / hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+def _encode(image: Image.Image, fmt: str, quality: int) -> bytes:
+    buffer = io.BytesIO()
+    if fmt == "JPEG":
+        image.save(buffer, format="JPEG", quality=quality, optimize=True)
+    else:
+        image.save(buffer, format=fmt, optimize=True)
+    return buffer.getvalue()
+
+def _shrink(image_bytes: bytes) -> Tuple[bytes, str]:
+    '''
+    把图片压到像素和字节预算以内, 返回(图片内容, 格式)
+    原图已满足预算时直接使用原图
+    '''
+    image = Image.open(io.BytesIO(image_bytes))
+    fmt = image.format if image.format in _MIME_TYPES else None
+    pixels = image.width * image.height
+    if fmt is not None and pixels <= image_max_pixels and len(image_bytes) <= image_max_bytes:
+        return image_bytes, fmt
+
+    has_alpha = image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+    fmt = "PNG" if has_alpha else "JPEG"
+    image = image.convert("RGBA" if has_alpha else "RGB")
+    scale = min(1.0, (image_max_pixels / pixels) ** 0.5)
+    while True:
+        size = (max(1, int(image.width * scale)), max(1, int(image.height * scale)))
+        resized = image.resize(size, Image.LANCZOS) if size != image.size else image
+        for quality in (_JPEG_QUALITIES if fmt == "JPEG" else (None,)):
+            data = _encode(resized, fmt, quality)
+            if len(data) <= image_max_bytes:
+                return data, fmt
+        if size == (1, 1):
+            return data, fmt
+        scale *= 0.75 # 降低质量仍超出预算时继续缩小
+
+def prepare_image(image_path: str) -> Tuple[Path, str]:
+    '''
+    生成(或复用已有的)派生图片, 返回(派生图片路径, MIME类型)
+    入库时调用一次即可预先生成
+    '''
+    image_path = Path(image_path)
+    stat = image_path.stat()
+    path = _derivative_path(image_path, stat)
+    for fmt, mime in _MIME_TYPES.items():
+        candidate = path.with_suffix("." + fmt.lower())
+        if candidate.exists():
+            return candidate, mime
+    data, fmt = _shrink(image_path.read_bytes())
+    candidate = path.with_suffix("." + fmt.lower())
+    atomic_write(candidate, data)
+    return candidate, _MIME_TYPES[fmt]
+
+def encode_data_url(path: Path, mime: str) -> str:
+    '''
+    把(派生)图片编码为data URL, 不经过内存缓存; 入库时每张图片只用一次, 不应挤掉查询时常用的图片
+    '''
+    img_b64 = base64.b64encode(Path(path).read_bytes()).decode("utf-8")
+    return f"data:{mime};base64,{img_b64}"
+
+@lru_cache(maxsize=image_payload_lru)
+def _data_url(image_path: str, mtime_ns: int, size: int) -> str:
+    return encode_data_url(*prepare_image(image_path))
+
+def image_data_url(image_path: str) -> str:
+    '''
+    图片的data URL, 以(路径, mtime, 大小)为键缓存在内存中, 原图更新后自动失效
+    '''
+    stat = os.stat(image_path)
+    return _data_url(str(image_path), stat.st_mtime_ns, stat.st_size)
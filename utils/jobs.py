@@ -0,0 +1,356 @@
+'''
+后台入库任务: 任务持久化在SQLite中, 由进程池中的工作进程执行解析、图片描述和嵌入,
+各阶段进度写回数据库供页面轮询; 刷新页面不会中断任务
+运行中的任务由所属进程定期写心跳, 进程退出后超过INGEST_JOB_LEASE秒没有心跳的任务重新排队
+'''
+import os
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import threading
+import multiprocessing
+from pathlib import Path
+from contextlib import contextmanager
+from typing import Callable, List, Optional
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from .metrics import span, registry
+
+ingest_workers       = int(os.getenv("INGEST_WORKERS", "2"))
+parse_shard_workers  = int(os.getenv("PARSE_SHARD_WORKERS", "0"))
+ingest_job_lease     = float(os.getenv("INGEST_JOB_LEASE", "60")) # 运行中的任务超过该秒数没有心跳时, 视为所属进程已退出
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+FINISHED_STATUSES = (DONE, FAILED, CANCELLED)
+
+
+class JobCancelled(Exception):
+    pass
+
+class JobQueue:
+    '''
+    基于SQLite的任务队列, 每次操作使用独立的连接, 可在多线程、多进程中使用
+    '''
+    def __init__(self, db_path: Path):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    file_path TEXT NOT NULL,
+                    progress TEXT NOT NULL DEFAULT '{}',
+                    error TEXT,
+                    cancel_requested INTEGER NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    owner TEXT,
+                    heartbeat_at REAL
+                )"""
+            )
+            # 旧版本创建的数据库没有owner/heartbeat_at列
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            if "owner" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+            if "heartbeat_at" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN heartbeat_at REAL")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn: # 正常退出时提交, 异常时回滚
+                yield conn
+        finally:
+            conn.close()
+
+    def submit(self, file_path: Path) -> str:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, status, file_path, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (job_id, QUEUED, str(file_path), now, now)
+            )
+        return job_id
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_dict(row) if row else None
+
+    def list_jobs(self, limit: int = 20) -> List[dict]:
+        with self._connect() as conn:
+            rows = conn.execute("SELECT * FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,)).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def active_job(self, file_path: Path) -> Optional[dict]:
+        '''
+        同一文件排队中或运行中的任务, 没有时返回None
+        '''
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE file_path = ? AND status IN (?, ?) ORDER BY created_at DESC LIMIT 1",
+                (str(file_path), QUEUED, RUNNING)
+            ).fetchone()
+        return self._to_dict(row) if row else None
+
+    def cancel(self, job_id: str):
+        '''
+        排队中的任务直接取消, 运行中的任务在下一次汇报进度时停止
+        '''
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET cancel_requested = 1, updated_at = ? WHERE id = ?", (time.time(), job_id))
+            conn.execute("UPDATE jobs SET status = ? WHERE id = ? AND status = ?", (CANCELLED, job_id, QUEUED))
+
+    def claim_next(self, owner: str) -> Optional[dict]:
+        '''
+        取出最早的排队任务, 标记为由owner运行中
+        '''
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT * FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1", (QUEUED,)).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            conn.execute(
+                "UPDATE jobs SET status = ?, owner = ?, heartbeat_at = ?, updated_at = ? WHERE id = ?",
+                (RUNNING, owner, now, now, row["id"])
+            )
+        return self._to_dict(row)
+
+    def heartbeat(self, owner: str):
+        '''
+        续约owner正在运行的任务
+        '''
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET heartbeat_at = ? WHERE status = ? AND owner = ?", (time.time(), RUNNING, owner))
+
+    def requeue_expired(self, lease: float = ingest_job_lease) -> int:
+        '''
+        超过lease秒没有心跳的运行中任务(所属进程已退出)重新排队, 其他进程仍在运行的任务不受影响
+        '''
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = ?, owner = NULL, updated_at = ? "
+                "WHERE status = ? AND (heartbeat_at IS NULL OR heartbeat_at < ?)",
+                (QUEUED, now, RUNNING, now - lease)
+            )
+            return cursor.rowcount
+
+    def requeue(self, job_id: str):
+        '''
+        把本进程未能开始执行的任务放回队列
+        '''
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, owner = NULL, updated_at = ? WHERE id = ? AND status = ?",
+                (QUEUED, time.time(), job_id, RUNNING)
+            )
+
+    def update_progress(self, job_id: str, stage: str, done: int, total: int):
+        '''
+        更新某个阶段的进度, 任务已被请求取消时抛出JobCancelled
+        '''
+        with self._connect() as conn:
+            row = conn.execute("SELECT progress, cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            progress = json.loads(row["progress"])
+            progress[stage] = {"done": done, "total": total}
+            conn.execute(
+                "UPDATE jobs SET progress = ?, updated_at = ? WHERE id = ?",
+                (json.dumps(progress), time.time(), job_id)
+            )
+        if row["cancel_requested"]:
+            raise JobCancelled(job_id)
+
+    def finish(self, job_id: str, status: str, error: str = None):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+                (status, error, time.time(), job_id)
+            )
+
+    @staticmethod
+    def _to_dict(row: sqlite3.Row) -> dict:
+        job = dict(row)
+        job["progress"] = json.loads(job["progress"])
+        job["cancel_requested"] = bool(job["cancel_requested"])
+        return job
+
+def _available_cpus() -> int:
+    if hasattr(os, "sched_getaffinity"):
+        return max(1, len(os.sched_getaffinity(0)))
+    return os.cpu_count() or 1
+
+def _limit_threads(threads: int):
+    '''
+    工作进程的初始化函数: 把OpenMP/BLAS(及之后导入的torch)的线程数限制为本进程分到的核数,
+    多个工作进程同时解析时不会各自占满所有核; 按页范围并行解析的子进程继承该限制后再平分
+    '''
+    for name in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[name] = str(threads)
+
+def run_ingest_job(db_path: str, job_id: str, file_path: str, parse_output_dir: str, persist_dir: str, shard_workers: int = 0):
+    '''
+    在工作进程中执行一个入库任务: 解析 -> 切分与图片描述 -> 嵌入
+    shard_workers: 解析时并行分析页范围的进程数, 0表示每个可用核一个进程
+    返回本任务记录的指标(见metrics.MetricsRegistry.drain), 由主进程合并后在/metrics中导出
+    '''
+    # 工作进程中才导入解析和嵌入模块, 避免拖慢主进程
+    from .parse_pdf import parse_doc
+    from .embedding import create_nodes, build_corpus, content_list_path
+
+    registry.drain() # 工作进程会被复用, 丢弃之前残留的指标
+
+    queue = JobQueue(db_path)
+
+    def progress_callback(stage: str, done: int, total: int):
+        queue.update_progress(job_id, stage, done, total)
+
+    try:
+        doc_path = Path(file_path)
+        output_path = Path(parse_output_dir) / doc_path.stem / "auto"
+        progress_callback("parse", 0, 0)
+        # 输出内容由PARSE_OUTPUT_PROFILE决定, lean时版面PDF在预览时再生成
+        with span("parse"):
+            parse_doc(path_list=[doc_path], output_dir=parse_output_dir, progress_callback=progress_callback, shard_workers=shard_workers)
+        progress_callback("caption", 0, 0) # parse_doc会吞掉异常, 这里再检查一次是否已取消
+        if not content_list_path(output_path, doc_path.stem).exists():
+            raise RuntimeError(f"解析{doc_path.name}失败")
+        with span("create_nodes"):
+            nodes_list = create_nodes(parsed_result_path_list=[output_path], progress_callback=progress_callback)
+        if not nodes_list or not nodes_list[0]:
+            raise RuntimeError(f"{doc_path.name}中没有可入库的内容")
+        progress_callback("embed", 0, 0)
+        with span("build_corpus"):
+            build_corpus(nodes_list=nodes_list, persist_dir=Path(persist_dir), progress_callback=progress_callback)
+        queue.finish(job_id, DONE)
+    except JobCancelled:
+        queue.finish(job_id, CANCELLED)
+    except Exception as e:
+        queue.finish(job_id, FAILED, error=str(e))
+    return registry.drain()
+
+class JobManager:
+    '''
+    任务调度: 后台线程从队列中取任务, 交给进程池执行, 同时最多运行max_workers个任务
+    工作进程被杀死(如解析时内存不足)后进程池不可再用, 这时换一个新的进程池, 后续任务照常执行
+    runner: 在工作进程中执行任务的函数, 参数与run_ingest_job相同
+    '''
+    def __init__(
+        self,
+        db_path: Path,
+        parse_output_dir: Path,
+        persist_dir: Path,
+        max_workers: int = ingest_workers,
+        runner: Callable = run_ingest_job
+    ):
+        self.queue = JobQueue(db_path)
+        # 多个进程(页面和service.py)可能共用同一个任务数据库, 每个进程以owner标识自己运行的任务
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.queue.requeue_expired()
+        self._parse_output_dir = str(parse_output_dir)
+        self._persist_dir = str(persist_dir)
+        # 每个工作进程都会按页范围并行解析, 总进程数不超过CPU核数
+        cpu_share = max(1, _available_cpus() // max(1, max_workers))
+        self._cpu_share = cpu_share
+        self._shard_workers = min(parse_shard_workers, cpu_share) if parse_shard_workers > 0 else cpu_share
+        self._runner = runner
+        self._max_workers = max_workers
+        self._slots = threading.Semaphore(max_workers)
+        self._wakeup = threading.Event()
+        self._executor_lock = threading.Lock()
+        self._executor = self._new_executor()
+        threading.Thread(target=self._dispatch, daemon=True).start()
+        threading.Thread(target=self._heartbeat, daemon=True).start()
+
+    def submit(self, file_path: Path) -> str:
+        job_id = self.queue.submit(file_path)
+        self._wakeup.set()
+        return job_id
+
+    def _new_executor(self) -> ProcessPoolExecutor:
+        # 用spawn启动工作进程, 避免fork带有线程的Streamlit进程
+        return ProcessPoolExecutor(
+            max_workers=self._max_workers, mp_context=multiprocessing.get_context("spawn"),
+            initializer=_limit_threads, initargs=(self._cpu_share,)
+        )
+
+    def _replace_executor(self, broken: ProcessPoolExecutor):
+        '''
+        替换已损坏的进程池, 多个线程同时发现时只替换一次
+        '''
+        with self._executor_lock:
+            if self._executor is broken:
+                print("入库工作进程异常退出, 重新创建进程池")
+                broken.shutdown(wait=False, cancel_futures=True)
+                self._executor = self._new_executor()
+
+    def _heartbeat(self):
+        '''
+        定期续约本进程运行中的任务, 并把已失去心跳的任务重新排队
+        '''
+        while True:
+            time.sleep(ingest_job_lease / 4)
+            try:
+                self.queue.heartbeat(self.owner)
+                if self.queue.requeue_expired():
+                    self._wakeup.set()
+            except sqlite3.Error as e:
+                print(f"更新任务心跳失败: {e}")
+
+    def _dispatch(self):
+        while True:
+            self._slots.acquire()
+            job = self.queue.claim_next(self.owner)
+            if job is None:
+                self._slots.release()
+                self._wakeup.wait(timeout=1.0)
+                self._wakeup.clear()
+                continue
+            executor = self._executor
+            try:
+                future = executor.submit(
+                    self._runner, str(self.queue.db_path), job["id"], job["file_path"],
+                    self._parse_output_dir, self._persist_dir, self._shard_workers
+                )
+            except (BrokenProcessPool, RuntimeError):
+                # 进程池已损坏(之前的任务的工作进程被杀死), 任务还没开始执行, 放回队列后换新的进程池
+                self.queue.requeue(job["id"])
+                self._slots.release()
+                self._replace_executor(executor)
+                continue
+            future.add_done_callback(lambda f, job_id=job["id"], executor=executor: self._on_done(f, job_id, executor))
+
+    def _on_done(self, future, job_id: str, executor: ProcessPoolExecutor):
+        self._slots.release()
+        error = None if future.cancelled() else future.exception()
+        if future.cancelled() or isinstance(error, BrokenProcessPool):
+            # 工作进程被杀死, 同一进程池中运行的任务都会以此结束
+            self.queue.finish(job_id, FAILED, error="入库工作进程异常退出")
+            self._replace_executor(executor)
+            self._wakeup.set()
+        elif error is not None:
+            self.queue.finish(job_id, FAILED, error=str(error))
+        elif isinstance(future.result(), dict):
+            registry.merge(future.result()) # 工作进程中记录的解析、图片描述和嵌入指标
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+def get_job_manager(db_path: Path, parse_output_dir: Path, persist_dir: Path) -> JobManager:
+    '''
+    进程内每个任务数据库只创建一个JobManager, Streamlit的rerun和各会话共享
+    '''
+    with _managers_lock:
+        key = str(db_path)
+        if key not in _managers:
+            _managers[key] = JobManager(db_path, parse_output_dir, persist_dir)
+        return _managers[key]
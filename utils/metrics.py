@@ -0,0 +1,217 @@
+'''
+流水线各阶段的耗时埋点和计数器
+span()记录阶段耗时(直方图), increment()累加计数(token数、字节数、缓存命中等)
+指标可以按Prometheus文本格式导出(METRICS_PORT开启/metrics接口, 默认只监听本机), 每个span也可以写成一行JSON日志(METRICS_LOG_FILE)
+入库任务在工作进程中执行, 其指标由drain()取出, 随任务结果交回主进程merge()
+trace()收集当前上下文中的span, 用于展示单个回答的耗时分解
+'''
+import os
+import json
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+metrics_port     = int(os.getenv("METRICS_PORT", "0"))
+metrics_host     = os.getenv("METRICS_HOST", "127.0.0.1")
+metrics_log_file = os.getenv("METRICS_LOG_FILE", "")
+
+_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, float("inf"))
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: dict) -> LabelKey:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+def _format_labels(labels: LabelKey, extra: dict = None) -> str:
+    items = list(labels) + list((extra or {}).items())
+    if not items:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in items)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(items, escaped)) + "}"
+
+class MetricsRegistry:
+    '''
+    进程内的指标: 阶段耗时直方图和计数器, 线程安全
+    '''
+    def __init__(self, log_file: str = ""):
+        self._lock = threading.Lock()
+        self._histograms: Dict[Tuple[str, LabelKey], list] = {} # (阶段, 标签) -> [各桶计数, 总和, 次数]
+        self._counters: Dict[Tuple[str, LabelKey], float] = {}
+        self._log_file = log_file
+        self._log = None
+
+    def observe(self, stage: str, seconds: float, labels: dict = None):
+        key = (stage, _label_key(labels or {}))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * len(_BUCKETS), 0.0, 0]
+            for index, bound in enumerate(_BUCKETS):
+                if seconds <= bound:
+                    histogram[0][index] += 1
+                    break
+            histogram[1] += seconds
+            histogram[2] += 1
+        self.log({"type": "span", "stage": stage, "seconds": round(seconds, 6), "labels": labels or {}})
+
+    def increment(self, name: str, value: float = 1, labels: dict = None):
+        key = (name, _label_key(labels or {}))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def log(self, record: dict):
+        '''
+        写一行JSON日志, 未配置日志文件时不写
+        '''
+        if not self._log_file:
+            return
+        line = json.dumps({"ts": time.time(), "pid": os.getpid(), **record}, ensure_ascii=False, default=str)
+        with self._lock:
+            if self._log is None:
+                os.makedirs(os.path.dirname(os.path.abspath(self._log_file)), exist_ok=True)
+                self._log = open(self._log_file, "a", encoding="utf-8", buffering=1) # 按行缓冲, 多进程追加写
+            self._log.write(line + "\n")
+
+    def prometheus_text(self) -> str:
+        lines = []
+        with self._lock:
+            if self._histograms:
+                lines.append("# HELP rag_stage_duration_seconds Duration of pipeline stages")
+                lines.append("# TYPE rag_stage_duration_seconds histogram")
+            for (stage, labels), (buckets, total, count) in sorted(self._histograms.items()):
+                stage_labels = (("stage", stage),) + labels
+                cumulative = 0
+                for bound, bucket_count in zip(_BUCKETS, buckets):
+                    cumulative += bucket_count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"rag_stage_duration_seconds_bucket{_format_labels(stage_labels, {'le': le})} {cumulative}")
+                lines.append(f"rag_stage_duration_seconds_sum{_format_labels(stage_labels)} {total}")
+                lines.append(f"rag_stage_duration_seconds_count{_format_labels(stage_labels)} {count}")
+            names = sorted(set(name for name, _ in self._counters))
+            for name in names:
+                lines.append(f"# TYPE rag_{name}_total counter")
+                for (counter_name, labels), value in sorted(self._counters.items()):
+                    if counter_name == name:
+                        lines.append(f"rag_{name}_total{_format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def drain(self) -> dict:
+        '''
+        取出并清空直方图和计数器, 用于把工作进程的指标交给主进程
+        '''
+        with self._lock:
+            state = {"histograms": self._histograms, "counters": self._counters}
+            self._histograms, self._counters = {}, {}
+        return state
+
+    def merge(self, state: dict):
+        '''
+        累加drain()取出的指标
+        '''
+        with self._lock:
+            for key, (buckets, total, count) in state["histograms"].items():
+                histogram = self._histograms.get(key)
+                if histogram is None:
+                    histogram = self._histograms[key] = [[0] * len(_BUCKETS), 0.0, 0]
+                histogram[0] = [a + b for a, b in zip(histogram[0], buckets)]
+                histogram[1] += total
+                histogram[2] += count
+            for key, value in state["counters"].items():
+                self._counters[key] = self._counters.get(key, 0) + value
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "stages": [
+                    {"stage": stage, "labels": dict(labels), "count": count, "seconds": total}
+                    for (stage, labels), (_, total, count) in sorted(self._histograms.items())
+                ],
+                "counters": [
+                    {"name": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in sorted(self._counters.items())
+                ],
+            }
+
+# 进程内共享的指标
+registry = MetricsRegistry(log_file=metrics_log_file)
+
+@contextmanager
+def span(stage: str, **labels):
+    '''
+    记录一个阶段的耗时, 同时加入当前的trace
+    '''
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - start, **labels)
+
+def record(stage: str, seconds: float, **labels):
+    '''
+    记录已知耗时的阶段, 用于无法用with包裹的场景(如流式响应)
+    '''
+    registry.observe(stage, seconds, labels)
+    spans = _current_trace.get()
+    if spans is not None:
+        spans.append((stage, seconds))
+
+def increment(name: str, value: float = 1, **labels):
+    registry.increment(name, value, labels)
+
+@contextmanager
+def trace():
+    '''
+    收集当前上下文中结束的span, 返回[(阶段, 秒)]列表
+    span在其他线程中结束时不会被收集
+    '''
+    spans: List[Tuple[str, float]] = []
+    token = _current_trace.set(spans)
+    try:
+        yield spans
+    finally:
+        _current_trace.reset(token)
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        path = self.path.split("?")[0].rstrip("/")
+        if path == "/metrics":
+            body, content_type = registry.prometheus_text().encode("utf-8"), "text/plain; version=0.0.4"
+        elif path == "/metrics.json":
+            body, content_type = json.dumps(registry.snapshot(), ensure_ascii=False).encode("utf-8"), "application/json"
+        else:
+            self.send_response(404)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+_server: Optional[ThreadingHTTPServer] = None
+_server_lock = threading.Lock()
+
+def start_metrics_server(port: int = metrics_port, host: str = metrics_host) -> Optional[ThreadingHTTPServer]:
+    '''
+    在后台线程中提供/metrics(Prometheus)和/metrics.json, port为0时不启动; 重复调用只启动一次
+    '''
+    global _server
+    if port <= 0:
+        return None
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, daemon=True).start()
+        return _server
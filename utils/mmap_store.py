@@ -0,0 +1,375 @@
+'''
+内存映射的向量库, 可以代替Chroma(VECTOR_STORE=mmap)
+每个集合一个目录persist_dir/mmap/<集合名>/, 每次写入生成新的一代gen-<序号>/, CURRENT文件记录当前一代:
+    vectors.npy           L2归一化后的float16向量, 精排时使用
+    codes.npy/scales.npy  int8量化向量和每行的缩放系数(dtype为int8时), 粗排时扫描
+    ids.txt               每行一个节点ID, 行号即向量的行号
+    nodes.jsonl/offsets.npy  节点文本和元数据, 按行号随机读取
+    ivf.npz               IVF倒排: 聚类中心和每个簇的行范围, 节点数达到ivf_min_nodes时生成, 向量按簇连续存放
+    meta.json
+数组都以np.load(mmap_mode="r")打开, 打开集合只读取meta.json, 各进程共享同一份页缓存, 不复制向量
+查询时先扫描int8/float16向量(有IVF时只扫描最近的nprobe个簇)粗排, 再用float16向量对前top_k*rerank_factor个候选精确重排
+写入(add/delete_nodes)先暂存在内存中, commit()时生成新的一代; 旧一代的文件在正在读取的进程中仍然有效
+'''
+import os
+import json
+import mmap
+import shutil
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from llama_index.core.schema import BaseNode
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.vector_stores.types import (
+    BasePydanticVectorStore, MetadataFilters, VectorStoreQuery, VectorStoreQueryResult
+)
+from llama_index.core.vector_stores.utils import node_to_metadata_dict, metadata_dict_to_node
+
+from .cache import atomic_write
+
+try:
+    import fcntl
+except ImportError: # Windows下不做跨进程加锁
+    fcntl = None
+
+vector_store_dtype         = os.getenv("VECTOR_STORE_DTYPE", "float16")
+vector_store_ivf_min_nodes = int(os.getenv("VECTOR_STORE_IVF_MIN_NODES", "20000"))
+vector_store_nprobe        = int(os.getenv("VECTOR_STORE_NPROBE", "16"))
+vector_store_rerank_factor = int(os.getenv("VECTOR_STORE_RERANK_FACTOR", "4"))
+
+CURRENT_FILE = "CURRENT"
+SCAN_CHUNK_ROWS = 65536 # 粗排时每次转换为float32的行数, 限制临时内存
+
+
+def mmap_store_dir(persist_dir: Path, collection: str) -> Path:
+    return Path(persist_dir) / "mmap" / collection
+
+def list_mmap_collections(persist_dir: Path) -> List[str]:
+    root = Path(persist_dir) / "mmap"
+    if not root.exists():
+        return []
+    return sorted(path.name for path in root.iterdir() if (path / CURRENT_FILE).exists())
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms > 0, norms, 1.0)
+
+def _quantize(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    '''
+    每行对称量化为int8, 返回(int8向量, 每行的缩放系数)
+    '''
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales = np.where(scales > 0, scales, 1.0).astype(np.float32)
+    codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales
+
+def _assign(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    labels = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), SCAN_CHUNK_ROWS):
+        chunk = np.asarray(vectors[start:start + SCAN_CHUNK_ROWS], dtype=np.float32)
+        labels[start:start + len(chunk)] = np.argmax(chunk @ centroids.T, axis=1)
+    return labels
+
+def _kmeans(vectors: np.ndarray, n_lists: int, iterations: int = 10, sample_size: int = 65536, seed: int = 0) -> np.ndarray:
+    '''
+    球面k-means(余弦相似度), 在最多sample_size个采样向量上训练, 返回归一化后的聚类中心
+    '''
+    rng = np.random.default_rng(seed)
+    sample_rows = np.sort(rng.choice(len(vectors), size=min(len(vectors), sample_size), replace=False))
+    sample = np.asarray(vectors[sample_rows], dtype=np.float32)
+    centroids = sample[rng.choice(len(sample), size=n_lists, replace=False)].copy()
+    for _ in range(iterations):
+        labels = _assign(sample, centroids)
+        order = np.argsort(labels, kind="stable")
+        present, starts = np.unique(labels[order], return_index=True)
+        sums = np.add.reduceat(sample[order], starts, axis=0)
+        # 空簇重新随机取一个采样点作为中心
+        centroids = sample[rng.choice(len(sample), size=n_lists)].copy()
+        centroids[present] = sums
+        centroids = _normalize(centroids).astype(np.float32)
+    return centroids
+
+class MmapVectorStore(BasePydanticVectorStore):
+    '''
+    基于内存映射文件的向量库, 只支持余弦相似度的向量检索, 不支持元数据过滤
+    dtype: 粗排扫描的向量类型, float16或int8
+    ivf_min_nodes: 节点数达到该值时建立IVF索引, 小于等于0时不建立
+    '''
+    stores_text: bool = True
+    store_dir: str
+    dtype: str = vector_store_dtype
+    ivf_min_nodes: int = vector_store_ivf_min_nodes
+    nprobe: int = vector_store_nprobe
+    rerank_factor: int = vector_store_rerank_factor
+
+    _generation: Optional[str] = PrivateAttr(default=None)
+    _meta: dict = PrivateAttr(default_factory=dict)
+    _vectors: Optional[np.ndarray] = PrivateAttr(default=None)
+    _codes: Optional[np.ndarray] = PrivateAttr(default=None)
+    _scales: Optional[np.ndarray] = PrivateAttr(default=None)
+    _offsets: Optional[np.ndarray] = PrivateAttr(default=None)
+    _nodes_file: Any = PrivateAttr(default=None)
+    _nodes_mmap: Any = PrivateAttr(default=None)
+    _centroids: Optional[np.ndarray] = PrivateAttr(default=None)
+    _list_offsets: Optional[np.ndarray] = PrivateAttr(default=None)
+    _ids: Optional[List[str]] = PrivateAttr(default=None)
+    _rows: Optional[Dict[str, int]] = PrivateAttr(default=None)
+    _pending: Dict[str, BaseNode] = PrivateAttr(default_factory=dict)
+    _deleted: set = PrivateAttr(default_factory=set)
+
+    def __init__(self, store_dir: Path, **kwargs: Any):
+        super().__init__(store_dir=str(store_dir), **kwargs)
+        if self.dtype not in ("float16", "int8"):
+            raise ValueError(f"不支持的向量类型{self.dtype}, 可选float16/int8")
+        self._open()
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "MmapVectorStore"
+
+    @staticmethod
+    def exists(store_dir: Path) -> bool:
+        return (Path(store_dir) / CURRENT_FILE).exists()
+
+    @property
+    def client(self) -> Any:
+        return None
+
+    @property
+    def count(self) -> int:
+        # 不定义__len__: llama_index用真值判断是否传入了vector_store, 空库会被当成未传入
+        return self._meta.get("count", 0)
+
+    def _open(self):
+        '''
+        打开当前一代的文件, 只读取meta.json, 其余文件做内存映射
+        '''
+        self._close()
+        current = Path(self.store_dir) / CURRENT_FILE
+        if not current.exists():
+            self._generation, self._meta = None, {}
+            return
+        self._generation = current.read_text().strip()
+        gen_dir = Path(self.store_dir) / self._generation
+        self._meta = json.loads((gen_dir / "meta.json").read_text())
+        if self._meta["count"] == 0:
+            return
+        self._vectors = np.load(gen_dir / "vectors.npy", mmap_mode="r")
+        self._offsets = np.load(gen_dir / "offsets.npy", mmap_mode="r")
+        if self._meta["dtype"] == "int8":
+            self._codes = np.load(gen_dir / "codes.npy", mmap_mode="r")
+            self._scales = np.load(gen_dir / "scales.npy", mmap_mode="r")
+        if (gen_dir / "ivf.npz").exists():
+            with np.load(gen_dir / "ivf.npz") as ivf:
+                self._centroids = ivf["centroids"]
+                self._list_offsets = ivf["offsets"]
+        self._nodes_file = open(gen_dir / "nodes.jsonl", "rb")
+        self._nodes_mmap = mmap.mmap(self._nodes_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _close(self):
+        if self._nodes_mmap is not None:
+            self._nodes_mmap.close()
+            self._nodes_file.close()
+        self._vectors = self._codes = self._scales = self._offsets = None
+        self._nodes_file = self._nodes_mmap = None
+        self._centroids = self._list_offsets = None
+        self._ids = self._rows = None
+
+    def node_ids(self) -> List[str]:
+        '''
+        已提交的节点ID, 按行号排列
+        '''
+        if self._ids is None:
+            if not self.count:
+                self._ids = []
+            else:
+                text = (Path(self.store_dir) / self._generation / "ids.txt").read_text(encoding="utf-8")
+                self._ids = text.split("\n")[:self.count]
+        return self._ids
+
+    def _row_index(self) -> Dict[str, int]:
+        if self._rows is None:
+            self._rows = {node_id: row for row, node_id in enumerate(self.node_ids())}
+        return self._rows
+
+    def _read_record(self, row: int) -> bytes:
+        return self._nodes_mmap[int(self._offsets[row]):int(self._offsets[row + 1]) - 1] # 不含行尾换行符
+
+    def _read_node(self, row: int) -> BaseNode:
+        record = json.loads(self._read_record(row))
+        node = metadata_dict_to_node(record["metadata"], text=record["text"])
+        # 带上归一化后的float16向量, 组装上下文时用于去重, 不必再请求嵌入模型
+        node.embedding = np.asarray(self._vectors[row], dtype=np.float32).tolist()
+        return node
+
+    def search(self, query_embedding: List[float], top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        '''
+        返回(行号, 余弦相似度), 按相似度从高到低排列
+        '''
+        count = self.count
+        if count == 0 or top_k <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        query = _normalize(np.asarray(query_embedding, dtype=np.float32))
+        if len(query) != self._meta["dim"]:
+            raise ValueError(f"查询向量维度{len(query)}与向量库维度{self._meta['dim']}不一致")
+
+        if self._centroids is not None:
+            probe = np.argsort(-(self._centroids @ query))[:self.nprobe]
+            ranges = sorted((int(self._list_offsets[i]), int(self._list_offsets[i + 1])) for i in probe)
+        else:
+            ranges = [(0, count)]
+        scan = self._codes if self._codes is not None else self._vectors
+        rows, scores = [], []
+        for start, end in ranges:
+            for chunk_start in range(start, end, SCAN_CHUNK_ROWS):
+                chunk_end = min(end, chunk_start + SCAN_CHUNK_ROWS)
+                chunk_scores = np.asarray(scan[chunk_start:chunk_end], dtype=np.float32) @ query
+                if self._scales is not None:
+                    chunk_scores *= self._scales[chunk_start:chunk_end]
+                rows.append(np.arange(chunk_start, chunk_end))
+                scores.append(chunk_scores)
+        rows, scores = np.concatenate(rows), np.concatenate(scores)
+
+        # 量化或近似检索时多取一些候选, 再用float16向量精确重排
+        approximate = self._codes is not None or self._centroids is not None
+        candidates = min(len(rows), top_k * max(1, self.rerank_factor) if approximate else top_k)
+        top = np.argpartition(-scores, candidates - 1)[:candidates]
+        rows, scores = rows[top], scores[top]
+        if approximate:
+            rows = np.sort(rows) # 按行号顺序读取, 减少随机访问
+            scores = np.asarray(self._vectors[rows], dtype=np.float32) @ query
+        order = np.argsort(-scores)[:top_k]
+        return rows[order], scores[order]
+
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        if query.filters is not None:
+            raise NotImplementedError("MmapVectorStore不支持元数据过滤")
+        if query.query_embedding is None:
+            raise ValueError("MmapVectorStore只支持向量检索")
+        rows, scores = self.search(query.query_embedding, query.similarity_top_k)
+        nodes = [self._read_node(row) for row in rows]
+        return VectorStoreQueryResult(
+            nodes=nodes,
+            similarities=[float(score) for score in scores],
+            ids=[node.node_id for node in nodes],
+        )
+
+    def get_nodes(self, node_ids: Optional[List[str]] = None, filters: Optional[MetadataFilters] = None) -> List[BaseNode]:
+        if filters is not None:
+            raise NotImplementedError("MmapVectorStore不支持元数据过滤")
+        rows = self._row_index()
+        if node_ids is None:
+            return [self._read_node(row) for row in range(self.count)]
+        return [self._read_node(rows[node_id]) for node_id in node_ids if node_id in rows]
+
+    def documents(self) -> Tuple[List[str], List[str]]:
+        '''
+        所有已提交节点的(ID, 文本), 用于重建BM25索引
+        '''
+        texts = [json.loads(self._read_record(row))["text"] for row in range(self.count)]
+        return list(self.node_ids()), texts
+
+    def add(self, nodes: Sequence[BaseNode], **kwargs: Any) -> List[str]:
+        '''
+        暂存节点(必须已有嵌入), commit()后才可以检索
+        '''
+        for node in nodes:
+            if node.embedding is None:
+                raise ValueError(f"节点{node.node_id}没有嵌入")
+            self._pending[node.node_id] = node
+            self._deleted.discard(node.node_id)
+        return [node.node_id for node in nodes]
+
+    def delete_nodes(self, node_ids: Optional[List[str]] = None, filters: Optional[MetadataFilters] = None, **delete_kwargs: Any) -> None:
+        if filters is not None:
+            raise NotImplementedError("MmapVectorStore不支持元数据过滤")
+        for node_id in node_ids or []:
+            self._pending.pop(node_id, None)
+            self._deleted.add(node_id)
+
+    def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+        self.delete_nodes([
+            node_id for row, node_id in enumerate(self.node_ids())
+            if self._read_node(row).ref_doc_id == ref_doc_id
+        ])
+
+    def clear(self) -> None:
+        self._pending.clear()
+        self._deleted.update(self.node_ids())
+
+    def commit(self):
+        '''
+        把暂存的新增和删除写成新的一代, 并切换到新的一代
+        '''
+        if not self._pending and not self._deleted:
+            return
+        store_dir = Path(self.store_dir)
+        store_dir.mkdir(parents=True, exist_ok=True)
+        with open(store_dir / ".lock", "w") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            self._open() # 其他进程可能已经提交过, 在最新的一代上合并
+            self._write_generation(store_dir)
+        self._pending.clear()
+        self._deleted.clear()
+
+    def _write_generation(self, store_dir: Path):
+        removed = self._deleted | set(self._pending)
+        keep_rows = np.array([row for row, node_id in enumerate(self.node_ids()) if node_id not in removed], dtype=np.int64)
+        new_nodes = list(self._pending.values())
+        ids = [self.node_ids()[row] for row in keep_rows] + [node.node_id for node in new_nodes]
+        records = [self._read_record(row) for row in keep_rows] + [
+            json.dumps({
+                "id": node.node_id,
+                "text": node.get_content(),
+                "metadata": node_to_metadata_dict(node, remove_text=True, flat_metadata=False),
+            }, ensure_ascii=False).encode("utf-8") for node in new_nodes
+        ]
+        dim = self._meta.get("dim") or (len(new_nodes[0].embedding) if new_nodes else 0)
+        vectors = np.zeros((len(ids), dim), dtype=np.float16)
+        if len(keep_rows):
+            vectors[:len(keep_rows)] = self._vectors[keep_rows]
+        if new_nodes:
+            new_vectors = np.asarray([node.embedding for node in new_nodes], dtype=np.float32)
+            if new_vectors.shape[1] != dim:
+                raise ValueError(f"嵌入维度{new_vectors.shape[1]}与向量库维度{dim}不一致")
+            vectors[len(keep_rows):] = _normalize(new_vectors)
+
+        centroids = None
+        if 0 < self.ivf_min_nodes <= len(ids):
+            # 按簇重排各行, 每个簇在文件中连续存放, 查询时只读取探测到的簇
+            centroids = _kmeans(vectors, n_lists=max(1, int(np.sqrt(len(ids)))))
+            labels = _assign(vectors, centroids)
+            order = np.argsort(labels, kind="stable")
+            vectors, ids, records = vectors[order], [ids[i] for i in order], [records[i] for i in order]
+            list_offsets = np.searchsorted(labels[order], np.arange(len(centroids) + 1)).astype(np.int64)
+
+        generation = f"gen-{int(self._generation.split('-')[1]) + 1 if self._generation else 1:06d}"
+        gen_dir = store_dir / generation
+        if gen_dir.exists(): # 上次写入中途失败留下的目录
+            shutil.rmtree(gen_dir)
+        gen_dir.mkdir()
+        np.save(gen_dir / "vectors.npy", vectors)
+        if self.dtype == "int8":
+            codes, scales = _quantize(vectors.astype(np.float32))
+            np.save(gen_dir / "codes.npy", codes)
+            np.save(gen_dir / "scales.npy", scales)
+        if centroids is not None:
+            np.savez(gen_dir / "ivf.npz", centroids=centroids, offsets=list_offsets)
+        with open(gen_dir / "nodes.jsonl", "wb") as f:
+            for record in records:
+                f.write(record + b"\n")
+        offsets = np.zeros(len(records) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(record) + 1 for record in records])
+        np.save(gen_dir / "offsets.npy", offsets)
+        (gen_dir / "ids.txt").write_text("\n".join(ids), encoding="utf-8")
+        (gen_dir / "meta.json").write_text(json.dumps({"count": len(ids), "dim": dim, "dtype": self.dtype}))
+
+        previous = self._generation
+        atomic_write(store_dir / CURRENT_FILE, generation.encode("utf-8"))
+        # 保留上一代给仍在读取的进程, 更早的删除(已映射的文件删除后在Linux上仍可读取)
+        for path in store_dir.glob("gen-*"):
+            if path.name not in (generation, previous):
+                shutil.rmtree(path, ignore_errors=True)
+        self._open()
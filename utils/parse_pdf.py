@@ -1,21 +1,166 @@
 # Copyright (c) Opendatalab. All rights reserved.
 import copy
+import gzip
+import hashlib
 import json
 import os
+import shutil
+import sys
+import multiprocessing
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pypdfium2 as pdfium
 
 from loguru import logger
 
-from mineru.cli.common import convert_pdf_bytes_to_bytes_by_pypdfium2, prepare_env, read_fn
-from mineru.data.data_reader_writer import FileBasedDataWriter
-from mineru.utils.draw_bbox import draw_layout_bbox, draw_span_bbox
-from mineru.utils.enum_class import MakeMode
-from mineru.backend.vlm.vlm_analyze import doc_analyze as vlm_doc_analyze
-from mineru.backend.pipeline.pipeline_analyze import doc_analyze as pipeline_doc_analyze
-from mineru.backend.pipeline.pipeline_middle_json_mkcontent import union_make as pipeline_union_make
-from mineru.backend.pipeline.model_json_to_middle_json import result_to_middle_json as pipeline_result_to_middle_json
-from mineru.backend.vlm.vlm_middle_json_mkcontent import union_make as vlm_union_make
-from mineru.utils.guess_suffix_or_lang import guess_suffix_by_path
+# MinerU modules are imported inside the functions that use them: importing them loads the model stack,
+# which the query process (e.g. ensure_layout_pdf on an already rendered layout PDF) should not pay for
+
+
+# Number of pages analyzed per checkpoint; an interrupted parse resumes from the last finished range
+PARSE_CHECKPOINT_PAGES = int(os.getenv("PARSE_CHECKPOINT_PAGES", "50"))
+PARSE_MANIFEST_NAME = "parse_manifest.json"
+# Worker processes analyzing page ranges in parallel, 0 means one per available core
+PARSE_SHARD_WORKERS = int(os.getenv("PARSE_SHARD_WORKERS", "0"))
+# Lower bound of a shard's size, each worker loads its own models so tiny shards do not pay off
+PARSE_MIN_SHARD_PAGES = 8
+# "full" writes every MinerU artifact; "lean" writes only the content list and images needed for ingestion
+PARSE_OUTPUT_PROFILE = os.getenv("PARSE_OUTPUT_PROFILE", "full")
+# Whether the lean profile gzips its JSON output
+PARSE_COMPRESS_JSON = os.getenv("PARSE_COMPRESS_JSON", "1") not in ("0", "false", "False")
+
+
+def _write_json_atomic(path: Path, obj, indent=None):
+    """Write JSON to a temp file next to `path` and rename it into place"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(obj, f, ensure_ascii=False, indent=indent)
+    os.replace(tmp_path, path)
+
+
+def _write_json_gz_atomic(path: Path, obj):
+    """Write compact gzipped JSON to a temp file next to `path` and rename it into place"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    with gzip.open(tmp_path, "wt", encoding="utf-8", compresslevel=6) as f:
+        json.dump(obj, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp_path, path)
+
+
+def _parse_key(pdf_sha256: str, options: dict) -> str:
+    """Cache key of a parse: hash of the input bytes plus every option that changes the output"""
+    payload = json.dumps({"pdf_sha256": pdf_sha256, "options": options}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _is_parsed(local_md_dir, pdf_file_name: str, parse_key: str) -> bool:
+    manifest_path = Path(local_md_dir) / PARSE_MANIFEST_NAME
+    if not manifest_path.exists():
+        return False
+    try:
+        manifest = json.loads(manifest_path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return False
+    return manifest.get("parse_key") == parse_key and any(
+        (Path(local_md_dir) / f"{pdf_file_name}_content_list{suffix}").exists() for suffix in (".json", ".json.gz")
+    )
+
+
+def _analyze_range(
+        backend, pdf_bytes, lang, image_writer, parse_method,
+        formula_enable, table_enable, server_url, keep_model_output=True
+):
+    """
+    Run the model on (a page range of) one PDF, returning its middle json and raw model output.
+    Without `keep_model_output` the model output is None and the pipeline skips its deepcopy.
+    """
+    if backend == "pipeline":
+        from mineru.backend.pipeline.pipeline_analyze import doc_analyze as pipeline_doc_analyze
+        from mineru.backend.pipeline.model_json_to_middle_json import result_to_middle_json as pipeline_result_to_middle_json
+
+        infer_results, all_image_lists, all_pdf_docs, lang_list, ocr_enabled_list = pipeline_doc_analyze(
+            [pdf_bytes], [lang], parse_method=parse_method, formula_enable=formula_enable, table_enable=table_enable
+        )
+        model_list = infer_results[0]
+        # result_to_middle_json mutates the model list, so the raw output has to be copied first
+        model_json = copy.deepcopy(model_list) if keep_model_output else None
+        middle_json = pipeline_result_to_middle_json(
+            model_list, all_image_lists[0], all_pdf_docs[0], image_writer,
+            lang_list[0], ocr_enabled_list[0], formula_enable
+        )
+        return middle_json, model_json
+    from mineru.backend.vlm.vlm_analyze import doc_analyze as vlm_doc_analyze
+
+    middle_json, infer_result = vlm_doc_analyze(pdf_bytes, image_writer=image_writer, backend=backend, server_url=server_url)
+    return middle_json, infer_result if keep_model_output else None
+
+
+def _analyze_shard(
+        range_bytes, backend, lang, local_image_dir, parse_method,
+        formula_enable, table_enable, server_url, keep_model_output
+):
+    """Analyze one page shard in a worker process; the parent merges the shards of a checkpoint range"""
+    from mineru.data.data_reader_writer import FileBasedDataWriter
+
+    image_writer = FileBasedDataWriter(local_image_dir)
+    range_middle_json, range_model_output = _analyze_range(
+        backend, range_bytes, lang, image_writer, parse_method,
+        formula_enable, table_enable, server_url, keep_model_output
+    )
+    return {"middle_json": range_middle_json, "model_output": range_model_output}
+
+
+def _thread_budget() -> int:
+    """Cores this process may use: its own thread limit when it runs in a limited worker, else every available core"""
+    limit = os.environ.get("OMP_NUM_THREADS", "")
+    if limit.isdigit() and int(limit) > 0:
+        return int(limit)
+    if hasattr(os, "sched_getaffinity"):
+        return max(1, len(os.sched_getaffinity(0)))
+    return os.cpu_count() or 1
+
+
+def _limit_threads(threads: int):
+    """Process pool initializer capping the OpenMP/BLAS/torch thread pools at the worker's share of the cores"""
+    for name in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[name] = str(threads)
+    torch = sys.modules.get("torch") # Imported later it reads OMP_NUM_THREADS itself
+    if torch is not None:
+        torch.set_num_threads(threads)
+
+
+def _shard_workers(backend: str, requested: int) -> int:
+    """Number of processes for sharded parsing; backends that hold a local VLM engine stay serial"""
+    if backend not in ("pipeline", "http-client"):
+        return 1
+    if requested > 0:
+        return requested
+    if hasattr(os, "sched_getaffinity"):
+        return max(1, len(os.sched_getaffinity(0)))
+    return os.cpu_count() or 1
+
+
+def _merge_ranges(ranges: list, is_pipeline: bool):
+    """Concatenate per-range results, shifting page indices by each range's first page"""
+    middle_json = None
+    model_output = []
+    for range_start, range_middle_json, range_model_output in ranges:
+        for page_info in range_middle_json["pdf_info"]:
+            page_info["page_idx"] += range_start
+        if range_model_output is None:
+            model_output = None
+        elif model_output is not None:
+            if is_pipeline:
+                for page_model in range_model_output:
+                    page_model["page_info"]["page_no"] += range_start
+            model_output.extend(range_model_output)
+        if middle_json is None:
+            middle_json = range_middle_json
+        else:
+            middle_json["pdf_info"].extend(range_middle_json["pdf_info"])
+    return middle_json, model_output
 
 
 def do_parse(
@@ -35,60 +180,185 @@ def do_parse(
     f_dump_model_output=True,  # Whether to dump model output files
     f_dump_orig_pdf=True,  # Whether to dump original PDF files
     f_dump_content_list=True,  # Whether to dump content list files
-    f_make_md_mode=MakeMode.MM_MD,  # The mode for making markdown content, default is MM_MD
+    f_make_md_mode=None,  # The mode for making markdown content, default (None) is MakeMode.MM_MD
     start_page_id=0,  # Start page ID for parsing, default is 0
     end_page_id=None,  # End page ID for parsing, default is None (parse all pages until the end of the document)
+    checkpoint_pages=PARSE_CHECKPOINT_PAGES,  # Pages analyzed per checkpointed range
+    progress_callback=None,  # Called as progress_callback("parse", pages_done, page_count) after each range
+    shard_workers=PARSE_SHARD_WORKERS,  # Processes analyzing page ranges in parallel, 0 means one per core
+    output_profile=PARSE_OUTPUT_PROFILE,  # "full" or "lean", lean overrides the f_* switches above
+    compress_json=PARSE_COMPRESS_JSON,  # Whether the lean profile gzips its JSON output
 ):
+    """
+    Parse each PDF unless a manifest shows byte-identical input was already parsed with the same options.
+    Pages are analyzed in ranges of `checkpoint_pages`; every finished range is saved under
+    `.checkpoints/` so an interrupted parse resumes from the first unfinished range.
+    Checkpoint ranges always start at multiples of `checkpoint_pages`, so a resume with a different number of
+    workers still finds them. With more than one shard worker the pending ranges are split into shards that are
+    analyzed in a process pool, each worker writing images into the shared image dir; a range's checkpoint is
+    saved once all of its shards are done, and the ranges are then merged in page order.
+    Note that paragraphs and tables spanning a shard boundary are not merged across it.
+    The lean profile keeps only the content list and images plus a compressed copy of `pdf_info`,
+    from which `ensure_layout_pdf` renders the layout PDF when it is first previewed.
+    """
+    from mineru.cli.common import convert_pdf_bytes_to_bytes_by_pypdfium2, prepare_env
+    from mineru.data.data_reader_writer import FileBasedDataWriter
+    from mineru.utils.enum_class import MakeMode
 
-    if backend == "pipeline":
-        for idx, pdf_bytes in enumerate(pdf_bytes_list):
-            new_pdf_bytes = convert_pdf_bytes_to_bytes_by_pypdfium2(pdf_bytes, start_page_id, end_page_id)
-            pdf_bytes_list[idx] = new_pdf_bytes
-
-        infer_results, all_image_lists, all_pdf_docs, lang_list, ocr_enabled_list = pipeline_doc_analyze(pdf_bytes_list, p_lang_list, parse_method=parse_method, formula_enable=formula_enable,table_enable=table_enable)
-
-        for idx, model_list in enumerate(infer_results):
-            model_json = copy.deepcopy(model_list)
-            pdf_file_name = pdf_file_names[idx]
-            local_image_dir, local_md_dir = prepare_env(output_dir, pdf_file_name, parse_method)
-            image_writer, md_writer = FileBasedDataWriter(local_image_dir), FileBasedDataWriter(local_md_dir)
-
-            images_list = all_image_lists[idx]
-            pdf_doc = all_pdf_docs[idx]
-            _lang = lang_list[idx]
-            _ocr_enable = ocr_enabled_list[idx]
-            middle_json = pipeline_result_to_middle_json(model_list, images_list, pdf_doc, image_writer, _lang, _ocr_enable, formula_enable)
-
-            pdf_info = middle_json["pdf_info"]
-
-            pdf_bytes = pdf_bytes_list[idx]
-            _process_output(
-                pdf_info, pdf_bytes, pdf_file_name, local_md_dir, local_image_dir,
-                md_writer, f_draw_layout_bbox, f_draw_span_bbox, f_dump_orig_pdf,
-                f_dump_md, f_dump_content_list, f_dump_middle_json, f_dump_model_output,
-                f_make_md_mode, middle_json, model_json, is_pipeline=True
-            )
-    else:
+    if output_profile not in ("full", "lean"):
+        raise ValueError(f"Unknown output profile: {output_profile}")
+    if f_make_md_mode is None:
+        f_make_md_mode = MakeMode.MM_MD
+    lean = output_profile == "lean"
+    if lean:
+        f_draw_layout_bbox = f_draw_span_bbox = f_dump_md = False
+        f_dump_middle_json = f_dump_model_output = f_dump_orig_pdf = False
+        f_dump_content_list = True
+    is_pipeline = backend == "pipeline"
+    if not is_pipeline:
         if backend.startswith("vlm-"):
             backend = backend[4:]
-
         f_draw_span_bbox = False
         parse_method = "vlm"
-        for idx, pdf_bytes in enumerate(pdf_bytes_list):
-            pdf_file_name = pdf_file_names[idx]
-            pdf_bytes = convert_pdf_bytes_to_bytes_by_pypdfium2(pdf_bytes, start_page_id, end_page_id)
-            local_image_dir, local_md_dir = prepare_env(output_dir, pdf_file_name, parse_method)
-            image_writer, md_writer = FileBasedDataWriter(local_image_dir), FileBasedDataWriter(local_md_dir)
-            middle_json, infer_result = vlm_doc_analyze(pdf_bytes, image_writer=image_writer, backend=backend, server_url=server_url)
-
-            pdf_info = middle_json["pdf_info"]
-
-            _process_output(
-                pdf_info, pdf_bytes, pdf_file_name, local_md_dir, local_image_dir,
-                md_writer, f_draw_layout_bbox, f_draw_span_bbox, f_dump_orig_pdf,
-                f_dump_md, f_dump_content_list, f_dump_middle_json, f_dump_model_output,
-                f_make_md_mode, middle_json, infer_result, is_pipeline=False
-            )
+
+    for idx, pdf_bytes in enumerate(pdf_bytes_list):
+        pdf_file_name = pdf_file_names[idx]
+        lang = p_lang_list[idx]
+        options = {
+            "backend": backend,
+            "parse_method": parse_method,
+            "lang": lang if is_pipeline else None,
+            "formula_enable": formula_enable,
+            "table_enable": table_enable,
+            "start_page_id": start_page_id,
+            "end_page_id": end_page_id,
+            "output_profile": output_profile,
+            "compress_json": bool(compress_json) if lean else False,
+        }
+        pdf_sha256 = hashlib.sha256(pdf_bytes).hexdigest()
+        parse_key = _parse_key(pdf_sha256, options)
+        local_image_dir, local_md_dir = prepare_env(output_dir, pdf_file_name, parse_method)
+        if _is_parsed(local_md_dir, pdf_file_name, parse_key):
+            logger.info(f"{pdf_file_name} is unchanged since the last parse, skipping")
+            continue
+        image_writer, md_writer = FileBasedDataWriter(local_image_dir), FileBasedDataWriter(local_md_dir)
+
+        pdf_bytes = convert_pdf_bytes_to_bytes_by_pypdfium2(pdf_bytes, start_page_id, end_page_id)
+        pdf = pdfium.PdfDocument(pdf_bytes)
+        page_count = len(pdf)
+        pdf.close()
+        checkpoint_dir = Path(local_md_dir) / ".checkpoints" / parse_key[:16]
+
+        # Checkpoints cover fixed multiples of checkpoint_pages, so a resume finds them whatever the worker count
+        checkpoints = {}
+        pending = []
+        for range_start in range(0, page_count, checkpoint_pages):
+            range_end = min(range_start + checkpoint_pages, page_count) - 1
+            checkpoint_path = checkpoint_dir / f"{range_start}-{range_end}.json"
+            if checkpoint_path.exists():
+                logger.info(f"{pdf_file_name}: resuming pages {range_start}-{range_end} from checkpoint")
+                with open(checkpoint_path, "r", encoding="utf-8") as f:
+                    checkpoints[range_start] = json.load(f)
+            else:
+                pending.append((range_start, range_end, checkpoint_path))
+
+        pages_done = sum(len(checkpoint["middle_json"]["pdf_info"]) for checkpoint in checkpoints.values())
+        if progress_callback is not None and checkpoints:
+            progress_callback("parse", pages_done, page_count)
+
+        def range_bytes_of(range_start, range_end):
+            if range_start == 0 and range_end == page_count - 1:
+                return pdf_bytes
+            return convert_pdf_bytes_to_bytes_by_pypdfium2(pdf_bytes, range_start, range_end)
+
+        # With several workers each pending checkpoint range is split into shards so every core gets one
+        workers = _shard_workers(backend, shard_workers)
+        pending_pages = sum(range_end - range_start + 1 for range_start, range_end, _ in pending)
+        shard_pages = max(PARSE_MIN_SHARD_PAGES, -(-pending_pages // workers)) if workers > 1 else checkpoint_pages
+        shards = [
+            (range_start, shard_start, min(shard_start + shard_pages, range_end + 1) - 1)
+            for range_start, range_end, _ in pending
+            for shard_start in range(range_start, range_end + 1, shard_pages)
+        ]
+        workers = min(workers, len(shards))
+        # A document analyzed in a single range has nothing to resume, so it skips the (large) checkpoint dump
+        save_checkpoints = len(pending) > 1 or bool(checkpoints)
+        if workers > 1:
+            logger.info(f"{pdf_file_name}: parsing {len(shards)} page shards in {workers} processes")
+            checkpoint_paths = {range_start: checkpoint_path for range_start, _, checkpoint_path in pending}
+            shard_results = {range_start: {} for range_start in checkpoint_paths}
+            shard_counts = {range_start: 0 for range_start in checkpoint_paths}
+            for range_start, _, _ in shards:
+                shard_counts[range_start] += 1
+            # Spawned workers do not inherit the parent's threads or loaded models; each gets its share of the cores
+            with ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                initializer=_limit_threads, initargs=(max(1, _thread_budget() // workers),)
+            ) as executor:
+                futures = {
+                    executor.submit(
+                        _analyze_shard, range_bytes_of(shard_start, shard_end),
+                        backend, lang, local_image_dir, parse_method,
+                        formula_enable, table_enable, server_url, f_dump_model_output
+                    ): (range_start, shard_start, shard_end)
+                    for range_start, shard_start, shard_end in shards
+                }
+                try:
+                    for future in as_completed(futures):
+                        range_start, shard_start, shard_end = futures[future]
+                        results = shard_results[range_start]
+                        results[shard_start] = future.result()
+                        if len(results) == shard_counts[range_start]:
+                            # Every shard of the checkpoint range is done: merge them and save the checkpoint
+                            middle_json, model_output = _merge_ranges([
+                                (start - range_start, results[start]["middle_json"], results[start]["model_output"])
+                                for start in sorted(results)
+                            ], is_pipeline)
+                            checkpoints[range_start] = {"middle_json": middle_json, "model_output": model_output}
+                            if save_checkpoints:
+                                _write_json_atomic(checkpoint_paths[range_start], checkpoints[range_start])
+                        pages_done += shard_end - shard_start + 1
+                        if progress_callback is not None:
+                            progress_callback("parse", pages_done, page_count)
+                except BaseException:
+                    for future in futures:
+                        future.cancel()
+                    raise
+        else:
+            for range_start, range_end, checkpoint_path in pending:
+                range_middle_json, range_model_output = _analyze_range(
+                    backend, range_bytes_of(range_start, range_end), lang, image_writer, parse_method,
+                    formula_enable, table_enable, server_url, f_dump_model_output
+                )
+                checkpoints[range_start] = {"middle_json": range_middle_json, "model_output": range_model_output}
+                if save_checkpoints:
+                    _write_json_atomic(checkpoint_path, checkpoints[range_start])
+                pages_done += range_end - range_start + 1
+                if progress_callback is not None:
+                    progress_callback("parse", pages_done, page_count)
+
+        ranges = [
+            (range_start, checkpoints[range_start]["middle_json"], checkpoints[range_start]["model_output"])
+            for range_start in sorted(checkpoints)
+        ]
+        middle_json, model_output = _merge_ranges(ranges, is_pipeline)
+        pdf_info = middle_json["pdf_info"]
+
+        _process_output(
+            pdf_info, pdf_bytes, pdf_file_name, local_md_dir, local_image_dir,
+            md_writer, f_draw_layout_bbox, f_draw_span_bbox, f_dump_orig_pdf,
+            f_dump_md, f_dump_content_list, f_dump_middle_json, f_dump_model_output,
+            f_make_md_mode, middle_json, model_output, is_pipeline=is_pipeline,
+            lean=lean, compress_json=compress_json
+        )
+
+        _write_json_atomic(Path(local_md_dir) / PARSE_MANIFEST_NAME, {
+            "parse_key": parse_key,
+            "pdf_sha256": pdf_sha256,
+            "options": options,
+            "page_count": page_count,
+        }, indent=4)
+        shutil.rmtree(Path(local_md_dir) / ".checkpoints", ignore_errors=True)
 
 
 def _process_output(
@@ -108,9 +378,21 @@ def _process_output(
         f_make_md_mode,
         middle_json,
         model_output=None,
-        is_pipeline=True
+        is_pipeline=True,
+        lean=False,
+        compress_json=False
 ):
     """处理输出文件"""
+    from mineru.utils.draw_bbox import draw_layout_bbox, draw_span_bbox
+    from mineru.utils.enum_class import MakeMode
+    from mineru.backend.pipeline.pipeline_middle_json_mkcontent import union_make as pipeline_union_make
+    from mineru.backend.vlm.vlm_middle_json_mkcontent import union_make as vlm_union_make
+
+    if lean:
+        # 版面PDF在预览时由ensure_layout_pdf按需生成, 这里只保存绘制所需的pdf_info
+        Path(local_md_dir, f"{pdf_file_name}_layout.pdf").unlink(missing_ok=True)
+        _write_json_output(Path(local_md_dir), f"{pdf_file_name}_pdf_info", pdf_info, compress_json)
+
     if f_draw_layout_bbox:
         draw_layout_bbox(pdf_info, pdf_bytes, local_md_dir, f"{pdf_file_name}_layout.pdf")
 
@@ -136,10 +418,14 @@ def _process_output(
     if f_dump_content_list:
         make_func = pipeline_union_make if is_pipeline else vlm_union_make
         content_list = make_func(pdf_info, MakeMode.CONTENT_LIST, image_dir)
-        md_writer.write_string(
-            f"{pdf_file_name}_content_list.json",
-            json.dumps(content_list, ensure_ascii=False, indent=4),
-        )
+        if lean:
+            _write_json_output(Path(local_md_dir), f"{pdf_file_name}_content_list", content_list, compress_json)
+        else:
+            Path(local_md_dir, f"{pdf_file_name}_content_list.json.gz").unlink(missing_ok=True)
+            md_writer.write_string(
+                f"{pdf_file_name}_content_list.json",
+                json.dumps(content_list, ensure_ascii=False, indent=4),
+            )
 
     if f_dump_middle_json:
         md_writer.write_string(
@@ -156,6 +442,49 @@ def _process_output(
     logger.info(f"local output dir is {local_md_dir}")
 
 
+def _write_json_output(local_md_dir: Path, stem: str, obj, compress_json: bool):
+    """Write `<stem>.json.gz` or compact `<stem>.json`, removing the other variant left by an earlier parse"""
+    if compress_json:
+        _write_json_gz_atomic(local_md_dir / f"{stem}.json.gz", obj)
+        (local_md_dir / f"{stem}.json").unlink(missing_ok=True)
+    else:
+        _write_json_atomic(local_md_dir / f"{stem}.json", obj)
+        (local_md_dir / f"{stem}.json.gz").unlink(missing_ok=True)
+
+
+def _read_json_output(local_md_dir: Path, stem: str):
+    """Read `<stem>.json.gz` or `<stem>.json`, whichever exists"""
+    gz_path = local_md_dir / f"{stem}.json.gz"
+    if gz_path.exists():
+        with gzip.open(gz_path, "rt", encoding="utf-8") as f:
+            return json.load(f)
+    with open(local_md_dir / f"{stem}.json", "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def ensure_layout_pdf(local_md_dir, pdf_file_name: str, pdf_path) -> Path:
+    """
+    Return the layout PDF of a parse, rendering it from the saved `pdf_info` if the lean profile skipped it.
+    `pdf_path` is the parsed source PDF; it must be byte-identical to what the manifest recorded.
+    """
+    local_md_dir = Path(local_md_dir)
+    layout_path = local_md_dir / f"{pdf_file_name}_layout.pdf"
+    if layout_path.exists():
+        return layout_path
+    from mineru.cli.common import convert_pdf_bytes_to_bytes_by_pypdfium2, read_fn
+    from mineru.utils.draw_bbox import draw_layout_bbox
+
+    manifest = json.loads((local_md_dir / PARSE_MANIFEST_NAME).read_text(encoding="utf-8"))
+    pdf_bytes = read_fn(Path(pdf_path))
+    if hashlib.sha256(pdf_bytes).hexdigest() != manifest["pdf_sha256"]:
+        raise ValueError(f"{pdf_path} has changed since it was parsed")
+    options = manifest["options"]
+    pdf_bytes = convert_pdf_bytes_to_bytes_by_pypdfium2(pdf_bytes, options["start_page_id"], options["end_page_id"])
+    pdf_info = _read_json_output(local_md_dir, f"{pdf_file_name}_pdf_info")
+    draw_layout_bbox(pdf_info, pdf_bytes, str(local_md_dir), layout_path.name)
+    return layout_path
+
+
 def parse_doc(
         path_list: list[Path],
         output_dir,
@@ -164,7 +493,10 @@ def parse_doc(
         method="auto",
         server_url=None,
         start_page_id=0,
-        end_page_id=None
+        end_page_id=None,
+        progress_callback=None,
+        output_profile=PARSE_OUTPUT_PROFILE,
+        shard_workers=PARSE_SHARD_WORKERS
 ):
     """
         Parameter description:
@@ -188,7 +520,12 @@ def parse_doc(
         server_url: When the backend is `http-client`, you need to specify the server_url, for example:`http://127.0.0.1:30000`
         start_page_id: Start page ID for parsing, default is 0
         end_page_id: End page ID for parsing, default is None (parse all pages until the end of the document)
+        progress_callback: Optional callable receiving ("parse", pages_done, page_count) after each parsed page range
+        output_profile: "full" writes every MinerU artifact, "lean" only the content list and images for ingestion
+        shard_workers: Processes analyzing page ranges in parallel, 0 means one per available core
     """
+    from mineru.cli.common import read_fn
+
     try:
         file_name_list = []
         pdf_bytes_list = []
@@ -208,12 +545,17 @@ def parse_doc(
             parse_method=method,
             server_url=server_url,
             start_page_id=start_page_id,
-            end_page_id=end_page_id
+            end_page_id=end_page_id,
+            progress_callback=progress_callback,
+            output_profile=output_profile,
+            shard_workers=shard_workers
         )
     except Exception as e:
         logger.exception(e)
 
 if __name__ == '__main__':
+    from mineru.utils.guess_suffix_or_lang import guess_suffix_by_path
+
     # args
     __dir__ = os.path.dirname(os.path.abspath(__file__))
     pdf_files_dir = os.path.join(__dir__, "../pdf_docs")
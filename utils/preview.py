@@ -0,0 +1,65 @@
+'''
+PDF页面预览: 只渲染选中的那一页, 按预览分辨率生成的缩略图以(PDF哈希, 页码, DPI)为键缓存在磁盘上,
+同一页再次预览时直接读盘, 不再重新光栅化
+'''
+import io
+import os
+import hashlib
+import threading
+from functools import lru_cache
+
+from pdf2image import convert_from_path, pdfinfo_from_path
+
+from .cache import DiskLRUCache, cache_dir
+
+preview_dpi          = int(os.getenv("PREVIEW_DPI", "80"))
+preview_cache_max_mb = float(os.getenv("PREVIEW_CACHE_MAX_MB", "128"))
+
+_thumbnail_cache = None
+_thumbnail_cache_lock = threading.Lock()
+
+
+def get_thumbnail_cache() -> DiskLRUCache:
+    '''
+    缩略图缓存, 创建时要扫描缓存目录, 第一次预览时才创建, 不拖慢页面启动
+    '''
+    global _thumbnail_cache
+    with _thumbnail_cache_lock:
+        if _thumbnail_cache is None:
+            _thumbnail_cache = DiskLRUCache(cache_dir / "previews", max_bytes=int(preview_cache_max_mb * 1024 * 1024))
+        return _thumbnail_cache
+
+@lru_cache(maxsize=256)
+def _pdf_hash(pdf_path: str, mtime_ns: int, size: int) -> str:
+    digest = hashlib.sha256()
+    with open(pdf_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+@lru_cache(maxsize=256)
+def _page_count(pdf_path: str, mtime_ns: int, size: int) -> int:
+    return int(pdfinfo_from_path(pdf_path)["Pages"])
+
+def page_count(pdf_path: str) -> int:
+    '''
+    PDF的页数, 只读取文件信息不渲染页面, 以(路径, mtime, 大小)为键缓存在内存中
+    '''
+    stat = os.stat(pdf_path)
+    return _page_count(str(pdf_path), stat.st_mtime_ns, stat.st_size)
+
+def render_page(pdf_path: str, page: int, dpi: int = preview_dpi) -> bytes:
+    '''
+    渲染PDF的第page页(从1开始)为JPEG缩略图, 已渲染过的页面直接从磁盘缓存读取
+    '''
+    stat = os.stat(pdf_path)
+    key = f"{_pdf_hash(str(pdf_path), stat.st_mtime_ns, stat.st_size)}-{page}-{dpi}"
+    thumbnail_cache = get_thumbnail_cache()
+    thumbnail = thumbnail_cache.get(key)
+    if thumbnail is None:
+        image = convert_from_path(pdf_path, dpi=dpi, first_page=page, last_page=page)[0]
+        buffer = io.BytesIO()
+        image.convert("RGB").save(buffer, format="JPEG", quality=85)
+        thumbnail = buffer.getvalue()
+        thumbnail_cache.set(key, thumbnail)
+    return thumbnail
@@ -0,0 +1,79 @@
+import time
+import asyncio
+import threading
+
+
+class TokenBucket:
+    '''
+    令牌桶限流器, rate为每秒补充的令牌数, capacity为桶容量(允许的突发请求数)
+    rate <= 0 时不限流
+    '''
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def acquire(self, tokens: float = 1.0):
+        '''
+        阻塞直到取到令牌
+        '''
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+
+class Overloaded(Exception):
+    '''
+    等待的请求过多或等待超时, 调用方应稍后重试
+    '''
+    pass
+
+class ConcurrencyLimiter:
+    '''
+    asyncio并发限制: 同时最多max_concurrency个请求访问上游模型, 最多max_pending个请求排队等待
+    排队已满或等待超过timeout(秒)时抛出Overloaded, 把压力反馈给客户端而不是无限堆积
+    用法: async with limiter: ...
+    '''
+    def __init__(self, max_concurrency: int, max_pending: int, timeout: float = None):
+        self.max_concurrency = max_concurrency
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.active = 0
+        self.pending = 0
+
+    async def acquire(self):
+        if self._semaphore.locked() and self.pending >= self.max_pending:
+            raise Overloaded(f"排队的请求已达上限{self.max_pending}")
+        self.pending += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            raise Overloaded(f"等待超过{self.timeout}秒")
+        finally:
+            self.pending -= 1
+        self.active += 1
+
+    def release(self):
+        self.active -= 1
+        self._semaphore.release()
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.release()
@@ -0,0 +1,132 @@
+'''
+进程内共享的资源注册表, Streamlit每次rerun和每个新会话都复用同一份
+ChromaDB客户端、VectorStoreIndex和检索器, 不再重复打开SQLite/HNSW文件
+
+每个集合的版本号记录在persist_dir/index_versions.json中, build_corpus写入后递增,
+其他进程(如后台入库任务)写入后, 本进程下一次获取资源时会发现版本变化并重新加载
+'''
+import os
+import json
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from .cache import atomic_write
+
+VERSIONS_FILE = "index_versions.json"
+
+_lock = threading.RLock() # 保护下面的字典, 创建资源(耗时)时不持有
+_resource_locks: Dict[Tuple[str, str, str], threading.Lock] = {} # 每个资源一把锁, 同一资源只创建一次
+_generation = 0 # invalidate时递增, 创建期间被清除的资源不再写入缓存
+_clients: Dict[str, Tuple[float, Any]] = {} # persist_dir -> (创建时版本文件的mtime, 客户端)
+_resources: Dict[Tuple[str, str, str], Tuple[int, Any]] = {} # (persist_dir, 集合, 类型) -> (版本号, 资源)
+_versions: Dict[str, Tuple[float, dict]] = {} # persist_dir -> (mtime, 各集合版本号)
+
+
+def _versions_mtime(persist_dir: str) -> float:
+    try:
+        return os.stat(Path(persist_dir) / VERSIONS_FILE).st_mtime_ns
+    except FileNotFoundError:
+        return 0
+
+def _load_versions(persist_dir: str) -> dict:
+    mtime = _versions_mtime(persist_dir)
+    cached = _versions.get(persist_dir)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    try:
+        versions = json.loads((Path(persist_dir) / VERSIONS_FILE).read_text())
+    except (FileNotFoundError, ValueError):
+        versions = {}
+    _versions[persist_dir] = (mtime, versions)
+    return versions
+
+def _close_client(client):
+    '''
+    关闭客户端并停止它的底层系统(SQLite连接、HNSW索引), 下次打开同一路径时重新读取
+    '''
+    from chromadb.api.client import SharedSystemClient
+
+    if hasattr(client, "close"):
+        client.close()
+        return
+    # 旧版本的chromadb没有close, 只停止并移除这个路径的系统, 不影响其他路径的客户端
+    system = SharedSystemClient._identifier_to_system.pop(client._identifier, None)
+    if system is not None:
+        system.stop()
+
+def get_chroma_client(persist_dir: Path):
+    '''
+    获取persist_dir对应的ChromaDB客户端, 其他进程写入过集合时重新打开
+    '''
+    import chromadb # 导入约需1秒, 只在第一次打开集合时导入
+
+    key = str(persist_dir)
+    with _lock:
+        mtime = _versions_mtime(key)
+        cached = _clients.get(key)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        if cached is not None:
+            # chromadb按路径缓存底层系统, 需要关闭旧客户端才能读到其他进程写入的数据
+            # 基于旧客户端创建的资源也一并清除
+            invalidate(persist_dir)
+            _close_client(cached[1])
+        client = chromadb.PersistentClient(path=key)
+        _clients[key] = (mtime, client)
+        return client
+
+def index_version(persist_dir: Path, collection: str) -> int:
+    '''
+    集合当前的版本号, 每次build_corpus写入后递增
+    '''
+    with _lock:
+        return _load_versions(str(persist_dir)).get(collection, 0)
+
+def bump_index_version(persist_dir: Path, collection: str) -> int:
+    '''
+    集合写入后调用: 递增版本号并让该集合已缓存的资源失效
+    '''
+    key = str(persist_dir)
+    with _lock:
+        versions = dict(_load_versions(key))
+        versions[collection] = versions.get(collection, 0) + 1
+        atomic_write(Path(key) / VERSIONS_FILE, json.dumps(versions, ensure_ascii=False).encode("utf-8"))
+        _versions[key] = (_versions_mtime(key), versions)
+        # 本进程写入的数据客户端已经可见, 只需更新记录的mtime
+        if key in _clients:
+            _clients[key] = (_versions[key][0], _clients[key][1])
+        invalidate(persist_dir, collection)
+        return versions[collection]
+
+def get_resource(persist_dir: Path, collection: str, kind: str, factory: Callable[[], Any]) -> Any:
+    '''
+    获取缓存的资源(如"index"、"retriever"), 不存在或集合版本已变化时调用factory创建
+    factory在该资源自己的锁内执行: 同一资源并发请求时只创建一次, 不阻塞其他集合和其他资源
+    '''
+    key = (str(persist_dir), collection, kind)
+    with _lock:
+        resource_lock = _resource_locks.setdefault(key, threading.Lock())
+    with resource_lock:
+        with _lock:
+            version = index_version(persist_dir, collection)
+            cached = _resources.get(key)
+            if cached is not None and cached[0] == version:
+                return cached[1]
+            generation = _generation
+        resource = factory()
+        with _lock:
+            if resource is not None and generation == _generation:
+                _resources[key] = (version, resource)
+        return resource
+
+def invalidate(persist_dir: Path, collection: Optional[str] = None):
+    '''
+    清除persist_dir下某个集合(或全部集合)缓存的资源
+    '''
+    global _generation
+    with _lock:
+        _generation += 1
+        for key in list(_resources):
+            if key[0] == str(persist_dir) and (collection is None or key[1] == collection):
+                del _resources[key]
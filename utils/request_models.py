@@ -1,7 +1,10 @@
 import os
-from openai import OpenAI
+import time
+import threading
 from dotenv import load_dotenv
 
+from .metrics import span, record, increment
+
 load_dotenv()
 dashscope_api_key               = os.getenv("DASHSCOPE_API_KEY")
 dashscope_base_url              = os.getenv("DASHSCOPE_BASE_URL")
@@ -9,24 +12,157 @@ dashscope_llm_model_name        = os.getenv("DASHSCOPE_LLM_MODEL_NAME")
 dashscope_vlm_model_name        = os.getenv("DASHSCOPE_VLM_MODEL_NAME")
 dashscope_text_embed_model_name = os.getenv("DASHSCOPE_TEXT_EMBED_MODEL_NAME")
 
-client = OpenAI(
-    api_key=dashscope_api_key,
-    base_url=dashscope_base_url,
-)
+_client_lock = threading.Lock()
+_clients = {}
+
+def get_client(asynchronous: bool = False):
+    '''
+    OpenAI兼容客户端, 第一次请求时才导入openai并创建, 导入本模块不需要openai和API key
+    '''
+    with _client_lock:
+        if asynchronous not in _clients:
+            from openai import OpenAI, AsyncOpenAI
+            client_class = AsyncOpenAI if asynchronous else OpenAI
+            _clients[asynchronous] = client_class(api_key=dashscope_api_key, base_url=dashscope_base_url)
+        return _clients[asynchronous]
+
+def _timeout(timeout: float):
+    from openai import NOT_GIVEN
+    return timeout if timeout is not None else NOT_GIVEN
+
+def _client_for(timeout: float, asynchronous: bool = False):
+    '''
+    指定了timeout的请求不重试: 客户端默认重试2次, 超时的请求最多会阻塞约3倍的timeout
+    '''
+    client = get_client(asynchronous)
+    return client.with_options(max_retries=0) if timeout is not None else client
+
+def _count_usage(response):
+    # 开启include_usage时, 流式响应的最后一个片段带有token用量
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        increment("vlm_prompt_tokens", usage.prompt_tokens or 0)
+        increment("vlm_completion_tokens", usage.completion_tokens or 0)
+
+def _record_stream(stream):
+    if stream.time_to_first_token is not None:
+        record("vlm_first_token", stream.time_to_first_token)
+    record("vlm_stream", stream.total_latency)
+
+class VLMStream:
+    '''
+    VLM流式响应, 迭代得到文本片段
+    time_to_first_token/total_latency 记录首个片段和整个响应的耗时(秒)
+    提前停止迭代或调用close()都会关闭上游连接
+    '''
+    def __init__(self, stream, start_time: float):
+        self._stream = stream
+        self._start_time = start_time
+        self.time_to_first_token = None
+        self.total_latency = None
+
+    def __iter__(self):
+        try:
+            for chunk in self._stream:
+                _count_usage(chunk)
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    if self.time_to_first_token is None:
+                        self.time_to_first_token = time.perf_counter() - self._start_time
+                    yield delta
+        finally:
+            self.close()
+
+    def close(self):
+        if self.total_latency is None:
+            self.total_latency = time.perf_counter() - self._start_time
+            self._stream.close()
+            _record_stream(self)
+
+class AsyncVLMStream:
+    '''
+    VLMStream的异步版本, 用async for迭代
+    '''
+    def __init__(self, stream, start_time: float):
+        self._stream = stream
+        self._start_time = start_time
+        self.time_to_first_token = None
+        self.total_latency = None
+
+    async def __aiter__(self):
+        try:
+            async for chunk in self._stream:
+                _count_usage(chunk)
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    if self.time_to_first_token is None:
+                        self.time_to_first_token = time.perf_counter() - self._start_time
+                    yield delta
+        finally:
+            await self.aclose()
+
+    async def aclose(self):
+        if self.total_latency is None:
+            self.total_latency = time.perf_counter() - self._start_time
+            await self._stream.close()
+            _record_stream(self)
 
 def request_vlm(
     system_content: dict,
-    user_content: dict
+    user_content: dict,
+    timeout: float = None
 ) -> str:
-    #TODO(wangjintao): 支持流式响应
-    completion = client.chat.completions.create(
+    with span("vlm_request"):
+        completion = _client_for(timeout).chat.completions.create(
+            model=dashscope_vlm_model_name,
+            messages=[
+                system_content,
+                user_content
+            ],
+            timeout=_timeout(timeout),
+        )
+    _count_usage(completion)
+    return completion.choices[0].message.content
+
+def request_vlm_stream(
+    system_content: dict,
+    user_content: dict,
+    timeout: float = None
+) -> VLMStream:
+    start_time = time.perf_counter()
+    stream = _client_for(timeout).chat.completions.create(
         model=dashscope_vlm_model_name,
         messages=[
             system_content,
             user_content
         ],
+        stream=True,
+        stream_options={"include_usage": True},
+        timeout=_timeout(timeout),
     )
-    return completion.choices[0].message.content
+    return VLMStream(stream, start_time)
+
+async def arequest_vlm_stream(
+    system_content: dict,
+    user_content: dict,
+    timeout: float = None
+) -> AsyncVLMStream:
+    start_time = time.perf_counter()
+    stream = await _client_for(timeout, asynchronous=True).chat.completions.create(
+        model=dashscope_vlm_model_name,
+        messages=[
+            system_content,
+            user_content
+        ],
+        stream=True,
+        stream_options={"include_usage": True},
+        timeout=_timeout(timeout),
+    )
+    return AsyncVLMStream(stream, start_time)
 
 def request_llm():
-    pass
\ No newline at end of file
+    pass
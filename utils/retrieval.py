@@ -1,9 +1,24 @@
-import base64
-from typing import List
-from llama_index.core.schema import BaseNode
+import os
+import time
+import asyncio
+from typing import Dict, List, Tuple, Union
+from concurrent.futures import ThreadPoolExecutor, wait
+from llama_index.core.schema import BaseNode, NodeWithScore, QueryBundle
 from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.vector_stores.types import BasePydanticVectorStore, VectorStoreQuery
+from llama_index.core.base.embeddings.base import BaseEmbedding
 
-from .request_models import request_vlm
+from .image_payload import image_data_url
+from .context import assemble_context
+from .metrics import span, increment
+from .lexical import BM25Index
+from .request_models import request_vlm, request_vlm_stream, arequest_vlm_stream, VLMStream, AsyncVLMStream
+
+NO_ANSWER = "未找到相关答案"
+
+retrieval_latency_budget = float(os.getenv("RETRIEVAL_LATENCY_BUDGET", "3"))
+# 跨集合检索共用的线程池
+_fanout_executor = ThreadPoolExecutor(max_workers=int(os.getenv("RETRIEVAL_MAX_WORKERS", "8")))
 
 SYSTEM_PROMPT = """You are a multimodal reasoning assistant.
 You are given the following inputs:
@@ -21,35 +36,201 @@ Your task is to:
 - Use reasoning that is faithful to the provided contexts; do not hallucinate unsupported details.
 """
 
+class HybridRetriever(BaseRetriever):
+    '''
+    向量检索和BM25字面检索两路召回, 用倒数排名融合(RRF)合并结果
+    '''
+    def __init__(
+        self,
+        vector_retriever: BaseRetriever,
+        lexical_index: BM25Index,
+        vector_store: BasePydanticVectorStore,
+        similarity_top_k: int = 5,
+        rrf_k: int = 60
+    ):
+        super().__init__()
+        self._vector_retriever = vector_retriever
+        self._lexical_index = lexical_index
+        self._vector_store = vector_store
+        self._similarity_top_k = similarity_top_k
+        self._rrf_k = rrf_k
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        vector_hits = self._vector_retriever.retrieve(query_bundle)
+        lexical_hits = self._lexical_index.search(query_bundle.query_str, top_k=self._similarity_top_k)
+
+        fused_scores = {}
+        for rank, node_id in enumerate([hit.node.node_id for hit in vector_hits]):
+            fused_scores[node_id] = fused_scores.get(node_id, 0.0) + 1.0 / (self._rrf_k + rank + 1)
+        for rank, (node_id, _) in enumerate(lexical_hits):
+            fused_scores[node_id] = fused_scores.get(node_id, 0.0) + 1.0 / (self._rrf_k + rank + 1)
+        top_ids = sorted(fused_scores, key=fused_scores.get, reverse=True)[:self._similarity_top_k]
+
+        # 只在字面检索中命中的节点需要从向量库中取出
+        nodes = {hit.node.node_id: hit.node for hit in vector_hits}
+        missing_ids = [node_id for node_id in top_ids if node_id not in nodes]
+        if missing_ids:
+            nodes.update({node.node_id: node for node in self._vector_store.get_nodes(node_ids=missing_ids)})
+        return [NodeWithScore(node=nodes[node_id], score=fused_scores[node_id]) for node_id in top_ids if node_id in nodes]
+
+class MultiCollectionRetriever(BaseRetriever):
+    '''
+    跨多个集合的检索器: 查询只嵌入一次, 并发查询各集合的向量库(有BM25索引的集合同时做字面检索)
+    各集合使用同一个嵌入模型, 余弦相似度可以直接比较: 向量命中按原始相似度合并排序,
+    有字面检索时再与各集合的BM25排名一起做倒数排名融合(RRF), 与单集合的HybridRetriever一致
+    超过latency_budget(秒)仍未返回的集合会被跳过
+    '''
+    def __init__(
+        self,
+        vector_stores: Dict[str, BasePydanticVectorStore],
+        embed_model: BaseEmbedding,
+        similarity_top_k: int = 5,
+        latency_budget: float = retrieval_latency_budget,
+        lexical_indexes: Dict[str, BM25Index] = None,
+        rrf_k: int = 60
+    ):
+        super().__init__()
+        self._vector_stores = vector_stores
+        self._embed_model = embed_model
+        self._similarity_top_k = similarity_top_k
+        self._latency_budget = latency_budget
+        self._lexical_indexes = lexical_indexes or {}
+        self._rrf_k = rrf_k
+
+    def _search_collection(self, name: str, query: VectorStoreQuery, query_str: str):
+        '''
+        在一个集合中检索, 返回(向量检索结果, BM25命中的(节点ID, 分数)列表)
+        '''
+        result = self._vector_stores[name].query(query)
+        lexical_index = self._lexical_indexes.get(name)
+        lexical_hits = lexical_index.search(query_str, top_k=self._similarity_top_k) if lexical_index is not None else []
+        return result, lexical_hits
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        deadline = time.monotonic() + self._latency_budget
+        query_embedding = self._embed_model.get_query_embedding(query_bundle.query_str)
+        query = VectorStoreQuery(query_embedding=query_embedding, similarity_top_k=self._similarity_top_k)
+        futures = {
+            _fanout_executor.submit(self._search_collection, name, query, query_bundle.query_str): name
+            for name in self._vector_stores
+        }
+        done, not_done = wait(futures, timeout=max(0.0, deadline - time.monotonic()))
+        for future in not_done:
+            # 已经开始执行的查询无法中断, 只能丢弃它的结果; 尚未开始的直接取消
+            if not future.cancel():
+                increment("retrieval_late_collections", collection=futures[future])
+            print(f"检索集合{futures[future]}超时, 已跳过")
+
+        vector_hits, lexical_lists, nodes = [], [], {}
+        for future in done:
+            name = futures[future]
+            try:
+                result, lexical_hits = future.result()
+            except Exception as e:
+                print(f"检索集合{name}失败: {e}")
+                continue
+            similarities = result.similarities or [0.0] * len(result.nodes)
+            for node, similarity in zip(result.nodes, similarities):
+                nodes[(name, node.node_id)] = node
+                vector_hits.append(((name, node.node_id), similarity))
+            if lexical_hits:
+                lexical_lists.append((name, [node_id for node_id, _ in lexical_hits]))
+        vector_hits.sort(key=lambda hit: hit[1], reverse=True)
+
+        if not lexical_lists:
+            return [NodeWithScore(node=nodes[key], score=similarity) for key, similarity in vector_hits[:self._similarity_top_k]]
+
+        fused_scores = {}
+        for rank, (key, _) in enumerate(vector_hits):
+            fused_scores[key] = fused_scores.get(key, 0.0) + 1.0 / (self._rrf_k + rank + 1)
+        for name, node_ids in lexical_lists:
+            for rank, node_id in enumerate(node_ids):
+                key = (name, node_id)
+                fused_scores[key] = fused_scores.get(key, 0.0) + 1.0 / (self._rrf_k + rank + 1)
+        top_keys = sorted(fused_scores, key=fused_scores.get, reverse=True)[:self._similarity_top_k]
+
+        # 只在字面检索中命中的节点需要从对应集合的向量库中取出
+        missing = {}
+        for name, node_id in top_keys:
+            if (name, node_id) not in nodes:
+                missing.setdefault(name, []).append(node_id)
+        for name, node_ids in missing.items():
+            for node in self._vector_stores[name].get_nodes(node_ids=node_ids):
+                nodes[(name, node.node_id)] = node
+        return [NodeWithScore(node=nodes[key], score=fused_scores[key]) for key in top_keys if key in nodes]
+
 def retrieve(query: str, retriever: BaseRetriever) -> List[BaseNode]:
-    # TODO(wangjintao): 可以实现多路召回, HyDE等思路
-    nodes = retriever.retrieve(query)
+    # TODO(wangjintao): 可以实现HyDE等思路, 多路召回见HybridRetriever
+    with span("retrieve"):
+        nodes = retriever.retrieve(query)
+    increment("retrieved_nodes", len(nodes))
     return nodes
 
-def synthesis_response(query: str, nodes: List[BaseNode]) -> str:
-    if len(nodes) < 1:
-        return "未找到相关答案"
-
-    text_context = ""
+def _build_messages(
+    query: str,
+    nodes: List[BaseNode],
+    query_embedding: List[float] = None
+) -> Tuple[dict, dict]:
+    '''
+    由检索到的节点构建VLM请求的system和user消息, 上下文按token和图片预算组装
+    '''
+    with span("context_assembly"):
+        text_parts, image_paths, stats = assemble_context(nodes, query_embedding=query_embedding)
+    increment("context_tokens", stats["tokens_after"])
+    increment("context_tokens_saved", stats["tokens_saved"])
+    increment("context_images", stats["images_after"])
+    print(
+        f"上下文: {stats['nodes']}个节点, 去重{stats['duplicates_dropped']}个, 裁剪表格{stats['tables_trimmed']}个, "
+        f"token {stats['tokens_before']} -> {stats['tokens_after']} (节省{stats['tokens_saved']}), "
+        f"图片 {stats['images_before']} -> {stats['images_after']}"
+    )
+    text_context = "".join(text + "\n" for text in text_parts) # 构建文本上下文
     user_content = {
         "role": "user",
         "content": [
             {"type": "text", "text": query}
         ]
     }
-    for node in nodes:
-        if node.metadata["content_type"] in ("text", "equation", "table"):
-            text_context = text_context + node.text + "\n" # 构建文本上下文
-        elif node.metadata["content_type"] == ("image"):
-            image_path = node.metadata["image_path"] # 构建图片上下文
-            with open(image_path, "rb") as f:
-                img_b64 = base64.b64encode(f.read()).decode("utf-8")
-                user_content["content"].append({"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{img_b64}"}})
+    for image_path in image_paths: # 构建图片上下文, 使用缩小后的派生图片
+        user_content["content"].append({"type": "image_url", "image_url": {"url": image_data_url(image_path)}})
 
     system_content = {
         "role": "system",
         "content": [{"type": "text","text": SYSTEM_PROMPT.format(query=query, text_context=text_context)}]
     }
+    return system_content, user_content
 
+def synthesis_response(
+    query: str,
+    nodes: List[BaseNode],
+    stream: bool = False,
+    query_embedding: List[float] = None
+) -> Union[str, VLMStream]:
+    '''
+    生成回答, stream为True时返回可迭代的VLMStream
+    节点带有嵌入时按MMR去重组装上下文, query_embedding用作相关性, 不传时使用检索得分
+    '''
+    if len(nodes) < 1:
+        return NO_ANSWER
+
+    system_content, user_content = _build_messages(query, nodes, query_embedding)
+    if stream:
+        return request_vlm_stream(system_content=system_content, user_content=user_content)
     response = request_vlm(system_content=system_content, user_content=user_content)
-    return response
\ No newline at end of file
+    return response
+
+async def asynthesis_response_stream(
+    query: str,
+    nodes: List[BaseNode],
+    query_embedding: List[float] = None
+) -> Union[str, AsyncVLMStream]:
+    '''
+    synthesis_response的异步流式版本
+    '''
+    if len(nodes) < 1:
+        return NO_ANSWER
+
+    system_content, user_content = await asyncio.to_thread( # 读图片不阻塞事件循环
+        _build_messages, query, nodes, query_embedding
+    )
+    return await arequest_vlm_stream(system_content=system_content, user_content=user_content)
@@ -0,0 +1,102 @@
+'''
+service.py的HTTP客户端, Streamlit页面设置SERVICE_URL后通过它调用服务, 页面进程不再加载索引和模型
+'''
+import json
+import time
+from pathlib import Path
+from typing import List, Optional
+
+import httpx
+
+
+class ServiceError(Exception):
+    pass
+
+class ServiceAnswerStream:
+    '''
+    服务端的流式回答, 迭代得到文本片段, 接口与VLMStream一致
+    迭代结束后cached/latency/nodes为服务端返回的信息
+    '''
+    def __init__(self, response: httpx.Response, start_time: float):
+        self._response = response
+        self._start_time = start_time
+        self.time_to_first_token = None
+        self.total_latency = None
+        self.cached = False
+        self.nodes = []
+        self.latency = []
+
+    def __iter__(self):
+        try:
+            for line in self._response.iter_lines():
+                if not line:
+                    continue
+                message = json.loads(line)
+                if message["type"] == "nodes":
+                    self.nodes = message["nodes"]
+                elif message["type"] == "delta":
+                    if self.time_to_first_token is None:
+                        self.time_to_first_token = time.perf_counter() - self._start_time
+                    yield message["text"]
+                elif message["type"] == "done":
+                    self.cached = message["cached"]
+                    self.latency = message["latency"]
+                elif message["type"] == "error":
+                    raise ServiceError(message["error"])
+        finally:
+            self.close()
+
+    def close(self):
+        if self.total_latency is None:
+            self.total_latency = time.perf_counter() - self._start_time
+            self._response.close()
+
+class ServiceClient:
+    def __init__(self, base_url: str, timeout: float = 300):
+        self._client = httpx.Client(base_url=base_url.rstrip("/"), timeout=timeout)
+
+    def _request(self, method: str, path: str, **kwargs) -> dict:
+        response = self._client.request(method, path, **kwargs)
+        if response.status_code >= 400:
+            try:
+                message = response.json().get("error")
+            except ValueError:
+                message = response.text
+            raise ServiceError(f"{response.status_code}: {message}")
+        return response.json()
+
+    def list_collections(self) -> List[str]:
+        return self._request("GET", "/collections")["collections"]
+
+    def query_stream(self, query: str, collections: List[str], top_k: int = 5) -> ServiceAnswerStream:
+        start_time = time.perf_counter()
+        request = self._client.build_request(
+            "POST", "/query", json={"query": query, "collections": collections, "top_k": top_k, "stream": True}
+        )
+        response = self._client.send(request, stream=True)
+        if response.status_code >= 400:
+            response.read()
+            response.close()
+            raise ServiceError(f"{response.status_code}: {response.text}")
+        return ServiceAnswerStream(response, start_time)
+
+    def ingest(self, file_name: str, content: bytes) -> dict:
+        '''
+        上传PDF并提交入库任务, 返回{"job_id", "output_path"}
+        '''
+        return self._request(
+            "POST", "/ingest", params={"name": Path(file_name).name}, content=content,
+            headers={"Content-Type": "application/pdf"}
+        )
+
+    def list_jobs(self, limit: int = 20) -> List[dict]:
+        return self._request("GET", "/jobs", params={"limit": limit})["jobs"]
+
+    def get_job(self, job_id: str) -> Optional[dict]:
+        try:
+            return self._request("GET", f"/jobs/{job_id}")
+        except ServiceError:
+            return None
+
+    def cancel(self, job_id: str):
+        self._request("DELETE", f"/jobs/{job_id}")